@@ -26,6 +26,7 @@
 '''
 from copy import deepcopy
 from pyvolve import newick
+from pyvolve.genetics import Genetics
 from Bio import AlignIO
 import numpy as np
 import sys
@@ -178,38 +179,20 @@ class CalcOverBranch(object):
             Argument "codon" is the sense codon of interest.
         '''
     
-        codon = codon.upper()
-        source_aa = self.translation_dict[codon]
+        molecules = Genetics()
+        source = molecules.codon_index[codon.upper()]
     
-        # Determine which sense codons are a single nucleotide change from input argument, codon
-        # One list for nonsyn and one list for syn
-        n_sites = 0.
-        s_sites  = 0.
-    
-        for i in range(3):
-            s_numer = 0.
-            n_numer = 0.
-            denom = 0.
-            for n in self.nucleotides:
-                if codon[i] != n:
-            
-                    target = codon[0:i] + n + codon[i+1:3]
-                    if target not in self.stop_codons:
-                        target_aa = self.translation_dict[target]
-                    
-                        # Evaluate syn, nonsyn
-                        if source_aa == target_aa:
-                            s_numer += self.B[codon[i] + n]
-                        else:
-                            n_numer += self.B[codon[i] + n]
-                        denom += self.B[codon[i] + n]        
-
-            # Tally if there were changes
-            if s_numer > 0.:
-                s_sites += s_numer/denom 
-            if n_numer > 0:
-                n_sites += n_numer/denom
-
+        # Weight each sense codon a single nucleotide change away by the probability of that change, and tally weights by the position changed
+        B = np.array([self.B.get(n1 + n2, 0.) for n1 in self.nucleotides for n2 in self.nucleotides])
+        weights = B[ molecules.codon_nuc_pair[source] ] * (molecules.codon_num_diff[source] == 1)
+        positions = molecules.codon_diff_positions[source]
+        denom   = np.dot(weights, positions)
+        s_numer = np.dot(weights * molecules.codon_syn[source], positions)
+        n_numer = denom - s_numer
+
+        # Tally positions where there were changes
+        s_sites = np.sum( np.divide(s_numer, denom, out = np.zeros(3), where = s_numer > 0.) )
+        n_sites = np.sum( np.divide(n_numer, denom, out = np.zeros(3), where = n_numer > 0.) )
         return n_sites, s_sites
 
 
@@ -9,6 +9,8 @@ The package consists of the following Python modules:
 
 * model
 
+* model_stack
+
 * parameters_sanity
 
 * newick
@@ -23,10 +25,31 @@ The package consists of the following Python modules:
 
 * evolver
 
+* transition_cache
+
+* model_registry
+
+* sequences
+
+* writers
+
+* sinks
+
+* compression
+
+* background
+
+* shards
+
+* replicates
+
+* parallel
+
 
 """
 __version__ = '0.8.4'
 from .model import *
+from .model_stack import *
 from .newick import *
 from .evolver import *
 from .genetics import *
@@ -35,5 +58,15 @@ from .state_freqs import *
 from .matrix_builder import *
 from .parameters_sanity import *
 from .empirical_matrices import *
+from .transition_cache import *
+from .model_registry import *
+from .sequences import *
+from .compression import *
+from .background import *
+from .shards import *
+from .writers import *
+from .sinks import *
+from .replicates import *
+from .parallel import *
 
 
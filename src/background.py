@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    This module defines a background writer, which performs output (e.g. writing simulated alignments to file) in a separate thread so that it overlaps with simulation.
+'''
+
+import asyncio
+import threading
+import queue
+
+
+class BackgroundWriter(object):
+    '''
+        Bounded queue of output tasks, performed in order by a single background thread. It is given to Evolver calls with the **writer** argument, so that each call returns as soon as simulation is complete, while its files are written in the background.
+
+        When the queue is full, submitting a task blocks until the thread has caught up (backpressure), so that memory held by pending results stays bounded. Any error raised by a task is kept, and raised by the next call to ``submit``, ``flush``, or ``close``; tasks submitted after an error are skipped.
+
+        Async callers may use ``asubmit``, ``aflush``, and ``aclose``, which wait without blocking the event loop.
+
+        Examples:
+            .. code-block:: python
+
+               >>> # Simulate 100 alignments, writing each while the next is simulated
+               >>> with BackgroundWriter(max_pending = 4) as writer:
+               ...     for i in range(100):
+               ...         evolve(seqfile = "seqs" + str(i) + ".fasta", writer = writer)
+    '''
+
+    def __init__(self, max_pending = 4):
+        '''
+            Optional arguments include,
+                1. **max_pending**, the maximum number of tasks waiting to be performed. Default: 4.
+        '''
+        assert(type(max_pending) is int and max_pending > 0), "\n\nThe maximum number of pending tasks must be a positive integer."
+        self.max_pending = max_pending
+        self._queue  = queue.Queue(maxsize = max_pending)
+        self._error  = None
+        self._closed = False
+        self._thread = threading.Thread(target = self._run, name = "pyvolve-writer", daemon = True)
+        self._thread.start()
+
+
+
+    def _run(self):
+        '''
+            Perform queued tasks until told to stop.
+        '''
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                if self._error is None:
+                    (func, args, kwargs) = task
+                    func(*args, **kwargs)
+            except BaseException as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+
+
+    def _raise_error(self):
+        '''
+            Raise the first error raised by a task, if any, clearing it.
+        '''
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+
+
+    def submit(self, func, *args, **kwargs):
+        '''
+            Queue a call to *func* with the given arguments, blocking if the queue is full. The arguments must not be modified afterwards.
+        '''
+        assert(not self._closed), "\n\nCannot submit to a closed BackgroundWriter."
+        self._raise_error()
+        self._queue.put( (func, args, kwargs) )
+
+
+
+    def flush(self):
+        '''
+            Wait until all queued tasks are complete, and raise any error raised by a task.
+        '''
+        self._queue.join()
+        self._raise_error()
+
+
+
+    def close(self):
+        '''
+            Wait until all queued tasks are complete, stop the background thread, and raise any error raised by a task.
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+
+    async def asubmit(self, func, *args, **kwargs):
+        '''
+            Queue a task, as with ``submit``, waiting for space in the queue without blocking the event loop.
+        '''
+        await asyncio.get_running_loop().run_in_executor(None, lambda: self.submit(func, *args, **kwargs))
+
+
+
+    async def aflush(self):
+        '''
+            Wait until all queued tasks are complete, as with ``flush``, without blocking the event loop.
+        '''
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+
+
+    async def aclose(self):
+        '''
+            Close the writer, as with ``close``, without blocking the event loop.
+        '''
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
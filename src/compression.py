@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    This module writes compressed output files, deflating independent blocks of data in parallel threads (in the manner of pigz), using only the standard library's zlib.
+'''
+
+import io
+import os
+import time
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+COMPRESSION_FORMATS = ["gzip", "deflate"]
+
+
+def open_output(filename, mode = "wb", compress = None, threads = None):
+    '''
+        Open an output file for writing, compressing it if requested.
+
+        Required positional arguments include,
+            1. **filename**, the name of the file to write
+
+        Optional arguments include,
+            1. **mode**, either "wb" for a binary file or "w" for a text file. Default: "wb".
+            2. **compress**, either "gzip", "deflate" (a raw deflate stream, with no gzip header or trailer), or False for no compression. Default: None, for gzip compression if **filename** ends with ".gz", and none otherwise.
+            3. **threads**, the number of compression threads. Default: the number of CPUs.
+    '''
+    assert(mode in ["w", "wb"]), "\n\nOutput files may only be opened with mode 'w' or 'wb'."
+    if compress is None:
+        compress = "gzip" if filename.endswith(".gz") else False
+    if not compress:
+        return open(filename, mode)
+    assert(compress in COMPRESSION_FORMATS), "\n\nCompression must be either 'gzip' or 'deflate'."
+    handle = ParallelGzipFile(filename, threads = threads, raw = (compress == "deflate"))
+    if mode == "w":
+        return io.TextIOWrapper(handle, encoding = "ascii")
+    return handle
+
+
+
+def _deflate_block(block, level, last):
+    '''
+        Deflate a block of data independently of all other blocks. Every block except the last ends on a byte boundary without being marked final, so that the compressed blocks may simply be concatenated into a single deflate stream.
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+
+
+class ParallelGzipFile(io.BufferedIOBase):
+    '''
+        Write-only binary file which compresses its contents in parallel threads. Data are divided into blocks, which are deflated independently on a thread pool (zlib releases the GIL while compressing) and written in order. The result is a standard gzip file (readable with gzip, zcat, or Python's gzip module), or, if requested, a raw deflate stream.
+
+        The number of blocks awaiting compression is bounded, so that memory use does not grow with the size of the file.
+    '''
+
+    def __init__(self, filename, level = 6, block_size = 2**20, threads = None, raw = False):
+        '''
+            Required positional arguments include,
+                1. **filename**, the name of the file to write
+
+            Optional arguments include,
+                1. **level**, the compression level, from 1 (fastest) to 9 (smallest). Default: 6.
+                2. **block_size**, the number of bytes in each independently compressed block. Default: 1 MB.
+                3. **threads**, the number of compression threads. Default: the number of CPUs.
+                4. **raw**, a boolean indicating whether a raw deflate stream is written, with no gzip header or trailer. Default: False.
+        '''
+        super(ParallelGzipFile, self).__init__()
+        self.level      = level
+        self.block_size = block_size
+        self.threads    = threads or os.cpu_count() or 1
+        self.raw        = raw
+        self._file      = open(filename, "wb")
+        self._pool      = ThreadPoolExecutor(max_workers = self.threads)
+        self._pending   = deque()
+        self._buffer    = bytearray()
+        self._crc       = 0
+        self._size      = 0
+        if not raw:
+            self._file.write( b"\x1f\x8b\x08\x00" + struct.pack("<I", int(time.time()) & 0xffffffff) + b"\x00\xff" )
+
+
+
+    def writable(self):
+        return True
+
+
+
+    def write(self, data):
+        '''
+            Write bytes to the file, returning the number of bytes written.
+        '''
+        assert(not self.closed), "\n\nCannot write to a closed file."
+        data = memoryview(data).cast("B")
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._submit( bytes(self._buffer[:self.block_size]), False )
+            del self._buffer[:self.block_size]
+        return len(data)
+
+
+
+    def _submit(self, block, last):
+        '''
+            Send a block for compression, first writing out compressed blocks if too many are pending.
+        '''
+        if not self.raw:
+            self._crc = zlib.crc32(block, self._crc)
+        self._size += len(block)
+        self._pending.append( self._pool.submit(_deflate_block, block, self.level, last) )
+        while len(self._pending) > 2 * self.threads:
+            self._file.write( self._pending.popleft().result() )
+
+
+
+    def close(self):
+        '''
+            Compress any remaining data, finish the stream, and close the file.
+        '''
+        if self.closed:
+            return
+        try:
+            self._submit( bytes(self._buffer), True )
+            self._buffer = bytearray()
+            while self._pending:
+                self._file.write( self._pending.popleft().result() )
+            if not self.raw:
+                self._file.write( struct.pack("<II", self._crc & 0xffffffff, self._size & 0xffffffff) )
+        finally:
+            self._pool.shutdown()
+            self._file.close()
+            super(ParallelGzipFile, self).close()
@@ -10,27 +10,26 @@
 The module will evolve sequences along a phylogeny.
 '''
 
-import itertools
-from copy import deepcopy
+import os
+import copy
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from scipy import linalg
-import random as rn
 from .model import *
 from .newick import *
 from .genetics import *
 from .partition import *
+from .transition_cache import *
+from .replicates import *
+from .sequences import *
+from .writers import *
+from .sinks import *
+from .compression import *
+from .background import *
+from .shards import *
 ZERO      = 1e-8
 MOLECULES = Genetics()
         
         
-class Site():
-    '''
-        Defines the Site class, which holds information for each evolved site.
-    '''
-    def __init__(self):
-        self.int_seq      = None # integer sequence at a site
-        self.rate         = None # site rate category
-
 
 class Evolver(object):
     ''' 
@@ -52,6 +51,12 @@ class Evolver(object):
             Required keyword arguments include,
                 1. **tree** is the phylogeny (parsed with the ``newick.read_tree`` function) along which sequences are evolved
                 2. **partitions** (or **partition**) is a list of Partition instances to evolve.
+            
+            Optional keyword arguments include,
+                1. **cache** is a TransitionCache instance in which transition matrices are stored and reused across calls, Evolver instances, and partitions. By default, a cache shared by all Evolver instances is used. Provide None or False to compute every transition matrix anew.
+                2. **seed** is a seed for the random number generator used in simulation: an integer, a numpy SeedSequence, or a numpy Generator. All random draws made by Evolver come from this generator, so identical seeds give identical simulations. Note that Evolver does not draw from numpy's global random state (``np.random``) during simulation. Default: None, in which case each call draws a new seed from numpy's global random state, so that ``np.random.seed`` still makes simulations reproducible.
+                3. **threads** is the number of threads used to evolve partitions in parallel along each branch. Each partition draws from its own random stream, derived from the Evolver's generator at every call, so results do not depend on the number of threads. Default: 1 (partitions are evolved in turn).
+                4. **ancestors** indicates which ancestral (internal node) sequences are retained after simulation: True to retain all, False to retain none, or a list of internal node names to retain. Tip sequences are always retained. An ancestral sequence which is not retained is released as soon as all of its children have been evolved, so that memory scales with the depth of the tree rather than with its number of nodes. Ancestral sequences may only be written with **write_anc**, or returned by ``get_sequences(anc = True)`` or ``get_alignment_array(anc = True)``, when all are retained; retained ancestors are otherwise given by Replicates objects and sinks. Default: True.
         '''
         
                 
@@ -59,19 +64,38 @@ class Evolver(object):
         if self.partitions is None:
             self.partitions = kwargs.get('partition', None)
         self.full_tree  = kwargs.get('tree', Node())
+        self.cache      = kwargs.get('cache', TRANSITION_CACHE)
+        self._legacy_seeding = kwargs.get('seed', None) is None # Seed each call from numpy's global random state?
+        self._rng       = np.random.default_rng( kwargs.get('seed', None) )
+        self.threads    = kwargs.get('threads', 1)
+        assert(type(self.threads) is int and self.threads > 0), "\n\nThe keyword argument 'threads' must be a positive integer."
+        self._thread_pool = None
+        self.ancestors  = kwargs.get('ancestors', True)
+        assert(self.ancestors is True or self.ancestors is False or type(self.ancestors) in [list, tuple, set]), "\n\nThe keyword argument 'ancestors' must be True, False, or a list of internal node names."
+        if not isinstance(self.cache, TransitionCache):
+            assert(self.cache is None or self.cache is False), "\n\nThe keyword argument 'cache' must be a TransitionCache instance, or None/False to disable caching."
+            self.cache = None
         
         # ATTRIBUTE FOR THE sitewise_dnds_mutsel PROJECT
         self.select_root_type = kwargs.get('select_root_type', 'random').lower() # other options are min, max to select the lowest prob and highest prob state, respectively, for the root sequence.
         assert(self.select_root_type in ["random", "min", "max"]), "\nValue for keyword argument select_root_type argument must be either 'random', 'min', or 'max'. Default behavior is random."
                 
-        # These dictionaries enable convenient post-processing of the simulated alignment. 
-        self._leaf_sites = {} # Store final tip Site lists only
-        self._evolved_sites = {} # Stores Site lists from all nodes, including internal and tips
+        # These dictionaries enable convenient post-processing of the simulated alignment. Each value is an integer array of states with shape (replicates, sites), where sites span all partitions.
+        self._leaf_sites = {} # Store final tip state arrays only
+        self._evolved_sites = {} # Stores state arrays from all nodes, including internal and tips
+        self._sinks = [] # Output sinks receiving each final sequence
+        self._retain = True # Retain final sequences in the dictionaries above?
+        self._shuffle_order = None # Site order applied to final sequences, for shuffled partitions
+        self._sites_buffer = None # Integer array of shape (replicates, retained nodes, sites) holding all retained sequences, tips first
+        self._root_states = None # Integer array of shape (replicates, sites) holding the root sequence, kept for sparse output
         
         # Setup and sanity checks 
         self._root_seq_length = 0
         self._setup_partitions()
         self._code = self.partitions[0]._root_model.code
+        self._state_dtype = self._obtain_state_dtype()
+        self._code_table = code_table(self._code)
+        self._compile_plan()
 
 
 
@@ -88,15 +112,35 @@ class Evolver(object):
             for p in self.partitions:
                 assert(isinstance(p, Partition)), "\n\nYou must provide either a single Partition object or list of Partition objects to evolver."    
         
-        # Assign root model flag to the full tree and determine length of root sequence
+        # Assign root model flag to the full tree and determine length of root sequence. Each partition occupies a contiguous block of sites, beginning at the recorded start position.
+        self._part_starts = []
         for part in self.partitions:        
             self.full_tree.model_flag = part.root_model_name
             if part.branch_het():
                 assert(self.full_tree.model_flag is not None), "\n\n Your root model name does not correspond to any of the Model objects' names provided to your Partition object(s)."
+            self._part_starts.append( self._root_seq_length )
             self._root_seq_length += sum( part.size )
 
         # Final check on size
         assert(self._root_seq_length > 0), "\n\nPartitions have no size!"
+        
+        # Record the partition of each site
+        self._site_partitions = np.zeros( self._root_seq_length, dtype = int )
+        for p in range( len(self.partitions) ):
+            self._site_partitions[ self._part_starts[p] : self._part_starts[p] + sum(self.partitions[p].size) ] = p
+    
+    
+    
+    def _obtain_state_dtype(self):
+        '''
+            Return the smallest unsigned integer type able to hold every state in the code. Sequences are stored as arrays of this type.
+        '''
+        if len(self._code) <= np.iinfo(np.uint8).max + 1:
+            return np.uint8
+        elif len(self._code) <= np.iinfo(np.uint16).max + 1:
+            return np.uint16
+        else:
+            return np.uint32
     
     
                 
@@ -107,11 +151,20 @@ class Evolver(object):
  
             Optional keyword arguments:
                 1. **seqfile** is a custom name for the output simulated alignment. Provide None or False to suppress file creation.
-                2. **seqfmt**  is the format for seqfile (either fasta, nexus, phylip, phylip-relaxed, stockholm, etc. Anything that Biopython can accept!!) Default is FASTA.
+                2. **seqfmt**  is the format for seqfile (either fasta, nexus, phylip, phylip-relaxed, stockholm, etc. Anything that Biopython can accept!!) FASTA, PHYLIP, and NEXUS files are written directly, without Biopython. Alternatively, npz or npy saves the alignment as a binary integer matrix of states, along with sequence names, the code, and the site rate table, for reloading (memory-mapped) with ``load_alignment``. For alignments which differ little from the root, vcf or variants saves only the root sequence and each sequence's differences from it, as VCF or as a compact binary archive (for reloading with ``load_variants``), respectively (see ``write_variants``). Default is FASTA.
                 3. **ratefile** is a custom name for the "site_rates.txt" file. Provide None or False to suppress file creation.
                 4. **infofile** is a custom name for the "site_rates_info.txt" file. Provide None or False to suppress file creation.
-                5. **write_anc** is a boolean argument (True or False) for whether ancestral sequences should be output along with the tip sequences. Default is False.
+                5. **write_anc** is a boolean argument (True or False) for whether ancestral sequences should be output along with the tip sequences. Ancestral and tip sequences are then written in tree preorder, beginning with the root, so that each ancestor precedes its descendents. Default is False.
                 6. **scale_tree** is a float argument for scaling the entire tree by a certain factor. Note that this argument can alternatively be used in the newick module (with `read_tree`) function, but it is included here for ease in replicates (e.g. lots of sims along same tree w/ varied branch lengths). Default: 1.
+                7. **seed** re-seeds the random number generator for this call (and subsequent calls), as described for the Evolver **seed** argument.
+                8. **replicates** is an integer number of replicate alignments to simulate in a single traversal of the tree. Each transition matrix is computed once per branch and used to evolve all replicates at once. When specified, a Replicates object is returned, and files are only written when named explicitly. The replicate number (from 1) is then inserted before each file's extension, e.g. simulated_alignment_1.fasta.
+                9. **sinks** is a Sink instance, or list of Sink instances (see the ``sinks`` module), each of which receives every retained node's sequence as soon as it is final, e.g. to stream tip sequences to disk while the rest of the tree is still evolving.
+                10. **retain** is a boolean argument for whether final sequences are also kept by the Evolver (for ``get_sequences``, **seqfile**, **replicates**, **store**, and **shards**). Providing False, together with **sinks**, avoids holding any sequences until the end of the simulation. Default: True.
+                11. **store** is a ReplicateStore instance, to which the simulated tip sequences and site rates (of every replicate) are appended.
+                12. **compress** indicates how the seqfile, ratefile, and infofile are compressed: "gzip", "deflate" (a raw deflate stream), or False for no compression. Compression is performed in parallel threads, and gzip files remain readable by standard gzip tools. Binary (npz and npy) sequence files are never compressed, so that they can be memory-mapped. Default: None, to gzip any file whose name ends with ".gz".
+                13. **writer** is a BackgroundWriter instance (see the ``background`` module), on which the seqfile, ratefile, and infofile are written in a background thread. The Evolver then returns as soon as simulation is complete, so that the next simulation overlaps with writing. Call the writer's ``flush`` or ``close`` method to wait for all files to be written and to raise any error encountered while writing them.
+                14. **shards** is a TensorShardWriter instance (see the ``shards`` module), to which the simulated tip sequences (of every replicate) are added as one-hot tensors, labeled with the parameters of the generating models and the **tree_id**.
+                15. **tree_id** is a number identifying the tree, saved as a label with any **shards**. Default: 0.
                 
                                 
             Examples:
@@ -129,39 +182,102 @@ class Evolver(object):
                    >>> # Custom sequence file name and format, and suppress rate information
                    >>> evolve(seqfile = "my_seqs.phy", seqfmt = "phylip", ratefile = None, infofile = None)
       
+                   >>> # Simulate 1000 replicate alignments at once, returning a Replicates object and writing no files
+                   >>> reps = evolve(replicates = 1000)
+
+                   >>> # Stream tip sequences to a FASTA file as they are produced, keeping nothing in memory
+                   >>> evolve(sinks = FastaSink("my_seqs.fasta"), retain = False, seqfile = None)
+
+                   >>> # Write files in the background, while the next alignment is simulated
+                   >>> writer = BackgroundWriter()
+                   >>> for i in range(100):
+                   ...     evolve(seqfile = "my_seqs" + str(i) + ".fasta", writer = writer)
+                   >>> writer.close()
         '''
         # Input arguments
-        self.seqfile    = kwargs.get('seqfile', 'simulated_alignment.fasta')
+        self.replicates = kwargs.get('replicates', None)
+        if self.replicates is None:
+            default_seqfile, default_ratefile, default_infofile = 'simulated_alignment.fasta', 'site_rates.txt', 'site_rates_info.txt'
+            self._num_replicates = 1
+        else:
+            default_seqfile, default_ratefile, default_infofile = None, None, None
+            assert(type(self.replicates) is int and self.replicates > 0), "\n\nThe argument 'replicates' must be a positive integer."
+            self._num_replicates = self.replicates
+        self.seqfile    = kwargs.get('seqfile', default_seqfile)
         self.seqfmt     = kwargs.get('seqfmt', 'fasta').lower()
         self.write_anc  = kwargs.get('write_anc', False)
-        self.ratefile   = kwargs.get('ratefile', 'site_rates.txt')
-        self.infofile   = kwargs.get('infofile', 'site_rates_info.txt')
+        if self.write_anc:
+            self._check_ancestors_retained()
+        self.ratefile   = kwargs.get('ratefile', default_ratefile)
+        self.infofile   = kwargs.get('infofile', default_infofile)
         self.scale_tree = kwargs.get('scale_tree', 1.)
+        self.compress   = kwargs.get('compress', None)
+        if kwargs.get('seed', None) is not None:
+            self._rng = np.random.default_rng( kwargs.get('seed') )
+            self._legacy_seeding = False
+        elif self._legacy_seeding:
+            # Without a seed, every call is seeded from numpy's global random state
+            self._rng = np.random.default_rng( np.random.randint(2**32, size = 4) )
+        self._sinks     = kwargs.get('sinks', None) or []
+        if isinstance(self._sinks, Sink):
+            self._sinks = [self._sinks]
+        self._retain    = kwargs.get('retain', True)
+        self.store      = kwargs.get('store', None)
+        self.writer     = kwargs.get('writer', None)
+        self.shards     = kwargs.get('shards', None)
+        self.tree_id    = kwargs.get('tree_id', 0)
+        assert(self._retain or not (self.seqfile or self.replicates is not None or self.store is not None or self.shards is not None)), "\n\nSequences must be retained (retain = True) to write a seqfile, store replicates, write shards, or return replicates. Otherwise, use a FastaSink."
+        self._leaf_sites, self._evolved_sites = {}, {}
+        if self._retain:
+            self._sites_buffer = np.empty( (self._num_replicates, len(self._buffer_names), self._root_seq_length), dtype = self._state_dtype )
+        else:
+            self._sites_buffer = None
+        self._spawn_partition_rngs()
+        self._shuffle_order = self._draw_shuffle_order()
 
 
-        # Simulate recursively
-        self._sim_subtree(self.full_tree)
-
-        # Shuffle sequences?
-        self._shuffle_sites()
-
-        # Convert Site dictionaries to sequence dictionaries
-        self.leaf_seqs = self._convert_site_to_seq_dict(self._leaf_sites)
-        self.evolved_seqs = self._convert_site_to_seq_dict(self._evolved_sites)
-
-        # Save rate info, as needed       
-        if self.ratefile:
-            self._write_ratefile()
-        if self.infofile:
-            self._write_infofile()
-        
-        
-        # Save sequences, as needed
-        if self.seqfile:
-            if self.write_anc:
-                self._write_sequences(self.evolved_seqs)
+        # Simulate along the plan, evolving partitions on a thread pool if requested
+        for sink in self._sinks:
+            sink.open(self)
+        try:
+            if self.threads > 1 and len(self.partitions) > 1:
+                with ThreadPoolExecutor( max_workers = min(self.threads, len(self.partitions)) ) as pool:
+                    self._thread_pool = pool
+                    try:
+                        self._simulate()
+                    finally:
+                        self._thread_pool = None
+            else:
+                self._simulate()
+        finally:
+            for sink in self._sinks:
+                sink.close()
+
+        # Apply any shuffling to the site rates, as it was applied to each final sequence
+        if self._shuffle_order is not None:
+            self._site_rates = np.take_along_axis(self._site_rates, self._shuffle_order, axis = 1)
+            self._root_states = np.take_along_axis(self._root_states, self._shuffle_order, axis = 1)
+
+        if self.store is not None:
+            self.store.append( self._sites_buffer[:, :self._num_buffer_leaves], self._site_rates, self._buffer_names[:self._num_buffer_leaves], self._code, self._site_partitions )
+        if self.shards is not None:
+            self.shards.write( self._sites_buffer[:, :self._num_buffer_leaves], self._buffer_names[:self._num_buffer_leaves], self._code, model_labels(self.partitions, self.tree_id) )
+
+        # Sequence mappings, whose strings are built only as needed. When several replicates were simulated, these give the first replicate.
+        self.leaf_seqs = LazySequences(self._leaf_sites, self._code, self._code_table, replicate = 0)
+        self.evolved_seqs = LazySequences(self._evolved_sites, self._code, self._code_table, replicate = 0)
+        results = None
+        if self.replicates is not None:
+            results = self._process_replicates()
+
+        # Save sequences and rate info, as needed, in the background if requested
+        if self.seqfile or self.ratefile or self.infofile:
+            if self.writer is None:
+                self._write_files()
             else:
-                self._write_sequences(self.leaf_seqs)
+                # A shallow copy keeps this call's buffers and file names, which a later call replaces rather than changes
+                self.writer.submit( copy.copy(self)._write_files )
+        return results
     #########################################################################################                      
                         
                         
@@ -169,96 +285,151 @@ class Evolver(object):
                         
                         
     ######################## FUNCTIONS TO PROCESS SIMULATED SEQUENCES #######################              
-    def _convert_site_to_seq_dict(self, seqdict):
+    def _spawn_partition_rngs(self):
         '''
-            Return dictionary with key:value pairs of ID:sequence string from the self._leaf_sites or self._evolved_sites dictionaries.
+            Derive an independent random number generator for each partition from the Evolver's generator.
+            All random draws for a partition (root sequence, evolution along branches, and shuffling) come from its own generator, so partitions may be evolved in any order, or concurrently, with identical results.
         '''
-        new_dict = {}
-        for entry in seqdict:
-            merged_entry = list( itertools.chain.from_iterable( seqdict[entry] ) )
-            sequence = self._site_to_sequence( merged_entry )
-            new_dict[entry] = sequence
-        return new_dict
-
+        seeds = self._rng.integers(2**63, size = len(self.partitions))
+        self._partition_rngs = [np.random.default_rng(seed) for seed in seeds]
+        
+        
 
-    def _site_to_sequence(self, site):
+    def _process_replicates(self):
         '''
-            Convert a single Site() object or list of Site() objects into a sequence string.
-            Argument *site* is either a Site() object or a list of them.
+            Collect all simulated replicates into a Replicates object, and return it.
         '''
-        if type(site) is list:
-            sequence = ''
-            for s in site:
-                sequence += self._code[s.int_seq]
-        else:
-            sequence = self._code[site.int_seq]
-        return sequence
+        num_taxa = self._num_buffer_leaves
+        taxa = self._buffer_names[:num_taxa]
+        ancestors = self._buffer_names[num_taxa:]
+        states = self._sites_buffer[:, :num_taxa]
+        ancestral_states = self._sites_buffer[:, num_taxa:]
+        return Replicates(taxa, states, ancestors, ancestral_states, self._site_rates, self._site_partitions, self._code)
 
 
 
+    def _write_files(self):
+        '''
+            Save the requested seqfile, ratefile, and infofile. When several replicates were simulated, each replicate is saved to its own files.
+        '''
+        if self.replicates is None:
+            if self.ratefile:
+                self._write_ratefile()
+            if self.infofile:
+                self._write_infofile()
+            if self.seqfile:
+                self._write_sequences()
+            return
+
+        seqfile, ratefile, infofile = self.seqfile, self.ratefile, self.infofile
+        for r in range(self._num_replicates):
+            if ratefile:
+                self.ratefile = self._replicate_filename(ratefile, r)
+                self._write_ratefile(r)
+            if infofile:
+                self.infofile = self._replicate_filename(infofile, r)
+                self._write_infofile()
+            if seqfile:
+                self.seqfile = self._replicate_filename(seqfile, r)
+                self._write_sequences(r)
+        self.seqfile, self.ratefile, self.infofile = seqfile, ratefile, infofile
+
+
+
+    def _replicate_filename(self, filename, replicate):
+        '''
+            Insert the replicate number (indexed from 1) before a file name's extension.
+        '''
+        (root, ext) = os.path.splitext(filename)
+        if ext == ".gz":
+            (root, inner_ext) = os.path.splitext(root)
+            ext = inner_ext + ext
+        return root + "_" + str(replicate + 1) + ext
 
-    def _shuffle_sites(self):
+
+
+    def _draw_shuffle_order(self):
         ''' 
-            Shuffle evolved sequences within partitions, if specified.
-            In particular, we shuffle sequences in the self._evolved_sites dictionary, and then we copy over to the self._leaf_sites dictionary.            
+            Draw the order in which sites of final sequences are given, shuffling sites within partitions, if specified.
+            A single index permutation is built for each replicate across all partitions (positions outside shuffled partitions map to themselves). It is drawn before simulation, so that it can be applied to each node's sequence as soon as that sequence is final, as well as to the site rate array.
+            Returns the permutation as an integer array of shape (replicates, sites), or None if no partition is shuffled.
         ''' 
-        start = 0
+        order = np.tile( np.arange(self._root_seq_length), (self._num_replicates, 1) )
+        shuffled = False
         for part_index in range( len(self.partitions) ):            
             part = self.partitions[part_index]
             if part._shuffle:
+                start = self._part_starts[part_index]
                 size = sum( part.size )
-                part_pos = np.arange( size ) + start
-                np.random.shuffle(part_pos)     
-                for record in self._evolved_sites:
-                    temp = []
-                    for pp in part_pos:
-                        temp.append( self._evolved_sites[record][part_index][pp] )
-                    self._evolved_sites[record][part_index][start:start + size] = temp
-
-        # Apply shuffling to self._leaf_sites
-        for record in self._leaf_sites:
-            self._leaf_sites[record] = self._evolved_sites[record]
+                for r in range(self._num_replicates):
+                    order[r, start : start + size] = start + self._partition_rngs[part_index].permutation(size)
+                shuffled = True
+        if not shuffled:
+            return None
+        return order
+
+
+
+    def _finalize_node(self, n, seq):
+        '''
+            Apply any shuffling to the final sequence of the node at plan index *n*, store it (if sequences are retained), and send it to all sinks.
+        '''
+        if self._shuffle_order is not None:
+            seq = np.take_along_axis(seq, self._shuffle_order, axis = 1)
+        name = self._plan_names[n]
+        if self._sites_buffer is not None:
+            # Store the sequence in its slot of the buffer, unless it was evolved there directly
+            stored = self._sites_buffer[:, self._plan_slots[n]]
+            if seq.base is not self._sites_buffer:
+                stored[...] = seq
+            seq = stored
+        if self._retain:
+            self._evolved_sites[name] = seq
+            if self._plan_leaves[n]:
+                self._leaf_sites[name] = seq
+        for sink in self._sinks:
+            sink.write(name, bool(self._plan_leaves[n]), seq)
 
                
                     
 
 
-    def _write_sequences(self, seqdict):
+    def _write_sequences(self, replicate = 0):
         ''' 
-            Write resulting sequences to a file in specified format.
+            Write resulting sequences, for a given replicate, to a file in specified format. Tip sequences are written or, if write_anc is True, all retained sequences, in tree preorder.
+            Binary formats (npz and npy) also store the code and the site rate table, as written to the ratefile.
         '''
-        from Bio.Seq import Seq
-        from Bio.SeqRecord import SeqRecord
-        from Bio.Alphabet import generic_alphabet
-        from Bio import SeqIO
+        (matrix, names, site_partitions, site_rates) = self.get_alignment_array(anc = self.write_anc, replicate = replicate)
+        if self.write_anc:
+            matrix = matrix[self._buffer_preorder]
+            names = [names[i] for i in self._buffer_preorder]
+        if self.seqfmt in BINARY_FORMATS:
+            write_alignment_array(self.seqfile, self.seqfmt, names, matrix, self._code, self._site_rate_table(replicate))
+        elif self.seqfmt in VARIANT_FORMATS:
+            write_variants(self.seqfile, self.seqfmt, names, matrix, self._root_states[replicate], self._code, compress = self.compress)
+        else:
+            write_alignment(self.seqfile, self.seqfmt, names, matrix, self._code, self._code_table, compress = self.compress)
 
-        alignment = [] 
-        for entry in seqdict:
-            seq_object = SeqRecord( Seq( seqdict[entry] , generic_alphabet ), id = entry, description = "")
-            alignment.append(seq_object)
-        try:
-            SeqIO.write(alignment, self.seqfile, self.seqfmt)
-        except:
-            raise TypeError("\n Output file format is unknown. Consult with Biopython manual to see which I/O formats are accepted.\n NOTE: If you are attempting to save as phylip and are receiving this error, try seqfmt = 'phylip-relaxed' instead.")
+
+
+    def _site_rate_table(self, replicate = 0):
+        '''
+            Return the site rate table, as written to the ratefile, for a given replicate: an integer array with a row for each site, and columns Site_Index, Partition_Index, and Rate_Category. All indexing is from *1*.
+        '''
+        return np.column_stack( (np.arange( self._root_seq_length ) + 1, self._site_partitions + 1, self._site_rates[replicate] + 1) )
 
 
 
-    def _write_ratefile(self):
+    def _write_ratefile(self, replicate = 0):
         '''
-            Write ratefile, a tab-delimited file containing site-specific rate information. Considers leaf sequences only.
+            Write ratefile, a tab-delimited file containing site-specific rate information, for a given replicate. Considers leaf sequences only.
             Writes -   Site_Index    Partition_Index     Rate_Category
             All indexing is from *1*.
         '''
-        refseq = list(self._leaf_sites.values())[0]
-        with open(self.ratefile, 'w') as ratef:
+        with open_output(self.ratefile, 'w', self.compress) as ratef:
             ratef.write("Site_Index\tPartition_Index\tRate_Category")
-            site_index = 1
-            for p in range(len(refseq)):
-                part = refseq[p]
-                for i in range(len(part)):
-                    w = "\n" + str(site_index) + "\t" + str(p +  1) + "\t" + str(part[i].rate + 1)
-                    ratef.write(w)
-                    site_index += 1
+            for i, p, r in self._site_rate_table(replicate):
+                ratef.write( "\n" + str(i) + "\t" + str(p) + "\t" + str(r) )
         
 
     def _write_infofile(self):
@@ -267,7 +438,7 @@ class Evolver(object):
             Writes -   Partition_Index    Model_Name    Rate_Category    Rate_Probability    Rate_Factor
             All indexing is from *1*.
         '''
-        with open(self.infofile, 'w') as infof:
+        with open_output(self.infofile, 'w', self.compress) as infof:
             infof.write("Partition_Index\tModel_Name\tRate_Category\tRate_Probability\tRate_Factor")
             for p in range( len(self.partitions) ):
                 part = self.partitions[p]  
@@ -286,16 +457,51 @@ class Evolver(object):
                   
                   
                                 
+    def _check_ancestors_retained(self):
+        '''
+            Assert that every ancestral sequence is retained, before ancestral sequences are written or returned alongside the tips.
+        '''
+        assert(np.all(self._plan_keep)), "\n\nAncestral sequences were requested, but only some (or none) of them are retained, as specified with the Evolver's 'ancestors' argument. Provide ancestors = True to retain every ancestral sequence. Otherwise, retained ancestral sequences are given by Replicates objects (with the 'replicates' argument) and sinks."
+
+
+
+    def get_alignment_array(self, anc = False, replicate = 0):
+        '''
+            Return the simulated alignment as an integer matrix of states, without building any sequence strings. The integers index the Evolver's code (e.g. 0,1,2,3 for A,C,G,T), and are stored in the smallest unsigned integer type able to hold them (uint8 for up to 256 states).
+            Default anc = False will return tip sequences only. If anc == True, retained ancestral sequences are included as well, after the tips. Optional argument *replicate* selects the replicate, when several were simulated.
+            
+            Returns a tuple of four arrays,
+                1. the matrix of states, of shape (sequences, sites)
+                2. the names of the sequences, in the same order as the rows of the matrix
+                3. the partition of each site (indexed from 0)
+                4. the rate category of each site (indexed from 0)
+            
+            The returned arrays are views of the Evolver's own buffers, so they are replaced, not changed, by a later call to the Evolver. They should be copied before being modified.
+        '''
+        assert(self._sites_buffer is not None), "\n\nNo sequences were retained by the Evolver. Call the Evolver (with retain = True) before requesting the alignment."
+        if anc:
+            self._check_ancestors_retained()
+            matrix = self._sites_buffer[replicate]
+            names = list(self._buffer_names)
+        else:
+            matrix = self._sites_buffer[replicate, :self._num_buffer_leaves]
+            names = self._buffer_names[:self._num_buffer_leaves]
+        return matrix, names, self._site_partitions, self._site_rates[replicate]
+
+
+
     def get_sequences(self, anc = False):
         '''
             Method to return the dictionary of simulated sequences.
-            Default anc = False will return the leaf_sites dictionary.
-            If anc == True, then will return the evolved_sites dictionary.
+            Default anc = False will return the tip sequences (from the leaf_seqs mapping).
+            If anc == True, then will return all retained sequences (from the evolved_seqs mapping).
+            When several replicates were simulated, the sequences of the first replicate are returned; all replicates are given by the returned Replicates object.
         '''
         if anc:
-            return self.evolved_seqs
+            self._check_ancestors_retained()
+            return dict(self.evolved_seqs)
         else:
-            return self.leaf_seqs
+            return dict(self.leaf_seqs)
                             
 
 
@@ -304,16 +510,14 @@ class Evolver(object):
     ######################### FUNCTIONS INVOLVED IN SEQUENCE EVOLUTION ############################
 
 
-    def _exponentiate_matrix(self, Q, t):
+    def _transition_matrix(self, model, t, category):
         '''
-            Perform exponentiation on instantaneous matrix to produce transition matrix, from a given instantaneous matrix Q and a given branch length t.
-            Assert that all rows sum to 1.
-            Return P
+            Obtain the transition matrix for a given model, branch length, and rate category, from the cache if one is in use.
         '''
-        P = linalg.expm( np.multiply(Q, float(t) ) )
-        assert( np.allclose( np.sum(P, axis = 1), np.ones(len(self._code))) ), "Rows in transition matrix do not each sum to 1."
-        return P
-                        
+        if self.cache is not None:
+            return self.cache(model, t, category)
+        else:
+            return model.transition_matrix(t, category)
     
     
     
@@ -337,13 +541,15 @@ class Evolver(object):
     
     
     
-    def _generate_prob_from_unif(self, prob_array):
+    def _generate_prob_from_unif(self, prob_array, rng = None):
         ''' 
             Sample a sequence (nuc,aa,or codon), and return an integer for the sequence chosen from a uniform distribution.
-            Arugment *prob_array* is any list and/or numpy array of probabilities which sum to 1.
+            Arugment *prob_array* is any list and/or numpy array of probabilities which sum to 1. Optional argument *rng* is the random number generator to draw from (default, the Evolver's generator).
         '''
         assert ( abs(np.sum(prob_array) - 1.) < ZERO), "Probabilities do not sum to 1. Cannot generate a new sequence."
-        r = rn.uniform(0,1)
+        if rng is None:
+            rng = self._rng
+        r = rng.uniform(0,1)
         i = 0
         sum = prob_array[i]
         while sum < r:
@@ -352,27 +558,63 @@ class Evolver(object):
         return i     
 
 
-    def _assign_root_seq_from_MRCA(self, raw_MRCA):
+    def _draw_states(self, prob_array, shape, rng = None, models = None):
         '''
-            Assign a root sequence from provided MRCA. This function converts a provided MRCA into a list of Site objects.
+            Draw an array of states of the given *shape* (replicates x sites), each independently from the probabilities in *prob_array*, in a single vectorized step.
+            Uniform draws are made site by site (all replicates of a site together), and each is located among the cumulative probabilities with np.searchsorted, so that the states drawn are exactly those which _generate_prob_from_unif would draw in turn.
+            Optional argument *rng* is the random number generator to draw from (default, the Evolver's generator).
+            Optional argument *models* gives, for each site, a row of *prob_array*, which is then an array of shape (models, states). As in _sample_states, the cumulative rows are offset by their row index, so that all sites are still located with a single call to np.searchsorted.
         '''
-        MRCA_sites = []
-        step = len(self._code[0])
-        for i in range(0, len(raw_MRCA), step):
+        assert ( np.all(np.abs(np.sum(prob_array, axis = -1) - 1.) < ZERO) ), "Probabilities do not sum to 1. Cannot generate a new sequence."
+        if rng is None:
+            rng = self._rng
+        cumulative = np.cumsum(prob_array, axis = -1)
+        size = cumulative.shape[-1]
+        r = rng.random( shape[::-1] ).T
+        if models is None:
+            states = np.searchsorted(cumulative, r)
+        else:
+            cumulative[:,-1] = 1.
+            cumulative += np.arange( len(cumulative) )[:,None]
+            states = np.searchsorted( cumulative.ravel(), models + r ) - models * size
+        np.clip(states, 0, size - 1, out = states)
+        return states
 
-            # Initialize a Site object
-            new_site = Site()
-            new_site.rate = 0
-            
-            # Convert to int_seq and append to MRCA_sites
-            try:
-                new_site.int_seq = self._code.index( raw_MRCA[i:i+step] )
-            except:
-                raise ValueError("\n\nProvided root sequence does not have the same code (alphabet) as model. Remove all noncanonical and/or wrong letters from provided root sequences. Further, if you are specifying codons, ensure that the length of your root sequence is divisible by 3.")
-            MRCA_sites.append(new_site)
-        
-        assert( len(MRCA_sites)*step == len(raw_MRCA)), "\n\nRoot sequence improperly converted."
-        return MRCA_sites
+
+
+    def _sample_states(self, P_matrix, states, rng = None, models = None):
+        '''
+            Sample a new state for every site in an integer array of current *states* (of any shape, e.g. replicates x sites), in a single vectorized step.
+            Rows of the transition matrix *P_matrix* are accumulated and offset by their row index, so that the cumulative rows form one ascending array. A bulk set of uniform draws (one per site), added to each site's current state, can then be located with a single call to np.searchsorted.
+            Optional argument *rng* is the random number generator to draw from (default, the Evolver's generator).
+            Optional argument *models* gives, for each site (broadcast against *states*), the index of its own transition matrix, when *P_matrix* is a stack of matrices of shape (models, states, states). The rows of all matrices are then offset together, and each site's draw is located in row (model * states + current state).
+            Returns an integer array of new states, with the same shape and type as *states*.
+        '''
+        if rng is None:
+            rng = self._rng
+        size = P_matrix.shape[-1]
+        cumulative = np.cumsum(P_matrix, axis = -1).reshape(-1, size)
+        cumulative[:,-1] = 1.
+        cumulative += np.arange( len(cumulative) )[:,None]
+        
+        current = states.astype(np.intp)
+        if models is not None:
+            current += models * size
+        r = rng.random(current.shape)
+        new_states = np.searchsorted( cumulative.ravel(), current + r ) - current * size
+        np.clip(new_states, 0, size - 1, out = new_states)
+        return new_states.astype(states.dtype)
+        
+
+    def _assign_root_seq_from_MRCA(self, raw_MRCA):
+        '''
+            Assign a root sequence from provided MRCA. This function converts a provided MRCA (a string, or bytes-like object such as a memory-mapped file) into an integer array of states, decoding all states at once.
+        '''
+        try:
+            MRCA_states = sequence_to_states(raw_MRCA, self._code, self._code_table)
+        except ValueError:
+            raise ValueError("\n\nProvided root sequence does not have the same code (alphabet) as model. Remove all noncanonical and/or wrong letters from provided root sequences. Further, if you are specifying codons, ensure that the length of your root sequence is divisible by 3.")
+        return MRCA_states.astype(self._state_dtype)
             
         
         
@@ -383,16 +625,18 @@ class Evolver(object):
     def _generate_root_seq(self):
         ''' 
             Generate a root sequence based on the stationary frequencies.
-            Return a complete root sequence list of Site objects.
+            Return the complete root sequence for every replicate, as an integer array of states with shape (replicates, sites). The root sequence is also stored as self._root_states (for sparse output relative to the root), and the rate category of each site in the array self._site_rates.
             
             NOTE: The select_root_type attribute is for the sitewise_dnds_mutsel project and was created on 4/30/15.
         '''
         
-        root_sequence = [] # This will contain a list for each partition's sequence (which is itself a list of Site() objects)
+        root_sequence         = np.zeros( (self._num_replicates, self._root_seq_length), dtype = self._state_dtype )
+        self._site_rates      = np.zeros( (self._num_replicates, self._root_seq_length), dtype = int )
 
-        for part in self.partitions:
-        
-            part_root = [] # reset to empty list
+        for p in range( len(self.partitions) ):
+            part  = self.partitions[p]
+            start = self._part_starts[p]
+            stop  = start + sum(part.size)
         
             # Is there a root sequence?
             if part.MRCA is not None:
@@ -402,130 +646,203 @@ class Evolver(object):
             else:            
             
                 # Grab model info for this partition to get frequency vector for root simulation
-                root_model = self._obtain_model(part, self.full_tree.model_flag)
+                root_model = part.models[ self._plan_models[0, p] ]
 
-                # Generate root_sequence and assign the Site a rate class
+                # Generate root_sequence and assign each site a rate class, drawing all sites of a rate class (in every replicate) at once. Sites of a SiteModelPartition use their own models' frequencies.
+                part_root = np.zeros( (self._num_replicates, sum(part.size)), dtype = self._state_dtype )
+                index = 0
                 for i in range( root_model.num_classes() ):
-                    for j in range( part.size[i] ):
-                        new_site = Site()
-                        new_site.rate = i
-                        ########### SECTION EDITED FOR sitewise_dnds_mutsel PROJECT ############
-                        if self.select_root_type == "min":
-                            new_site.int_seq = np.argmin(root_model.params['state_freqs'])
-                        
-                        elif self.select_root_type == "max":
-                            new_site.int_seq = np.argmax(root_model.params['state_freqs'])
-                        
-                        elif self.select_root_type == "random": 
-                            new_site.int_seq = self._generate_prob_from_unif( root_model.params['state_freqs'] )
-                        #########################################################################
-                        part_root.append( new_site )
-                        del new_site
+                    self._site_rates[:, start + index : start + index + part.size[i]] = i
+                    site_models = None if part.site_models is None else part.site_models[index : index + part.size[i]]
+                    ########### SECTION EDITED FOR sitewise_dnds_mutsel PROJECT ############
+                    if self.select_root_type == "min":
+                        states = np.argmin(root_model.params['state_freqs'], axis = -1)
+                        part_root[:, index : index + part.size[i]] = states if site_models is None else states[site_models]
+                    
+                    elif self.select_root_type == "max":
+                        states = np.argmax(root_model.params['state_freqs'], axis = -1)
+                        part_root[:, index : index + part.size[i]] = states if site_models is None else states[site_models]
+                    
+                    elif self.select_root_type == "random": 
+                        part_root[:, index : index + part.size[i]] = self._draw_states( root_model.params['state_freqs'], (self._num_replicates, part.size[i]), self._partition_rngs[p], site_models )
+                    #########################################################################
+                    index += part.size[i]
             
-            assert( len(part_root) == sum(part.size) ), "\n\nRoot sequence improperly generated for a partition, evolution cannot happen."
-            root_sequence.append(part_root)
+            assert( part_root.shape[-1] == sum(part.size) ), "\n\nRoot sequence improperly generated for a partition, evolution cannot happen."
+            root_sequence[:, start:stop] = part_root # A provided root sequence is shared by all replicates
+        self._root_states = root_sequence
         return root_sequence
 
         
         
-    def _sim_subtree(self, current_node, parent_node = None):
-        ''' 
-            Function to traverse a Node (tree) object recursively and simulate sequences.
-            Required positional arguments include,
-                1. **current_node** is the node (either internal node or leaf) TO WHICH we evolving
-                2. **parent_node** is the node we are evolving FROM. Default of None is only called when the root sequence is not yet made.
+    def _simulate(self):
         '''
-        
-        # We are at the base and must generate root sequence
-        if (parent_node == None and current_node.root is True):
-            current_node.seq = self._generate_root_seq() # the .seq attribute is actually a list of Site() objects.
-        else:
-            assert(current_node.root is False)
-            current_node.seq = self._evolve_branch(current_node, parent_node) 
-        self._evolved_sites[current_node.name] = current_node.seq
+            Simulate sequences along the entire tree.
+        '''
+        self._execute_plan()
 
-            
-        # We are at an internal node. Keep evolving
-        if len(current_node.children)>0:
-            for child_node in current_node.children:
-                self._sim_subtree(child_node, current_node)
-                
-        # We are at a leaf. Save the final sequence
-        else: 
-            self._leaf_sites[current_node.name] = current_node.seq
 
-        
-            
-            
-    def _check_parent_branch(self, parent_node, current_node):
-        ''' 
-            Function ensures that, for a given node we'd like to evolve to, an appropriate branch length exists. 
-            If the branch length is acceptable, an evolutionary model is then assigned to the node if one has yet been assigned.
-            
-            Required positional arguments include,
-                1. **parent_node** is node FROM which we evolve
-                2. **current_node** is the node (either internal node or leaf) TO WHICH we evolve
+
+    def _compile_plan(self):
         '''
-        assert (parent_node.seq != None), "\n\nThere is no parent sequence from which to evolve!"
-        assert (current_node.branch_length >= 0.), "\n\n Your tree has a negative branch length. I'm going to quit now."
-        if current_node.model_flag is None:
-            current_node.model_flag = parent_node.model_flag
-            
-            
-            
+            Compile the tree and partitions into a flat simulation plan, which is reused by every call. Nodes are listed in preorder (every parent precedes its descendents, and every subtree occupies a contiguous block), and the plan stores,
+                1. **self._plan_names**, the name of each node
+                2. **self._plan_parents**, an integer array giving the plan index of each node's parent (-1 for the root)
+                3. **self._plan_lengths**, an array of branch lengths leading to each node (0 for the root)
+                4. **self._plan_ends**, an integer array giving, for each node, the plan index just past the end of its subtree
+                5. **self._plan_leaves**, a boolean array indicating which nodes are tips
+                6. **self._plan_last_child**, an integer array giving the plan index of each node's last child (-1 for tips), after which the node's sequence is no longer needed
+                7. **self._plan_keep**, a boolean array indicating which nodes' sequences are retained after simulation (tips, and ancestors as specified by self.ancestors)
+                8. **self._plan_slots**, an integer array giving, for each retained node, its position in the buffer of retained sequences (-1 for other nodes). Tips come first, followed by retained ancestors, each in preorder. The names in buffer order are stored in self._buffer_names, the number of tips in self._num_buffer_leaves, and the buffer positions of all retained nodes, in preorder, in self._buffer_preorder.
+                9. **self._plan_models**, an integer array of shape (nodes, partitions) giving the index, in each partition's list of models, of the model used along each branch
+                10. **self._plan_categories**, a list giving, for each partition, the (rate category, start, stop) site slices of each rate category
             
+            Model flags are resolved here, once: a node without its own model flag evolves according to its parent's.
+        '''
+        names, parents, lengths, flags = [], [], [], []
+        stack = [(self.full_tree, -1)]
+        while stack:
+            (node, parent) = stack.pop()
+            index = len(names)
+            names.append(node.name)
+            parents.append(parent)
+            if parent < 0:
+                lengths.append(0.)
+                flags.append(node.model_flag)
+            else:
+                assert (node.branch_length >= 0.), "\n\n Your tree has a negative branch length. I'm going to quit now."
+                lengths.append( float(node.branch_length) )
+                flags.append( node.model_flag if node.model_flag is not None else flags[parent] )
+            stack.extend( [(child, index) for child in reversed(node.children)] )
+        
+        self._plan_names   = names
+        self._plan_parents = np.array(parents, dtype = int)
+        self._plan_lengths = np.array(lengths)
+        
+        # Subtree extents, accumulated from the tips upwards
+        sizes = np.ones( len(names), dtype = int )
+        self._plan_last_child = np.full( len(names), -1, dtype = int )
+        for n in range(len(names) - 1, 0, -1):
+            sizes[ parents[n] ] += sizes[n]
+            if self._plan_last_child[ parents[n] ] < 0:
+                self._plan_last_child[ parents[n] ] = n
+        self._plan_ends   = np.arange( len(names) ) + sizes
+        self._plan_leaves = self._plan_last_child < 0
+        
+        if self.ancestors is True or self.ancestors is False:
+            self._plan_keep = self._plan_leaves | self.ancestors
+        else:
+            missing = set(self.ancestors) - set(names)
+            assert(len(missing) == 0), "\n\nThe following ancestors requested with the keyword argument 'ancestors' are not in the tree: " + ", ".join([str(name) for name in missing])
+            self._plan_keep = self._plan_leaves | np.array([name in self.ancestors for name in names])
+        
+        buffer_order = list(np.flatnonzero(self._plan_leaves)) + list(np.flatnonzero(self._plan_keep & ~self._plan_leaves))
+        self._plan_slots = np.full( len(names), -1, dtype = int )
+        self._plan_slots[buffer_order] = np.arange( len(buffer_order) )
+        self._buffer_names = [names[n] for n in buffer_order]
+        self._num_buffer_leaves = int( np.sum(self._plan_leaves) )
+        self._buffer_preorder = self._plan_slots[self._plan_keep]
+        
+        self._plan_models = np.zeros( (len(names), len(self.partitions)), dtype = int )
+        self._plan_categories = []
+        for p in range( len(self.partitions) ):
+            part = self.partitions[p]
+            for n in range( len(names) ):
+                self._plan_models[n, p] = part.models.index( self._obtain_model(part, flags[n]) )
+            categories = []
+            index = self._part_starts[p]
+            for i in range( len(part.size) ):
+                categories.append( (i, index, index + part.size[i]) )
+                index += part.size[i]
+            self._plan_categories.append( categories )
+
+
+
+    def _execute_plan(self, start = 0, stop = None, parent_seq = None):
+        '''
+            Simulate sequences for a contiguous block of the plan, iteratively. The final state array of each retained node is handled by self._finalize_node as soon as it is evolved.
+            By default, the entire tree is simulated, beginning with the root sequence. Otherwise, the block [*start*, *stop*) must be a subtree (or consecutive sibling subtrees), and *parent_seq* is the state array of the parent of the node at *start*.
+        '''
+        if stop is None:
+            stop = len(self._plan_names)
+        seqs = {} # Sequences still needed to evolve children, released once the last child is evolved
+        for n in range(start, stop):
+            parent = self._plan_parents[n]
+            if parent < 0:
+                seq = self._generate_root_seq()
+            else:
+                # Tips are evolved directly into their slot of the buffer of retained sequences, unless sites must first be shuffled
+                out = None
+                if self._plan_leaves[n] and self._plan_keep[n] and self._sites_buffer is not None and self._shuffle_order is None:
+                    out = self._sites_buffer[:, self._plan_slots[n]]
+                seq = self._evolve_branch(n, parent_seq if parent < start else seqs[parent], out)
+            if parent >= start and n == self._plan_last_child[parent]:
+                del seqs[parent]
             
-    def _evolve_branch(self, current_node, parent_node):
+            if not self._plan_leaves[n]:
+                seqs[n] = seq
+            if self._plan_keep[n]:
+                self._finalize_node(n, seq)
+
+
+
+    def _evolve_branch(self, n, parent_seq, out = None):
         ''' 
-            Function to evolve a given sequence during tree traversal.
+            Function to evolve a given sequence along a branch of the plan.
             
             Required positional arguments include, 
-                1. **current_node** is the node (either internal node or leaf) we are evolving TO
-                2. **parent_node** is the node we are evolving FROM.
+                1. **n** is the plan index of the node (either internal node or leaf) we are evolving TO
+                2. **parent_seq** is the integer state array of the node we are evolving FROM.
+            
+            Optional argument **out** is an array into which the new states are written. Default: a new array.
         '''
+        if out is None:
+            new_seq = np.empty_like(parent_seq)
+        else:
+            new_seq = out
 
-        # Ensure parent sequence exists and branch length is acceptable. Return the model flag to use here.
-        self._check_parent_branch(parent_node, current_node)
- 
         # Evolve only if branch length is greater than 0 (1e-8). 
-        if current_node.branch_length <= ZERO:
-            new_seq = deepcopy(parent_node.seq)
+        if self._plan_lengths[n] <= ZERO:
+            new_seq[...] = parent_seq
         
         else:
-            new_seq = []            
+            branch_length = self.scale_tree * self._plan_lengths[n]
             
-            for p in range( len(self.partitions) ):
-                # Obtain current model for this partition at this branch
-                part = self.partitions[p]
-                current_model = self._obtain_model(part, current_node.model_flag)
-                index = 0
-                part_new_seq = []  # will temporarily store this partition's new sequence
-                
-                
-                
-                for i in range( current_model.num_classes() ):
-                    # Grab instantaneous rate matrix, which is done differently depending if codon (dN/dS) model or not. This is the rate het in the partition.
-                    Q_matrix = None
-                    if current_model.is_hetcodon_model():
-                        Q_matrix = current_model.matrix[i]
-                    else:
-                        Q_matrix = current_model.matrix * current_model.rate_factors[i] # note that rate_factors = [1.] if no site heterogeneity, so matrix unchanged
-                    assert( Q_matrix is not None ), "\n\nCouldn't retrieve instantaneous rate matrix."
-                    
-                    # Generate transition matrix
-                    P_matrix = self._exponentiate_matrix(Q_matrix, self.scale_tree * float(current_node.branch_length))
-                
-                    # Evolve branch
-                    part_parent_seq = parent_node.seq[p][index : index + part.size[i]]
-                    for j in range( part.size[i] ):
-                        new_site = deepcopy( part_parent_seq[j] )
-                        new_site.int_seq = self._generate_prob_from_unif( P_matrix[ new_site.int_seq ] )
-                        part_new_seq.append( new_site )
-                        index += 1
-                new_seq.append( part_new_seq )
+            # Partitions occupy disjoint slices of new_seq and draw from their own random streams, so they may be evolved concurrently.
+            if self._thread_pool is None:
+                for p in range( len(self.partitions) ):
+                    self._evolve_partition(p, self._plan_models[n, p], branch_length, parent_seq, new_seq)
+            else:
+                jobs = [self._thread_pool.submit(self._evolve_partition, p, self._plan_models[n, p], branch_length, parent_seq, new_seq) for p in range( len(self.partitions) )]
+                for job in jobs:
+                    job.result()
         return new_seq
-
         
         
         
-         
+    def _evolve_partition(self, p, model_index, branch_length, parent_seq, new_seq):
+        '''
+            Evolve the sites of a single partition along a branch, writing the new states into that partition's slice of *new_seq*.
+            
+            Required positional arguments include,
+                1. **p** is the index of the partition to evolve
+                2. **model_index** is the index, in the partition's list of models, of the model used along this branch
+                3. **branch_length** is the (scaled) length of the branch
+                4. **parent_seq** is the integer state array of the node we are evolving FROM
+                5. **new_seq** is the integer state array, for the node we are evolving TO, into which evolved states are written
+            
+            For a SiteModelPartition, the transition matrices of all models in its ModelStack are obtained at once, and each site is sampled from its own model's matrix.
+        '''
+        part = self.partitions[p]
+        current_model = part.models[model_index]
+        rng = self._partition_rngs[p]
+        
+        for (i, start, stop) in self._plan_categories[p]:
+            # Generate transition matrix for this rate category. The model handles rate heterogeneity, using either the category's rate factor or, for dN/dS models, the category's own matrix.
+            P_matrix = self._transition_matrix(current_model, branch_length, i)
+            site_models = None
+            if part.site_models is not None:
+                site_models = part.site_models[start - self._part_starts[p] : stop - self._part_starts[p]]
+        
+            # Evolve all sites in this rate category, across all replicates, at once
+            new_seq[:, start:stop] = self._sample_states( P_matrix, parent_seq[:, start:stop], rng, site_models )
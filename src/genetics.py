@@ -10,10 +10,29 @@
     This module contains various genetic definitions and mappings used throughout pyvolve.
 '''
 
+from types import MappingProxyType
+import numpy as np
+
+_TABLES = None # Lookup tables shared by all Genetics instances, built once per process
+
 
 class Genetics():
     '''
         Molecular alphabet objects.
+
+        Besides lists of states, each instance provides read-only lookup tables, built once per process and shared by all instances, so that states and pairs of codons are looked up in constant time rather than searched for:
+            1. **nucleotide_index**, **amino_acid_index**, and **codon_index**, dictionaries (read-only) of states to their indices
+            2. **nucleotide_bytes**, **amino_acid_bytes**, and **codon_bytes**, arrays of ASCII bytes with one row per state, such that indexing with an integer array of states gives the characters of a sequence
+            3. **nucleotide_lookup** and **amino_acid_lookup**, arrays of each state's index for all 256 byte values (-1 for bytes which are not states), such that indexing with the bytes of a sequence gives its states; and **codon_lookup**, an array of each codon's index (-1 for stop codons) by the indices of its three nucleotides
+            4. **codon_amino_acids**, the index of the amino acid coded by each codon; and **codon_nucleotides**, of shape 61x3, the indices of each codon's nucleotides
+        
+        Codon pairs are described by arrays of shape 61x61, indexed by source and target codon,
+            1. **codon_num_diff**, the number of nucleotide positions at which the codons differ
+            2. **codon_diff_positions**, of shape 61x61x3, True at each position at which the codons differ
+            3. **codon_source_nuc** and **codon_target_nuc**, the indices (0-3) of the source and target nucleotides at the first position at which the codons differ
+            4. **codon_nuc_pair**, the index of that nucleotide pair, 4*source + target (e.g. 1 for A to C)
+            5. **codon_syn**, True if the codons code for the same amino acid
+            6. **codon_num_ti** and **codon_num_tv**, the number of transitions and transversions between the codons
     '''
     
     def __init__(self):
@@ -28,6 +47,53 @@ class Genetics():
         self.codon_dict   = {"AAA":"K", "AAC":"N", "AAG":"K", "AAT":"N", "ACA":"T", "ACC":"T", "ACG":"T", "ACT":"T", "AGA":"R", "AGC":"S", "AGG":"R", "AGT":"S", "ATA":"I", "ATC":"I", "ATG":"M", "ATT":"I", "CAA":"Q", "CAC":"H", "CAG":"Q", "CAT":"H", "CCA":"P", "CCC":"P", "CCG":"P", "CCT":"P", "CGA":"R", "CGC":"R", "CGG":"R", "CGT":"R", "CTA":"L", "CTC":"L", "CTG":"L", "CTT":"L", "GAA":"E", "GAC":"D", "GAG":"E", "GAT":"D", "GCA":"A", "GCC":"A", "GCG":"A", "GCT":"A", "GGA":"G", "GGC":"G", "GGG":"G", "GGT":"G", "GTA":"V", "GTC":"V", "GTG":"V", "GTT":"V", "TAC":"Y", "TAT":"Y", "TCA":"S", "TCC":"S", "TCG":"S", "TCT":"S", "TGC":"C", "TGG":"W", "TGT":"C", "TTA":"L", "TTC":"F", "TTG":"L", "TTT":"F"}
         self.codons       = ["AAA", "AAC", "AAG", "AAT", "ACA", "ACC", "ACG", "ACT", "AGA", "AGC", "AGG", "AGT", "ATA", "ATC", "ATG", "ATT", "CAA", "CAC", "CAG", "CAT", "CCA", "CCC", "CCG", "CCT", "CGA", "CGC", "CGG", "CGT", "CTA", "CTC", "CTG", "CTT", "GAA", "GAC", "GAG", "GAT", "GCA", "GCC", "GCG", "GCT", "GGA", "GGC", "GGG", "GGT", "GTA", "GTC", "GTG", "GTT", "TAC", "TAT", "TCA", "TCC", "TCG", "TCT", "TGC", "TGG", "TGT", "TTA", "TTC", "TTG", "TTT"]
         self.stop_codons  = ["TAA", "TAG", "TGA"]     
+        
+        global _TABLES
+        if _TABLES is None:
+            _TABLES = self._build_tables()
+        self.__dict__.update(_TABLES)
+
+
+
+    def _build_tables(self):
+        '''
+            Build all lookup tables, with whole-array operations, and make them read-only.
+        '''
+        tables = {}
+        for (name, code) in [("nucleotide", self.nucleotides), ("amino_acid", self.amino_acids), ("codon", self.codons)]:
+            tables[name + "_index"] = MappingProxyType( {state: i for (i, state) in enumerate(code)} )
+            tables[name + "_bytes"] = np.frombuffer( "".join(code).encode("ascii"), dtype = np.uint8 ).reshape( len(code), len(code[0]) )
+        for (name, code) in [("nucleotide", self.nucleotides), ("amino_acid", self.amino_acids)]:
+            lookup = np.full(256, -1, dtype = np.int16)
+            lookup[ tables[name + "_bytes"][:,0] ] = np.arange(len(code))
+            tables[name + "_lookup"] = lookup
+        
+        codon_nucs = tables["nucleotide_lookup"][ tables["codon_bytes"] ]
+        codon_lookup = np.full( (4, 4, 4), -1, dtype = np.int16 )
+        codon_lookup[ codon_nucs[:,0], codon_nucs[:,1], codon_nucs[:,2] ] = np.arange(61)
+        tables["codon_lookup"] = codon_lookup
+        tables["codon_nucleotides"] = codon_nucs
+        tables["codon_amino_acids"] = np.array( [tables["amino_acid_index"][self.codon_dict[codon]] for codon in self.codons] )
+
+        source = np.broadcast_to( codon_nucs[:, None, :], (61, 61, 3) )
+        target = np.broadcast_to( codon_nucs[None, :, :], (61, 61, 3) )
+        diff = source != target
+        first = np.argmax(diff, axis = 2)[:, :, None]
+        purine = np.isin( np.arange(4), [tables["nucleotide_index"][n] for n in self.purines] )
+        transition = diff & (purine[source] == purine[target])
+        tables["codon_num_diff"]       = np.sum(diff, axis = 2)
+        tables["codon_diff_positions"] = diff
+        tables["codon_source_nuc"]     = np.take_along_axis(source, first, axis = 2)[:, :, 0]
+        tables["codon_target_nuc"]     = np.take_along_axis(target, first, axis = 2)[:, :, 0]
+        tables["codon_nuc_pair"]       = 4 * tables["codon_source_nuc"] + tables["codon_target_nuc"]
+        tables["codon_syn"]            = tables["codon_amino_acids"][:, None] == tables["codon_amino_acids"][None, :]
+        tables["codon_num_ti"]         = np.sum(transition, axis = 2)
+        tables["codon_num_tv"]         = np.sum(diff & ~transition, axis = 2)
+        
+        for table in tables.values():
+            if isinstance(table, np.ndarray):
+                table.setflags(write = False)
+        return tables
 
     
 
@@ -8,7 +8,6 @@
 
 
 
-
 '''
     This module will generate the Markov chain's instantaneous rate matrix, Q.
 '''
@@ -22,6 +21,8 @@ from .genetics import *
 from .state_freqs import *
 ZERO      = 1e-8
 MOLECULES = Genetics()
+_EMPIRICAL_MATRICES = {}    # Empirical replacement matrices, converted once to read-only arrays
+
 
 
 class MatrixBuilder(object):
@@ -54,35 +55,51 @@ class MatrixBuilder(object):
 
     def _build_matrix( self, parameters = None):
         ''' 
-            Generate an instantaneous rate matrix.
+            Generate an instantaneous rate matrix. All off-diagonal rates are computed at once by the child class's _build_rates method, with whole-array operations.
+            Child classes which build a stack of matrices at once (of shape (models, size, size)) have each matrix's diagonal filled.
         '''    
         if parameters is None:
             parameters = self.params
-        matrix = np.zeros( [self._size, self._size] ) # For nucleotides, self._size = 4; amino acids, self._size = 20; codons, self._size = 61.
-        for s in range(self._size):
-            for t in range(self._size):
-                # Non-diagonal
-                rate = self._calc_instantaneous_prob( s, t, parameters )                
-                matrix[s][t] = rate
-                
-            # Fill in the diagonal position so the row sums to 0, but ensure it doesn't became -0
-            matrix[s][s]= -1. * np.sum( matrix[s] )
-            if matrix[s][s] == -0.:
-                matrix[s][s] = 0.
-            assert ( abs(np.sum(matrix[s])) < ZERO ), "\n\nRow in instantaneous matrix does not sum to 0."
+        matrix = self._build_rates( parameters ) # For nucleotides, self._size = 4; amino acids, self._size = 20; codons, self._size = 61.
+        
+        # Fill in the diagonal positions so that rows sum to 0, but ensure they don't become -0
+        diagonal = np.arange(matrix.shape[-1])
+        matrix[..., diagonal, diagonal] = 0.
+        matrix[..., diagonal, diagonal] = 0. - np.sum(matrix, axis = -1)
+        assert ( np.all(np.abs(np.sum(matrix, axis = -1)) < ZERO) ), "\n\nRow in instantaneous matrix does not sum to 0."
         return matrix
 
 
 
+    def _build_rates(self, parameters):
+        '''
+            Return a matrix of all substitution rates (the diagonal is ignored), computed with whole-array operations. Implemented by child classes.
+        '''
+        print("Parent class function. Not called.")
+
+
+
+    def _mu_matrix(self, mu, symmetric = False):
+        '''
+            Convert a dictionary of nucleotide mutation rates (e.g. mu["AC"] is the rate from A to C) into a 4x4 array indexed by source and target nucleotide. 
+            If *symmetric* is True, each rate is looked up by the nucleotide pair in alphabetical order (e.g. mu["AC"] for both A to C and C to A).
+        '''
+        nucs = MOLECULES.nucleotides
+        mu_matrix = np.zeros( (4, 4) )
+        for i in range(4):
+            for j in range(4):
+                if i != j:
+                    pair = nucs[i] + nucs[j]
+                    mu_matrix[i][j] = mu["".join(sorted(pair))] if symmetric else mu[pair]
+        return mu_matrix
+
+
 
     def _scaling_factor_from_matrix(self, frequencies, matrix):
         '''
             Determine a scaling factor from a given frequency distribution and corresponding un-normalized rate matrix.
         '''
-        scaling_factor = 0.
-        for i in range(self._size):
-            scaling_factor += ( matrix[i][i] * frequencies[i] )
-        return scaling_factor
+        return np.sum( np.diag(matrix) * frequencies )
 
           
 
@@ -100,7 +117,6 @@ class MatrixBuilder(object):
 
 
 
-
     def _build_scaling_matrix(self):  
         '''
             Build the matrix used to determine a scaling factor for either average or neutral scaling.
@@ -132,77 +148,14 @@ class MatrixBuilder(object):
             Function to load the appropriate replacement matrix from empirical_matrices.py 
         '''
         from . import empirical_matrices as em
-        try:
-            self.emp_matrix = eval("em."+name+"_matrix")
-        except:
-            raise ValueError("\n\nCouldn't figure out your empirical matrix specification.")
-
-
-
-
-    def _is_TI(self, source, target):
-        ''' 
-            Determine if a given nucleotide change is a transition or a tranversion.  Used in child classes nucleotide_Matrix, mechCodon_Matrix, ECM_Matrix, mutSel_Matrix .
-            Returns True for transition, False for transversion.
-            
-            Arguments "source" and "target" are the actual nucleotides (not indices).
-        '''
-        
-        ti_pyrim = source in MOLECULES.pyrims and target in MOLECULES.pyrims
-        ti_purine = source in MOLECULES.purines and target in MOLECULES.purines    
-        if ti_pyrim or ti_purine:
-            return True
-        else:
-            return False
-            
-            
-            
-    def _is_syn(self, source, target):
-        '''
-            Determine if a given codon change is synonymous or nonsynonymous. Used in child classes mechCodon_Matrix, ECM_Matrix .
-            Returns True for synonymous, False for nonsynonymous.
-             
-            Arguments arguments "source" and "target" are codon indices (0-60, alphabetical).
-        '''
-        
-        source_codon = MOLECULES.codons[source]
-        target_codon = MOLECULES.codons[target]
-        if ( MOLECULES.codon_dict[source_codon] == MOLECULES.codon_dict[target_codon] ):
-            return True
-        else:
-            return False           
-    
-    
-    
-    def _get_nucleotide_diff(self, source, target):
-        ''' 
-            Get the nucleotide difference(s) between two codons. Used in child classes ECM_Matrix, mechCodon_Matrix, mutSel_Matrix .
-            Returns a string representing the nucleotide differences between source and target codon.
-            For instance, if source is AAA and target is ATA, the string AT would be returned. If source is AAA and target is ACC, then ACAC would be returned.
-            
-            Input arguments source and target are codon indices (0-60, alphabetical).
-        '''        
-        
-        source_codon = MOLECULES.codons[source]
-        target_codon = MOLECULES.codons[target]
-        return "".join( [source_codon[i]+target_codon[i] for i in range(len(source_codon)) if source_codon[i] != target_codon[i]] )
-        
-        
-    
-    def _calc_instantaneous_prob(self, source, target, params = None):
-        ''' 
-            Calculate a given element in the instantaneous rate matrix.
-            Returns the substitution probability from source to target, for a given model.
-            Arguments "source" and "target" are *indices* for the relevant aminos (0-19) /nucs (0-3) /codons (0-60). 
-        '''
-        print("Parent class function. Not called.")
-
-
-
-
-
-
-
+        if name not in _EMPIRICAL_MATRICES:
+            try:
+                matrix = np.array( eval("em."+name+"_matrix"), dtype = float )
+            except:
+                raise ValueError("\n\nCouldn't figure out your empirical matrix specification.")
+            matrix.setflags(write = False)
+            _EMPIRICAL_MATRICES[name] = matrix
+        self.emp_matrix = _EMPIRICAL_MATRICES[name]
 
 
 
@@ -221,18 +174,11 @@ class AminoAcid_Matrix(MatrixBuilder):
    
             
             
-    def _calc_instantaneous_prob( self, source, target, parameters = None ):
-        ''' 
-            Returns the substitution probability (s_ij * p_j, where s_ij is replacement matrix entry and p_j is target amino frequency) from source to target for amino acid empirical models.
-            Arguments "source" and "target" are indices for the relevant aminos (0-19).
+    def _build_rates(self, parameters):
         '''
-        if parameters is None:
-            parameters = self.params
-        return self.emp_matrix[source][target] * parameters['state_freqs'][target]        
-
-
-
-
+            Return all substitution rates (s_ij * p_j) for amino acid empirical models, as a matrix.
+        '''
+        return self.emp_matrix * np.asarray(parameters['state_freqs'])[None, :]
 
 
 
@@ -249,25 +195,11 @@ class Nucleotide_Matrix(MatrixBuilder):
         self.scale_matrix = "persite"
 
 
-    def _calc_instantaneous_prob(self, source, target, parameters = None):
-        ''' 
-            Returns the substitution probability (\mu_ij * p_j, where \mu_ij are nucleotide mutation rates and p_j is target nucleotide frequency) from source to target for nucleotide models.
-            Arguments "source" and "target" are indices for the relevant nucleotide (0-3).
+    def _build_rates(self, parameters):
         '''
-        if parameters is None:
-            parameters = self.params
-        source_nuc = self._code[source]
-        target_nuc = self._code[target]
-        if source_nuc == target_nuc:
-            return 0.
-        else:
-            return parameters['state_freqs'][target] * parameters['mu']["".join(sorted(source_nuc + target_nuc))]
-
-
-
-
-
-
+            Return all substitution rates (mu_ij * p_j) for nucleotide models, as a matrix.
+        '''
+        return np.asarray(parameters['state_freqs'])[None, :] * self._mu_matrix(parameters['mu'], symmetric = True)
 
 
 
@@ -297,40 +229,17 @@ class MechCodon_Matrix(MatrixBuilder):
                 self.scale_matrix = "persite"
 
 
-    def _calc_prob(self, target_codon, target_nuc, nuc_pair, subrate):
-        ''' 
-            Calculate instantaneous probability of (non)synonymous change for mechanistic codon models.
-            Argument *subrate* is either dN or dS.
+    def _build_rates(self, parameters):
         '''
-
-        prob =  self.params['mu'][nuc_pair] * subrate 
+            Return all substitution rates for mechanistic codon models, as a matrix. Only single-nucleotide changes have nonzero rates.
+        '''
+        rates = self._mu_matrix(self.params['mu'], symmetric = True)[MOLECULES.codon_source_nuc, MOLECULES.codon_target_nuc] * np.where(MOLECULES.codon_syn, parameters['alpha'], parameters['beta'])
         if self.model_type == 'gy':
-            prob *= self.params['state_freqs'][target_codon]
+            rates *= np.asarray(self.params['state_freqs'])[None, :]
         else:
-            prob *= self.params["nuc_freqs"][ MOLECULES.nucleotides.index(target_nuc) ]        
-        return prob
-    
-
-
-    def _calc_instantaneous_prob(self, source, target, parameters = None):
-        ''' 
-            Returns the substitution probability from source to target for mechanistic codon models.
-            Arguments "source" and "target" are indices for the relevant codons (0-60).
-        
-            Third argument can be specified as non-self when we are computing neutral scaling factor.
-        ''' 
-        if parameters is None:
-            parameters = self.params
-            
-        nuc_diff = self._get_nucleotide_diff(source, target)
-        if len(nuc_diff) != 2:
-            return 0.
-        else:
-            nuc_pair = "".join(sorted(nuc_diff[0] + nuc_diff[1]))
-            if self._is_syn(source, target):
-                return self._calc_prob(target, nuc_diff[1], nuc_pair, parameters['alpha'])
-            else:
-                return self._calc_prob(target, nuc_diff[1], nuc_pair, parameters['beta'])
+            rates *= np.asarray(self.params["nuc_freqs"])[ MOLECULES.codon_target_nuc ]
+        rates[MOLECULES.codon_num_diff != 1] = 0.
+        return rates
 
 
     def _build_scaling_params(self):
@@ -354,22 +263,19 @@ class MechCodon_Matrix(MatrixBuilder):
 
 
 
-
-
-
 class MutSel_Matrix(MatrixBuilder):    
     ''' 
         Child class of MatrixBuilder. This class implements functions relevant to constructing mutation-selection balance model instantaneous matrices, according to the HalpernBruno 1998 model.
         Here, this model is extended such that it can be used for either nucleotide or codon. This class will automatically detect which one you want based on the provided state frequencies or fitness values.
-
+        State frequencies or fitness values may also be given as an array of shape (models, size), to build a stack of matrices (one per row) at once, with a shared set of mutation rates (see ModelStack).
     '''
 
     def __init__(self, *args):
         super(MutSel_Matrix, self).__init__(*args)
         try:
-            self._size = len(self.params["state_freqs"])
+            self._size = np.shape(self.params["state_freqs"])[-1]
         except:
-            self._size = len(self.params["fitness"])
+            self._size = np.shape(self.params["fitness"])[-1]
         self.scale_matrix = "neutral"
         if self._size == 4:
             self._code = MOLECULES.nucleotides
@@ -380,70 +286,37 @@ class MutSel_Matrix(MatrixBuilder):
 
 
 
-        
-    def _calc_fixrate_state_freqs(self, source, target, nuc_diff, parameters):
-        ''' 
-            Calculate fixation probability using state frequencies and mutation rates.
+    def _build_rates(self, parameters):
         '''
-            
-        pi_i  = parameters['state_freqs'][source]           # source frequency
-        pi_j  = parameters['state_freqs'][target]           # target frequency 
-        mu_ij = parameters["mu"][nuc_diff]                  # source -> target mutation rate
-        mu_ji = parameters["mu"][nuc_diff[1] + nuc_diff[0]] # target -> source mutation rate
-        
-        # If either frequency is equal to 0, then the rate is 0.
-        if abs(pi_i) <= ZERO or abs(pi_j) <= ZERO:
-            fixation_rate = 0.
-        
-        # Otherwise, compute scaled selection coefficient as np.log( pi_mu ) = np.log( (mu_ji*pi_j)/(mu_ij*pi_i) )
-        else:
-            pi_mu = (mu_ji*pi_j)/(mu_ij*pi_i)
-            # If pi_mu == 1, L'Hopitals gives fixation rate of 1 (substitution probability is the forward mutation rate) 
-            if abs(1. - pi_mu) <= ZERO:
-                fixation_rate = 1. 
-            else:
-                fixation_rate =  np.log(pi_mu)/(1. - 1./pi_mu)
-        return fixation_rate
-
-
-
-
-    def _calc_fixrate_fitness(self, source, target, parameters):
-        ''' 
-            Calculate fixation probability using fitness values and mutation rates.
-        '''            
-        sij = parameters['fitness'][target] - parameters['fitness'][source]  
-        if abs(sij) <= ZERO:
-            fixation_rate = 1. 
+            Return all substitution rates for mutation-selection-balance models, as a matrix. Only single-nucleotide changes have nonzero rates.
+            Fixation rates are computed for all pairs of states at once, from either state frequencies or fitness values.
+        '''
+        if self._size == 61:
+            source_nuc, target_nuc, single = MOLECULES.codon_source_nuc, MOLECULES.codon_target_nuc, MOLECULES.codon_num_diff == 1
         else:
-            fixation_rate = (sij)/(1 - np.exp(-1.*sij))
-        return fixation_rate           
-        
-        
-                   
+            source_nuc, target_nuc = np.indices( (4, 4) )
+            single = source_nuc != target_nuc
+        mu_matrix = self._mu_matrix(parameters['mu'])
+        mu_ij = mu_matrix[source_nuc, target_nuc] # source -> target mutation rates
+        mu_ji = mu_matrix[target_nuc, source_nuc] # target -> source mutation rates
 
-    def _calc_instantaneous_prob(self, source, target, parameters = None):
-        ''' 
-            Calculate the substitution probability from source to target for mutation-selection-balance models.
-            Arguments "source" and "target" are indices for the relevant codons (0-60) or nucleotide (0-3).
-        
-            Third argument can be specified as non-self when we are computing neutral scaling factor.
-
-        '''        
-        if parameters is None:
-            parameters = self.params
-        
-        nuc_diff = self._get_nucleotide_diff(source, target)
-        if len(nuc_diff) != 2:
-            return 0.
-        else:
+        with np.errstate(divide = "ignore", invalid = "ignore", over = "ignore"):
             if self.params["calc_by_freqs"]:
-                fixation_rate = self._calc_fixrate_state_freqs(source, target, nuc_diff, parameters)
-
+                freqs = np.asarray(parameters['state_freqs'], dtype = float)
+                pi_i = freqs[..., :, None]
+                pi_j = freqs[..., None, :]
+                # Scaled selection coefficients, as np.log( pi_mu ). If either frequency is equal to 0, then the rate is 0. If pi_mu == 1, L'Hopitals gives fixation rate of 1.
+                pi_mu = (mu_ji*pi_j)/(mu_ij*pi_i)
+                fixation_rate = np.where( np.abs(1. - pi_mu) <= ZERO, 1., np.log(pi_mu)/(1. - 1./pi_mu) )
+                fixation_rate[ (np.abs(pi_i) <= ZERO) | (np.abs(pi_j) <= ZERO) ] = 0.
             else:
-                fixation_rate = self._calc_fixrate_fitness(source, target, parameters)
-          
-            return fixation_rate * parameters['mu'][nuc_diff]
+                fitness = np.asarray(parameters['fitness'], dtype = float)
+                sij = fitness[..., None, :] - fitness[..., :, None]
+                fixation_rate = np.where( np.abs(sij) <= ZERO, 1., (sij)/(1 - np.exp(-1.*sij)) )
+        
+        rates = fixation_rate * mu_ij
+        rates[..., ~single] = 0.
+        return rates
             
  
  
@@ -461,8 +334,6 @@ class MutSel_Matrix(MatrixBuilder):
 
 
 
-
-
 class ECM_Matrix(MatrixBuilder):
     ''' 
         Child class of MatrixBuilder. This class implements functions relevant to constructing a matrix specifically for the ECM (described in Kosiol2007) model.
@@ -486,48 +357,28 @@ class ECM_Matrix(MatrixBuilder):
         self._code = MOLECULES.codons
         self.scale_matrix = "persite" # It's completely unclear how these models should work, so stick with this.
         self._init_empirical_matrix(self.model_type)
-        
- 
 
 
-    def _set_kappa_param(self, nuc_diff):
+
+    def _kappa_matrix(self):
         ''' 
-            Calculations for the "kappa" parameter(s) for the ECM model. See the 2007 paper for details.
+            Return the "kappa" parameter for every pair of codons, from the transition and transversion counts of the codon-pair tables.
         '''
-        num_ti = 0
-        num_tv = 0
-        for i in range(0, len(nuc_diff), 2):
-            source_nuc = nuc_diff[i]
-            target_nuc = nuc_diff[i+1]
-            if self._is_TI(source_nuc, target_nuc):
-                num_ti += 1
-            else:
-                num_tv += 1
-        return self.params['k_ti']**num_ti * self.params['k_tv']**num_tv
+        return np.power(float(self.params['k_ti']), MOLECULES.codon_num_ti) * np.power(float(self.params['k_tv']), MOLECULES.codon_num_tv)
 
 
 
-
-    def _calc_instantaneous_prob(self, source, target, parameters = None):
-        ''' 
-            Returns the substitution probability from source to target for ECM models.
-            Arguments "source" and "target" are indices for the relevant codons (0-60).
-        '''  
-        if parameters is None:
-            parameters = self.params
-        nuc_diff = self._get_nucleotide_diff(source, target)
-        if len(nuc_diff) == 0  or (self.restricted and len(nuc_diff) != 2):
-            return 0.
+    def _build_rates(self, parameters):
+        '''
+            Return all substitution rates for ECM models, as a matrix. The restricted model allows only single-nucleotide changes.
+        '''
+        kappa_param = self._kappa_matrix()
+        rates = self.emp_matrix * np.asarray(parameters['state_freqs'])[None, :] * np.where(MOLECULES.codon_syn, parameters['alpha'], parameters['beta']) * kappa_param
+        if self.restricted:
+            rates[MOLECULES.codon_num_diff != 1] = 0.
         else:
-            kappa_param = self._set_kappa_param(nuc_diff)
-            if self._is_syn(source, target):
-                return self.emp_matrix[source][target] * parameters['state_freqs'][target] * parameters['alpha'] * kappa_param
-            else:
-                return self.emp_matrix[source][target] * parameters['state_freqs'][target] * parameters['beta'] * kappa_param
-
-
-
+            rates[MOLECULES.codon_num_diff == 0] = 0.
+        return rates
 
 
 
-           
@@ -11,6 +11,7 @@
     Define evolutionary model objects.
 '''
 
+import hashlib
 import numpy as np
 from copy import deepcopy
 from .matrix_builder import *
@@ -104,7 +105,9 @@ class Model():
         self._save_custom_matrix_freqs = kwargs.get('save_custom_frequencies', "custom_matrix_frequencies.txt")
         self.neutral_scaling           = kwargs.get('neutral_scaling', False)
         self.code                      = None
-        
+        self._eigensystems             = []                                     # Eigendecompositions of the rate matrix (or matrices), computed once when first needed. Filled in place, so that they are shared by copies of the model (see ModelRegistry).
+        self._fingerprint              = None                                   # Hash of the rate matrix (or matrices), computed once when first needed
+
         # There are lots of these
         self.aa_models    = ['jtt', 'wag', 'lg', 'ab', 'mtmam', 'mtrev24', 'dayhoff']
         
@@ -492,9 +495,93 @@ class Model():
         ''' 
             Return the number of rate classes associated with a given model.
         '''
-        return len(self.rate_probs)   
+        return len(self.rate_probs)
+
+
+
+    def transition_matrix(self, t, category = 0):
+        '''
+            Return the transition matrix, P(t) = exp(Qt), for a given branch length *t* and rate category *category*.
+            For heterogeneous codon models, the category selects which rate matrix is used. Otherwise, the branch length is scaled by the category's rate factor.
+
+            Transition matrices are computed from an eigendecomposition of the rate matrix, which is calculated only once per model. Matrices which cannot be reliably diagonalized are exponentiated directly.
+        '''
+        if not self._eigensystems:
+            if self.hetcodon_model:
+                self._eigensystems[:] = [self._decompose_matrix(m) for m in self.matrix]
+            else:
+                self._eigensystems[:] = [self._decompose_matrix(self.matrix)]
+
+        if self.hetcodon_model:
+            matrix = self.matrix[category]
+            eigensystem = self._eigensystems[category]
+        else:
+            matrix = self.matrix
+            eigensystem = self._eigensystems[0]
+            t = t * self.rate_factors[category] # note that rate_factors = [1.] if no site heterogeneity, so t unchanged
+
+        if eigensystem is None:
+            P = linalg.expm( np.multiply(matrix, float(t)) )
+        else:
+            (w, left, right) = eigensystem
+            P = np.dot( left * np.exp(w * float(t)), right ).real
+            P[P < 0.] = 0.
+        assert( np.max( np.abs(np.sum(P, axis = 1) - 1.) ) <= 1e-5 ), "Rows in transition matrix do not each sum to 1."
+        return P
+
+
+
+    def fingerprint(self):
+        '''
+            Return a hash string identifying this model's rate matrix (or matrices). Models with identical matrices share a fingerprint, which is used to key cached transition matrices.
+        '''
+        if self._fingerprint is None:
+            digest = hashlib.sha1()
+            if self.hetcodon_model:
+                matrices = self.matrix
+            else:
+                matrices = [self.matrix]
+            for m in matrices:
+                m = np.ascontiguousarray(m, dtype = float)
+                digest.update( str(m.shape).encode() )
+                digest.update( m.tobytes() )
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+
+
+    def _decompose_matrix(self, matrix):
+        '''
+            Compute an eigendecomposition of a rate matrix, such that matrix = left * diag(w) * right.
+            Returns the tuple (w, left, right), or None if the matrix cannot be reliably diagonalized.
+
+            When the matrix is reversible with respect to its state frequencies, it is first symmetrized as S = pi^(1/2) Q pi^(-1/2), and the (numerically stable) symmetric eigensolver is used. Otherwise, a general eigendecomposition is used.
+        '''
+        matrix = np.array(matrix, dtype = float)
+        freqs = np.array(self.params["state_freqs"], dtype = float)
+
+        # Reversible matrices are symmetrized
+        if len(freqs) == len(matrix) and np.all(freqs > ZERO):
+            flux = freqs[:,None] * matrix
+            if np.allclose(flux, flux.T, atol = ZERO):
+                root_freqs = np.sqrt(freqs)
+                symmetric = matrix * root_freqs[:,None] / root_freqs[None,:]
+                symmetric = 0.5 * (symmetric + symmetric.T)
+                (w, u) = linalg.eigh(symmetric)
+                return (w, u / root_freqs[:,None], u.T * root_freqs[None,:])
+
+        # Otherwise, attempt a general eigendecomposition, which fails for defective (non-diagonalizable) matrices
+        (w, v) = linalg.eig(matrix)
+        if np.linalg.cond(v) > 1./ZERO:
+            return None
+        v_inv = linalg.inv(v)
+        if not np.allclose( np.dot(v * w, v_inv).real, matrix, atol = ZERO ):
+            return None
+        if np.allclose(w.imag, 0.) and np.allclose(v.imag, 0.):
+            return (w.real, v.real, v_inv.real)
+        return (w, v, v_inv)
+
 
-            
     
 
     def assign_name(self, name):
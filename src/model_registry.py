@@ -0,0 +1,225 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    This module defines a registry of models, which builds each distinct model only once and shares it between all requests for an identical model.
+'''
+
+import copy
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from .model import *
+
+
+class ModelRegistry(object):
+    '''
+        Content-addressed, least-recently-used store of Model objects, with a fixed memory budget.
+        A registry is called with the same arguments as Model. Each request is keyed on a canonical hash of its model type, parameters, and keyword arguments (rate heterogeneity settings, **neutral_scaling**, etc.), excluding the model's name. The first request for a key constructs the model (sanity checks, matrix construction, scaling, and any frequency calculation). Later identical requests skip construction entirely, and return a copy of the stored model which shares its rate matrix (or matrices), parameters, and state frequencies, as well as the eigendecompositions and transition-matrix cache entries derived from them.
+
+        Since they are shared, the arrays of registered models are made read-only, and registered models should not be modified, except to assign a name. Each returned model has its own name.
+        Counters for registry hits, misses, and evictions are kept in the attributes **hits**, **misses**, and **evictions**. Evicted models remain usable by those which hold them, but are no longer shared with later requests.
+
+        Examples:
+            .. code-block:: python
+
+               >>> # Models for 100 partitions, built only once
+               >>> registry = ModelRegistry()
+               >>> partitions = [Partition(models = registry("gy", {"omega": 0.5}), size = 50) for i in range(100)]
+               >>> registry.stats()["misses"]
+               1
+    '''
+
+    def __init__(self, max_bytes = 64 * 2**20):
+        '''
+            Optional arguments include,
+                1. **max_bytes**, the memory budget, in bytes, for stored models, counting each model's rate matrices, state frequencies, and eigendecompositions. Least recently used models are evicted once this budget is exceeded. Default: 64 MB.
+        '''
+        assert(max_bytes >= 0), "\n\nThe memory budget for a ModelRegistry must be non-negative."
+        self.max_bytes = max_bytes
+        self._entries  = OrderedDict()
+        self._bytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self._lock     = threading.Lock()
+
+
+
+    def __call__(self, model_type, parameters = None, **kwargs):
+        '''
+            Return a Model for the given arguments (as described for Model), constructing it only if no identical model is registered.
+        '''
+        name = kwargs.pop('name', None)
+        key = self._make_key(model_type, parameters, kwargs)
+        with self._lock:
+            model = self._entries.get(key)
+            if model is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if model is None:
+            # The caller's parameters are left untouched, since Model modifies the dictionary it is given
+            model = Model(model_type, copy.deepcopy(parameters), **kwargs)
+            self._freeze(model)
+            with self._lock:
+                self._store(key, model)
+
+        shared = copy.copy(model)
+        shared.assign_name(name)
+        return shared
+
+
+
+    def _make_key(self, model_type, parameters, kwargs):
+        '''
+            Construct the registry key, a hash of the model type, parameters, and keyword arguments. Model types and parameters which Model treats as equivalent (e.g. "GY94" and "gy", or "omega" and "beta") share a key.
+        '''
+        model_type = model_type.lower().replace("94", "")
+        model_type = {"codon": "gy", "ecm": "ecmrest"}.get(model_type, model_type)
+        parameters = dict(parameters or {})
+        if "omega" in parameters:
+            parameters["beta"] = parameters.pop("omega")
+        digest = hashlib.sha1()
+        self._update_digest(digest, [model_type, parameters, kwargs])
+        return digest.hexdigest()
+
+
+
+    def _update_digest(self, digest, value):
+        '''
+            Add a canonical representation of a value to a hash. Dictionaries are hashed in the order of their keys, and numbers and arrays by their values (so that, e.g., a list and an array of the same numbers are identical).
+        '''
+        if isinstance(value, dict):
+            digest.update(b"{")
+            for key in sorted(value, key = str):
+                self._update_digest(digest, str(key))
+                self._update_digest(digest, value[key])
+            digest.update(b"}")
+        elif isinstance(value, (bool, np.bool_, str)) or value is None:
+            digest.update( (type(value).__name__ + ":" + str(value) + ";").encode() )
+        else:
+            try:
+                array = np.asarray(value)
+            except ValueError:
+                array = np.empty(len(value), dtype = object) # Ragged sequences
+            if array.dtype.kind in "biuf":
+                array = np.ascontiguousarray(array, dtype = float)
+                digest.update( ("array" + str(array.shape) + ":").encode() )
+                digest.update( array.tobytes() )
+            elif array.ndim == 0:
+                digest.update( (type(value).__name__ + ":" + repr(value) + ";").encode() )
+            else:
+                # Non-numeric sequences, e.g. custom codes
+                digest.update(b"[")
+                for item in value:
+                    self._update_digest(digest, item)
+                digest.update(b"]")
+
+
+
+    def _freeze(self, model):
+        '''
+            Make a newly constructed model's arrays read-only, and compute its fingerprint, so that both are shared by all copies.
+        '''
+        matrices = model.matrix if model.is_hetcodon_model() else [model.matrix]
+        arrays = list(matrices) + [model.rate_factors, model.rate_probs] + [value for value in model.params.values() if isinstance(value, np.ndarray)]
+        for array in arrays:
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+        model.fingerprint()
+
+
+
+    def _model_bytes(self, model):
+        '''
+            Memory held by a model: its rate matrices and state frequencies, and, whether or not they are yet computed, their eigendecompositions (about twice the size of the matrices).
+        '''
+        matrices = model.matrix if model.is_hetcodon_model() else [model.matrix]
+        return 3 * sum([np.asarray(m).nbytes for m in matrices]) + np.asarray(model.params["state_freqs"]).nbytes
+
+
+
+    def _store(self, key, model):
+        '''
+            Insert a model into the registry, evicting the least recently used models as needed to remain within the memory budget.
+        '''
+        size = self._model_bytes(model)
+        if size > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = model
+        self._bytes += size
+        self._evict()
+
+
+
+    def _evict(self):
+        '''
+            Evict least recently used models until the registry is within its memory budget.
+        '''
+        while self._bytes > self.max_bytes:
+            (old_key, old_model) = self._entries.popitem(last = False)
+            self._bytes -= self._model_bytes(old_model)
+            self.evictions += 1
+
+
+
+    def resize(self, max_bytes):
+        '''
+            Change the memory budget, in bytes, evicting models as needed.
+        '''
+        assert(max_bytes >= 0), "\n\nThe memory budget for a ModelRegistry must be non-negative."
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+
+
+    def clear(self):
+        '''
+            Remove all models from the registry and reset the counters.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._bytes    = 0
+            self.hits      = 0
+            self.misses    = 0
+            self.evictions = 0
+
+
+
+    def stats(self):
+        '''
+            Return a dictionary of registry statistics: number of stored models, memory in use (bytes), memory budget (bytes), hits, misses, and evictions.
+        '''
+        return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+
+    def __getstate__(self):
+        # The lock cannot be pickled; each copy receives its own.
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+
+# Default registry, for scripts which build the same models repeatedly.
+MODEL_REGISTRY = ModelRegistry()
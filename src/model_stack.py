@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    Define stacks of site-specific evolutionary models, whose rate matrices are built together with whole-array operations.
+'''
+
+import hashlib
+import numpy as np
+from scipy import linalg
+from .matrix_builder import *
+from .genetics import *
+from .parameters_sanity import *
+ZERO      = 1e-8
+MOLECULES = Genetics()
+
+
+class ModelStack(object):
+    '''
+        This class defines a stack of site-specific evolutionary models of a single type, which differ only in their site-specific parameters.
+        Rather than constructing one Model per site, parameters are sanity-checked once, all rate matrices are built together as a single array of shape (models, size, size), and all state frequencies are computed together.
+
+        Currently, stacks of mutation-selection models ("mutsel") are supported, with site-specific state frequencies or fitness values and shared mutation rates.
+    '''
+
+    def __init__(self, model_type, parameters = None, **kwargs):
+        '''
+            Instantiation requires two positional arguments:
+
+                1. **model_type**, the type of models in the stack. Currently, only "mutsel" is supported.
+                2. **parameters**, a dictionary of parameters, as for Model, except that either the key "state_freqs" or "fitness" gives an array with one row of values per model: of shape (models, 4) or (models, 61) for state frequencies, and (models, 4), (models, 20), or (models, 61) for fitness values. All other parameters (e.g. "mu", "kappa", or "Ne") are shared by all models.
+
+            Optional keyword arguments include,
+                1. **name**, the name for a ModelStack object.
+
+            Examples:
+                .. code-block:: python
+
+                   >>> # 1000 site-specific codon models from amino-acid fitness values, with a shared transition/transversion bias
+                   >>> fitness = np.random.normal(size = (1000, 20))
+                   >>> stack = ModelStack("mutsel", {"fitness": fitness, "kappa": 4.})
+                   >>> stack.matrix.shape
+                   (1000, 61, 61)
+        '''
+        self.model_type   = model_type.lower()
+        if parameters is None:
+            self.params = {}
+        else:
+            self.params = parameters
+        self.name         = kwargs.get('name', None)
+        self.rate_probs   = np.ones(1) # Heterogeneity is site-specific, so there is a single rate category
+        self.rate_factors = np.ones(1)
+        self.code         = None
+        self._eigensystems = None # Eigendecompositions of all rate matrices, computed once when first needed
+        self._fingerprint  = None # Hash of the rate matrices, computed once when first needed
+
+        self._check_acceptable_model()
+        self._construct_model()
+
+
+
+    def _check_acceptable_model(self):
+        '''
+            Check that the model type is supported, and that site-specific parameters are given as a two-dimensional array.
+        '''
+        assert(self.model_type == "mutsel"), "\n\nModel stacks may only be constructed for mutation-selection models."
+        assert(type(self.params) is dict), "\n\nThe parameters argument must be a dictionary."
+        for key in ["state_freqs", "fitness"]:
+            if key in self.params:
+                self.params[key] = np.array(self.params[key], dtype = float)
+                assert(self.params[key].ndim == 2 and self.params[key].shape[0] > 0), "\n\nFor a model stack, the value associated with the '" + key + "' key must be an array of shape (models, size)."
+
+
+
+    def _construct_model(self):
+        '''
+            Sanity-check parameters, and construct the stack of rate matrices and state frequencies.
+        '''
+        self.params = MutSel_Sanity(self.model_type, self.params)()
+        self.matrix = MutSel_Matrix(self.model_type, self.params)()
+        if not self.params["calc_by_freqs"]:
+            self._calculate_state_freqs_from_matrices()
+
+        if self.matrix.shape[-1] == 61:
+            self.code = MOLECULES.codons
+        else:
+            self.code = MOLECULES.nucleotides
+
+
+
+    def _calculate_state_freqs_from_matrices(self):
+        '''
+            Determine the stationary frequencies of all rate matrices at once. Frequencies solve pi*Q = 0, subject to the frequencies summing to 1, so one equation of each (singular) system is replaced by this constraint and all systems are solved together.
+        '''
+        size = self.matrix.shape[-1]
+        system = np.array( np.swapaxes(self.matrix, -1, -2) )
+        system[:, -1, :] = 1.
+        constraint = np.zeros( (len(self.matrix), size, 1) )
+        constraint[:, -1] = 1.
+        eq_freqs = np.linalg.solve(system, constraint)[:, :, 0]
+
+        # Equaling zero gets numerically horrible, so clean.
+        eq_freqs[eq_freqs == 0.] = ZERO
+        assert( np.all(np.abs(1. - np.sum(eq_freqs, axis = 1)) <= ZERO) ), "\n\nState frequencies calculated from matrices do not sum to 1."
+        assert( np.allclose(np.einsum("mi,mij->mj", eq_freqs, self.matrix), 0.) ), "\n\nState frequencies not properly calculated."
+        assert( np.all(eq_freqs > -ZERO) ), "\n\nNegative state frequencies calculated from matrices."
+        self.params["state_freqs"] = eq_freqs
+
+
+
+    def transition_matrix(self, t, category = 0):
+        '''
+            Return the transition matrices, P(t) = exp(Qt), of all models at once, as an array of shape (models, size, size), for a given branch length *t*. Since heterogeneity is site-specific, *category* is always 0.
+
+            Transition matrices are computed from eigendecompositions of all rate matrices, which are calculated together, and only once. Matrices which cannot be reliably diagonalized are exponentiated directly.
+        '''
+        if self._eigensystems is None:
+            self._eigensystems = self._decompose_matrices()
+        ((w, left, right), defective) = self._eigensystems
+
+        t = float(t) * self.rate_factors[category]
+        P = np.matmul( left * np.exp(w * t)[:, None, :], right ).real
+        P[P < 0.] = 0.
+        for m in np.flatnonzero(defective):
+            P[m] = linalg.expm( np.multiply(self.matrix[m], t) )
+        assert( np.max( np.abs(np.sum(P, axis = 2) - 1.) ) <= 1e-5 ), "Rows in transition matrix do not each sum to 1."
+        return P
+
+
+
+    def _decompose_matrices(self):
+        '''
+            Compute eigendecompositions of all rate matrices at once, such that each matrix = left * diag(w) * right.
+            Returns the tuple of stacked arrays (w, left, right), and a boolean array marking the models whose matrices cannot be reliably diagonalized.
+
+            When every matrix is reversible with respect to its state frequencies, matrices are symmetrized (as in Model) and the symmetric eigensolver is used. Otherwise, a general eigendecomposition is used.
+        '''
+        matrix = self.matrix
+        freqs = np.array(self.params["state_freqs"], dtype = float)
+
+        # Reversible matrices are symmetrized
+        if np.all(freqs > ZERO):
+            flux = freqs[:, :, None] * matrix
+            if np.allclose(flux, np.swapaxes(flux, 1, 2), atol = ZERO):
+                root_freqs = np.sqrt(freqs)
+                symmetric = matrix * root_freqs[:, :, None] / root_freqs[:, None, :]
+                symmetric = 0.5 * (symmetric + np.swapaxes(symmetric, 1, 2))
+                (w, u) = np.linalg.eigh(symmetric)
+                return (w, u / root_freqs[:, :, None], np.swapaxes(u, 1, 2) * root_freqs[:, None, :]), np.zeros(len(matrix), dtype = bool)
+
+        # Otherwise, attempt a general eigendecomposition, which fails for defective (non-diagonalizable) matrices
+        (w, v) = np.linalg.eig(matrix)
+        defective = np.linalg.cond(v) > 1./ZERO
+        v[defective] = np.eye(matrix.shape[-1])
+        v_inv = np.linalg.inv(v)
+        defective |= ~np.all( np.isclose( np.matmul(v * w[:, None, :], v_inv).real, matrix, atol = ZERO ), axis = (1, 2) )
+        if np.allclose(w.imag, 0.) and np.allclose(v.imag, 0.):
+            return (w.real, v.real, v_inv.real), defective
+        return (w, v, v_inv), defective
+
+
+
+    def fingerprint(self):
+        '''
+            Return a hash string identifying this stack's rate matrices, which is used to key cached transition matrices.
+        '''
+        if self._fingerprint is None:
+            digest = hashlib.sha1()
+            m = np.ascontiguousarray(self.matrix, dtype = float)
+            digest.update( str(m.shape).encode() )
+            digest.update( m.tobytes() )
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+
+
+    def __len__(self):
+        return len(self.matrix)
+
+
+
+    def num_classes(self):
+        '''
+            Return the number of rate classes associated with the models, which is always 1.
+        '''
+        return len(self.rate_probs)
+
+
+
+    def assign_name(self, name):
+        '''
+            Assign name to a ModelStack instance.
+        '''
+        self.name = name
+
+
+
+    def is_hetcodon_model(self):
+        '''
+            Return False, since model stacks are never heterogeneous codon models.
+        '''
+        return False
+
+
+
+    def extract_mutation_rates(self):
+        '''
+            Convenience function for returning the shared mutation rate dictionary to users.
+        '''
+        return self.params["mu"]
+
+
+    def extract_rate_matrix(self):
+        '''
+            Convenience function for returning the stack of rate matrices, of shape (models, size, size).
+        '''
+        return self.matrix
+
+
+    def extract_state_freqs(self):
+        '''
+            Convenience function for returning the stationary frequencies, of shape (models, size).
+        '''
+        return self.params["state_freqs"]
+
+
+    def extract_parameters(self):
+        '''
+            Convenience function for returning the params dictionary.
+        '''
+        return self.params
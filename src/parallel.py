@@ -0,0 +1,328 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    This module runs pyvolve simulations in parallel across processes.
+'''
+
+import os
+import heapq
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from .evolver import *
+from .replicates import *
+
+
+# Evolver instance held by each worker process of a ReplicateFarm or SubtreeEvolver. It is built once per worker, so that the tree and partitions are shipped to each worker only once.
+_WORKER_EVOLVER = None
+
+
+def _init_replicate_worker(tree, partitions, evolver_kwargs):
+    '''
+        Build the Evolver instance used by a ReplicateFarm worker process.
+    '''
+    global _WORKER_EVOLVER
+    _WORKER_EVOLVER = Evolver(tree = tree, partitions = partitions, **evolver_kwargs)
+
+
+
+def _run_worker_replicates(indices, seeds, call_kwargs):
+    '''
+        Simulate a chunk of replicates with the worker process's Evolver.
+    '''
+    return _simulate_replicates(_WORKER_EVOLVER, indices, seeds, call_kwargs)
+
+
+
+def _init_subtree_worker(tree, partitions, evolver_kwargs):
+    '''
+        Build the Evolver instance used by a SubtreeEvolver worker process. The tree is compiled into the same simulation plan as in the main process, so that subtrees can be sent as blocks of the plan.
+    '''
+    global _WORKER_EVOLVER
+    _WORKER_EVOLVER = Evolver(tree = tree, partitions = partitions, **evolver_kwargs)
+
+
+
+def _run_worker_subtree(*args):
+    '''
+        Evolve a subtree with the worker process's Evolver.
+    '''
+    return _evolve_subtree(_WORKER_EVOLVER, *args)
+
+
+
+def _evolve_subtree(evolve, start, stop, parent_seq, partition_seeds, num_replicates, scale_tree):
+    '''
+        Evolve the subtree occupying the block [*start*, *stop*) of the simulation plan, from its parent's integer state array *parent_seq*, using Evolver *evolve*.
+        Each partition draws from a generator seeded with the corresponding entry of *partition_seeds*, so that the subtree is evolved identically wherever it runs.
+        Returns a dictionary of tip state arrays and a dictionary of retained ancestral state arrays.
+    '''
+    evolve._num_replicates = num_replicates
+    evolve.scale_tree      = scale_tree
+    evolve._partition_rngs = [np.random.default_rng(seed) for seed in partition_seeds]
+    evolve._leaf_sites     = {}
+    evolve._evolved_sites  = {}
+    evolve._execute_plan(start, stop, parent_seq)
+    
+    leaves = evolve._leaf_sites
+    ancestors = {name: evolve._evolved_sites[name] for name in evolve._evolved_sites if name not in leaves}
+    evolve._leaf_sites, evolve._evolved_sites = {}, {}
+    return leaves, ancestors
+
+
+
+def _simulate_replicates(evolve, indices, seeds, call_kwargs):
+    '''
+        Simulate each replicate in *indices* with its own SeedSequence from *seeds*, using Evolver *evolve*. 
+        Any requested output files are written with the replicate number inserted before the extension.
+        Returns a list of (tip states, ancestral states, site rates) tuples, one per replicate, along with the tip and ancestor names.
+    '''
+    results = []
+    for (index, seed) in zip(indices, seeds):
+        kwargs = dict(call_kwargs)
+        for key in ['seqfile', 'ratefile', 'infofile']:
+            if kwargs[key]:
+                kwargs[key] = evolve._replicate_filename(kwargs[key], index)
+        evolve(seed = seed, **kwargs)
+        
+        # Retained sequences are sliced from the buffer, as in Evolver._process_replicates, so that no ancestors need be kept
+        num_taxa = evolve._num_buffer_leaves
+        taxa = evolve._buffer_names[:num_taxa]
+        ancestors = evolve._buffer_names[num_taxa:]
+        states = np.array( evolve._sites_buffer[0, :num_taxa] )
+        ancestral_states = np.array( evolve._sites_buffer[0, num_taxa:] )
+        results.append( (states, ancestral_states, evolve._site_rates[0]) )
+    return taxa, ancestors, results
+
+
+
+
+class ReplicateFarm(object):
+    '''
+        This callable class simulates replicate alignments across a pool of worker processes.
+        
+        Every replicate is simulated on its own random stream, spawned from a single numpy SeedSequence. Replicate i therefore always receives the same stream, and results are bit-identical regardless of the number of workers. The tree and partitions are shipped to each worker process once, when the worker starts, rather than with every task.
+        
+        Note that the division of each partition's sites into rate categories is fixed when a Partition is created, and is therefore shared by all replicates.
+    '''
+    
+    def __init__(self, **kwargs):
+        '''
+            Required keyword arguments include,
+                1. **tree** is the phylogeny (parsed with the ``newick.read_tree`` function) along which sequences are evolved
+                2. **partitions** (or **partition**) is a list of Partition instances to evolve.
+            
+            Optional keyword arguments include,
+                1. **workers** is the number of worker processes. Default: the number of CPUs. With a single worker, replicates are simulated in the current process.
+                2. **seed** is the master seed (an integer or numpy SeedSequence) from which every replicate's random stream is spawned. Default: None, in which case each call draws a new master seed from numpy's global random state, so that ``np.random.seed`` still makes simulations reproducible.
+                3. **chunksize** is the number of replicates sent to a worker in each task. Default: the number of replicates divided evenly into four tasks per worker.
+                
+            Any other keyword arguments are passed on to each worker's Evolver.
+
+            Examples:
+                .. code-block:: python
+                   
+                   >>> # Simulate 10000 replicates across 8 processes, reproducibly
+                   >>> farm = ReplicateFarm(tree = my_tree, partitions = my_partitions, workers = 8, seed = 1234)
+                   >>> reps = farm(10000)
+                   
+                   >>> # Also write an alignment file for each replicate: my_seqs_1.fasta, my_seqs_2.fasta, ...
+                   >>> reps = farm(100, seqfile = "my_seqs.fasta")
+        '''
+        self.tree       = kwargs.pop('tree', None)
+        self.partitions = kwargs.pop('partitions', None)
+        if self.partitions is None:
+            self.partitions = kwargs.pop('partition', None)
+        self.workers    = kwargs.pop('workers', None)
+        if self.workers is None:
+            self.workers = os.cpu_count() or 1
+        assert(type(self.workers) is int and self.workers > 0), "\n\nThe number of workers must be a positive integer."
+        self.chunksize  = kwargs.pop('chunksize', None)
+        
+        seed = kwargs.pop('seed', None)
+        self._legacy_seeding = seed is None # Seed each call from numpy's global random state?
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+        self._evolver_kwargs = kwargs
+
+        # Build an Evolver here as well, so that any problems with the tree and partitions surface immediately
+        self._evolver = Evolver(tree = self.tree, partitions = self.partitions, **kwargs)
+        
+
+
+    def __call__(self, replicates, **kwargs):
+        '''
+            Simulate replicate alignments, and return a Replicates object. The SeedSequence used for each replicate is recorded in the Replicates object's **seeds** attribute.
+            Note that each call spawns fresh streams from the master seed, so repeated calls give new replicates.
+            
+            Required positional arguments include,
+                1. **replicates** is the number of replicate alignments to simulate.
+            
+            Optional keyword arguments include **seqfile**, **seqfmt**, **ratefile**, **infofile**, **write_anc**, **scale_tree**, and **store**, as described for ``Evolver.__call__``. Files are written only when named explicitly, with the replicate number (from 1) inserted before each file's extension. Replicates are appended to a **store** in order, once all have been simulated.
+        '''
+        assert(type(replicates) is int and replicates > 0), "\n\nThe number of replicates must be a positive integer."
+        call_kwargs = {"seqfile": kwargs.get('seqfile', None), "seqfmt": kwargs.get('seqfmt', 'fasta'), "ratefile": kwargs.get('ratefile', None), "infofile": kwargs.get('infofile', None), "write_anc": kwargs.get('write_anc', False), "scale_tree": kwargs.get('scale_tree', 1.)}
+        if self._legacy_seeding:
+            self.seed_sequence = np.random.SeedSequence( np.random.randint(2**32, size = 4) )
+        seeds = self.seed_sequence.spawn(replicates)
+        indices = list(range(replicates))
+        
+        if self.workers == 1:
+            (taxa, ancestors, results) = _simulate_replicates(self._evolver, indices, seeds, call_kwargs)
+        else:
+            chunksize = self.chunksize
+            if chunksize is None:
+                chunksize = max(1, int(np.ceil( replicates / (4. * self.workers) )))
+            results = []
+            with ProcessPoolExecutor(max_workers = self.workers, initializer = _init_replicate_worker, initargs = (self.tree, self.partitions, self._evolver_kwargs)) as pool:
+                futures = [pool.submit(_run_worker_replicates, indices[i:i+chunksize], seeds[i:i+chunksize], call_kwargs) for i in range(0, replicates, chunksize)]
+                for future in futures:
+                    (taxa, ancestors, chunk) = future.result()
+                    results.extend(chunk)
+
+        states = np.stack( [r[0] for r in results] )
+        ancestral_states = np.stack( [r[1] for r in results] )
+        site_rates = np.stack( [r[2] for r in results] )
+        if kwargs.get('store', None) is not None:
+            kwargs['store'].append(states, site_rates, taxa, self._evolver._code, self._evolver._site_partitions)
+        return Replicates(taxa, states, ancestors, ancestral_states, site_rates, self._evolver._site_partitions, self._evolver._code, seeds = seeds)
+
+
+
+
+class SubtreeEvolver(Evolver):
+    '''
+        This Evolver subclass evolves independent subtrees of a large phylogeny in worker processes.
+        
+        The tree is split into a given number of subtrees of balanced size (in number of tips), by repeatedly dividing the largest remaining subtree at its root. The nodes above these subtrees are evolved in the current process. Once the parent of a subtree has a sequence, the subtree is sent to a worker process, where it is evolved on its own random streams, and only its tip sequences (and, if requested, its ancestral sequences) are gathered back.
+        
+        The random streams given to each subtree are drawn, in tree order, from the Evolver's generator, so that a given seed and number of subtrees reproduce the same simulation regardless of the number of workers.
+        
+        Unless ancestral sequences are requested with the **ancestors** argument, only tip sequences are retained and gathered, so that Replicates objects give tips only, and **write_anc** and ``get_sequences(anc = True)`` may not be used.
+    '''
+    
+    def __init__(self, **kwargs):
+        '''
+            Required keyword arguments are as for Evolver.
+            
+            Optional keyword arguments include,
+                1. **workers** is the number of worker processes. Default: the number of CPUs. With a single worker, subtrees are evolved in turn in the current process.
+                2. **subtrees** is the number of subtrees into which the tree is split. Default: four per worker.
+            
+            Any other keyword arguments are as described for Evolver. Note that the default for **ancestors** is False here, so that no ancestral sequences are gathered.
+            
+            Examples:
+                .. code-block:: python
+                   
+                   >>> # Evolve a 50,000-taxon tree across 16 processes
+                   >>> evolve = SubtreeEvolver(tree = my_big_tree, partitions = my_partitions, workers = 16, seed = 1234)
+                   >>> evolve(seqfile = "big_alignment.fasta")
+        '''
+        self.workers = kwargs.pop('workers', None)
+        if self.workers is None:
+            self.workers = os.cpu_count() or 1
+        assert(type(self.workers) is int and self.workers > 0), "\n\nThe number of workers must be a positive integer."
+        self.subtrees = kwargs.pop('subtrees', 4 * self.workers)
+        assert(type(self.subtrees) is int and self.subtrees > 0), "\n\nThe number of subtrees must be a positive integer."
+        kwargs.setdefault('ancestors', False)
+        
+        super(SubtreeEvolver, self).__init__(**kwargs)
+        self._worker_kwargs = {key: kwargs[key] for key in kwargs if key not in ['tree', 'partitions', 'partition']}
+        self._local_evolver = None
+        self._plan_index = dict( zip(self._plan_names, range(len(self._plan_names))) )
+        
+        
+        
+    def _simulate(self):
+        '''
+            Simulate sequences along the entire tree. The tree is split into subtrees, which are evolved by the worker processes once their parent sequences are known.
+        '''
+        if self.subtrees < 2:
+            super(SubtreeEvolver, self)._simulate()
+            return
+
+        frontier = self._split_plan()
+        
+        # Evolve the nodes above the subtrees, collecting a task for each subtree whose parent sequence is now known
+        tasks = []
+        seqs = {} # Sequences still needed to evolve children, released once the last child is evolved (or its subtree collected)
+        n = 0
+        while n < len(self._plan_names):
+            parent = self._plan_parents[n]
+            if n in frontier and not self._plan_leaves[n]:
+                tasks.append( (n, self._plan_ends[n], seqs[parent]) )
+                next_n = self._plan_ends[n]
+            else:
+                if parent < 0:
+                    seq = self._generate_root_seq()
+                else:
+                    seq = self._evolve_branch(n, seqs[parent])
+                if not self._plan_leaves[n]:
+                    seqs[n] = seq
+                if self._plan_keep[n]:
+                    self._finalize_node(n, seq)
+                next_n = n + 1
+            if parent >= 0 and n == self._plan_last_child[parent]:
+                del seqs[parent]
+            n = next_n
+
+        # Every subtree receives its own random stream for each partition. Sequences are finalized (and sent to any sinks) as each subtree is returned.
+        seeds = self._rng.integers(2**63, size = (len(tasks), len(self.partitions)))
+        args = [ (task[0], task[1], task[2], seeds[i], self._num_replicates, self.scale_tree) for (i, task) in enumerate(tasks) ]
+        if self.workers == 1 or len(tasks) < 2:
+            if self._local_evolver is None:
+                self._local_evolver = Evolver(tree = self.full_tree, partitions = self.partitions, **self._worker_kwargs)
+            for arg in args:
+                self._finalize_subtree( *_evolve_subtree(self._local_evolver, *arg) )
+        else:
+            with ProcessPoolExecutor(max_workers = min(self.workers, len(tasks)), initializer = _init_subtree_worker, initargs = (self.full_tree, self.partitions, self._worker_kwargs)) as pool:
+                futures = [pool.submit(_run_worker_subtree, *arg) for arg in args]
+                for future in futures:
+                    self._finalize_subtree( *future.result() )
+        
+        # Order retained sequences as in the tree
+        leaves, evolved = self._leaf_sites, self._evolved_sites
+        self._leaf_sites = {name: leaves[name] for name in self._plan_names if name in leaves}
+        self._evolved_sites = {name: evolved[name] for name in self._plan_names if name in evolved}
+
+
+
+    def _finalize_subtree(self, leaves, ancestors):
+        '''
+            Finalize the tip and retained ancestral sequences returned from a subtree.
+        '''
+        for name in ancestors:
+            self._finalize_node(self._plan_index[name], ancestors[name])
+        for name in leaves:
+            self._finalize_node(self._plan_index[name], leaves[name])
+
+
+
+    def _split_plan(self):
+        '''
+            Split the tree into (at most) self.subtrees subtrees of balanced size, by repeatedly dividing the subtree with the most tips at its root.
+            Returns the set of plan indices at the base of each subtree.
+        '''
+        # Count tips below each node, and list each node's children
+        tips = self._plan_leaves.astype(int)
+        children = [[] for n in range( len(self._plan_names) )]
+        for n in range(len(self._plan_names) - 1, 0, -1):
+            tips[ self._plan_parents[n] ] += tips[n]
+            children[ self._plan_parents[n] ].insert(0, n)
+        
+        heap = [(-tips[0], 0)]
+        while len(heap) < self.subtrees:
+            n = heap[0][1]
+            if self._plan_leaves[n]:
+                break
+            heapq.heappop(heap)
+            for child in children[n]:
+                heapq.heappush(heap, (-tips[child], child))
+        return set([entry[1] for entry in heap])
@@ -74,8 +74,8 @@ class ParametersSanity(object):
         '''
             State frequency sanity checks common to all child classes.
         '''
-        assert( len(self.params['state_freqs']) == self.size ), "\n\nThe value associated with the 'state_freqs' key in the provided parameters dictionary does not contain the correct number of values for your specified model."
-        assert( abs(1. - np.sum(self.params['state_freqs']) <= ZERO) ), "\n\nProvided state frequencies do not sum to 1."
+        assert( np.shape(self.params['state_freqs'])[-1] == self.size ), "\n\nThe value associated with the 'state_freqs' key in the provided parameters dictionary does not contain the correct number of values for your specified model."
+        assert( np.all(1. - np.sum(self.params['state_freqs'], axis = -1) <= ZERO) ), "\n\nProvided state frequencies do not sum to 1."
 
 
 
@@ -266,14 +266,10 @@ class MechCodon_Sanity(ParametersSanity):
             Calculate state codon frequencies from nucleotide frequencies for use in an MG-style model.
             NOTE: F1x4 are calculated because these *are* the state frequencies for an MG-stye model.
         '''
-        f1x4 = np.ones(61)
-        nf = self.params["nuc_freqs"]
+        nf = np.asarray(self.params["nuc_freqs"])
         assert( abs(np.sum(nf) - 1.) <= ZERO), "\n\nProvided nucleotide frequencies for an MG-style model do not sum to 1."
         pi_stop = (nf[3]*nf[0]*nf[2]) + (nf[3]*nf[2]*nf[0]) + (nf[3]*nf[0]*nf[0])
-        for i in range(61):
-            codon = MOLECULES.codons[i]
-            for j in range(3):
-                f1x4[i] *= nf[ MOLECULES.nucleotides.index(codon[j]) ]
+        f1x4 = np.prod( nf[MOLECULES.codon_nucleotides], axis = 1 )
         f1x4 /= (1. - pi_stop)
         assert( abs(np.sum(f1x4) - 1.) <= ZERO ), "\n\nCould not properly calculate F1x4 frequencies for an MG-style model."
         return f1x4
@@ -356,7 +352,7 @@ class MutSel_Sanity(ParametersSanity):
 
     def _sanity_state_freqs_fitness(self):
         '''
-            Check that either state_freqs or fitness have been properly provided for a MutSel model.
+            Check that either state_freqs or fitness have been properly provided for a MutSel model. Either may also be given as an array of shape (models, size), for a stack of models (see ModelStack).
             Additionally, add these keys to the parameters dictionary:
                 1. "codon_model". Boolean indicating if this is a "codon" (1) or "nucleotide" (0) MutSel model
                 2. "calc_by_freqs". Boolean indicating if calculations will be done using "state_freqs" (1) or "fitness" (0) values
@@ -367,11 +363,11 @@ class MutSel_Sanity(ParametersSanity):
         if 'state_freqs' in self.params:
             self.params["calc_by_freqs"] = True
 
-            if len(self.params['state_freqs']) == len(MOLECULES.codons):
+            if np.shape(self.params['state_freqs'])[-1] == len(MOLECULES.codons):
                 self.size = len(MOLECULES.codons)
                 self.params["codon_model"] = True
 
-            elif len(self.params['state_freqs']) == len(MOLECULES.nucleotides):
+            elif np.shape(self.params['state_freqs'])[-1] == len(MOLECULES.nucleotides):
                 self.size = len(MOLECULES.nucleotides)
                 self.params["codon_model"] = False
 
@@ -382,14 +378,14 @@ class MutSel_Sanity(ParametersSanity):
         elif 'fitness' in self.params:
             self.params["calc_by_freqs"] = False
 
-            if len(self.params['fitness']) == len(MOLECULES.codons) or len(self.params['fitness']) == len(MOLECULES.amino_acids):
+            if np.shape(self.params['fitness'])[-1] == len(MOLECULES.codons) or np.shape(self.params['fitness'])[-1] == len(MOLECULES.amino_acids):
                 self.params["codon_model"] = True
 
                 # Replace length-20 fitness with length-61 fitness, assuming equal fitness for synonymous codons.
-                if len(self.params['fitness']) == len(MOLECULES.amino_acids):
+                if np.shape(self.params['fitness'])[-1] == len(MOLECULES.amino_acids):
                     self._amino_to_codon_fitness()
 
-            elif len(self.params['fitness']) == len(MOLECULES.nucleotides):
+            elif np.shape(self.params['fitness'])[-1] == len(MOLECULES.nucleotides):
                 self.params["codon_model"] = False
 
             else:
@@ -419,15 +415,4 @@ class MutSel_Sanity(ParametersSanity):
         '''
             Convert a vector of amino acid fitness values to codon fitness values, assuming equal fitness among synonymous codons.
         '''
-        d = {}
-        for i in range(20):
-            syn_codons = MOLECULES.genetic_code[i]
-            for syn in syn_codons:
-                d[ syn ] = self.params['fitness'][i]
-
-        codon_fitness = np.zeros(61)
-        count = 0
-        for i in range(61):
-            codon_fitness[i] = d[MOLECULES.codons[i]]
-
-        self.params['fitness'] = codon_fitness
+        self.params['fitness'] = np.asarray(self.params['fitness'], dtype = float)[..., MOLECULES.codon_amino_acids]
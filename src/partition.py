@@ -7,10 +7,12 @@
 ##############################################################################
 
 '''
-    This module defines the Partition() class, which indicates a particular evolutionary unit. 
+    This module defines the Partition() class, which indicates a particular evolutionary unit, and the SiteModelPartition() class, a partition in which every site evolves according to its own model.
 '''
 
+import mmap
 from .model import * 
+from .model_stack import *
 
 class Partition():
 
@@ -23,8 +25,9 @@ class Partition():
         
             Optional keyword arguments:
             
-                1. **root_sequence**, a string giving the ancestral sequence for this partition. Note that, when provided, the **size** argument is not needed.
-                2. **root_model_name**, the *name attribute* of the model to be used at the root of the phylogeny. Applicable only to cases of *branch heterogeneity*.
+                1. **root_sequence**, a string giving the ancestral sequence for this partition. Note that, when provided, the **size** argument is not needed. A bytes-like object (e.g. bytes, or a memory-mapped file from Python's mmap module) may be given instead of a string, and is read without being copied into a string.
+                2. **root_file**, the name of a file holding the ancestral sequence for this partition, as an alternative to **root_sequence** for very long (e.g. chromosome-length) sequences. The file holds either the sequence alone, or a single FASTA record. A file holding the sequence alone (on one line) is memory-mapped, rather than read.
+                3. **root_model_name**, the *name attribute* of the model to be used at the root of the phylogeny. Applicable only to cases of *branch heterogeneity*.
 
             Examples:
                 .. code-block:: python
@@ -34,18 +37,26 @@ class Partition():
                    
                    >>> # Define a temporally heterogeneous partition, in which three models (model1, model2, and rootmodel) are used during sequence evolution, and rootmodel is the model at the root of the tree
                    >>> my_other_partition = Partition(models = [model1, model2, rootmodel], size = 134, root_model_name = rootmodel.name)       
+
+                   >>> # Define a partition which evolves from a chromosome-length root sequence, stored in a file
+                   >>> my_long_partition = Partition(models = my_model, root_file = "chr1.fasta")
                 
         '''
                 
                 
         self.size              = kwargs.get('size', None)   # Will be converted to list of integers representing partition length. If there is no rate heterogeneity, then the list is length 1. Else, list is length k, where k is the number of rate categories.
-        self.MRCA              = kwargs.get('root_sequence', None) # String of root sequence. If provided, all specified rate heterogeneity and the size argument *will be ignored*.
+        self.MRCA              = kwargs.get('root_sequence', None) # String (or bytes-like object) of root sequence. If provided, all specified rate heterogeneity and the size argument *will be ignored*.
+        root_file              = kwargs.get('root_file', None)
+        if root_file is not None:
+            assert(self.MRCA is None), "\n\nProvide either a root sequence or a root file for your Partition, not both."
+            self.MRCA = self._read_root_file(root_file)
         self.models            = kwargs.get('models', None)  # List of models associated with this partition. When length 1 (or not provided as a list) temporally homogeneous.
         if self.models is None:
             self.model         = kwargs.get('model', None)
         self.root_model_name   = kwargs.get('root_model_name', None)  # NAME of Model beginning evolution at root of tree. Used under *branch heterogeneity*, and should be None or False if process is temporally homogeneous. If there is branch heterogeneity, this string *MUST* correspond to one of the Model() object's names.
         self._shuffle          = False # Shuffle sites after evolving?
         self._root_model       = None  # The actual root model object.
+        self.site_models       = None  # Index of each site's model in a ModelStack (SiteModelPartition only)
 
         self._partition_sanity()
         self._size_MRCA_sanity()
@@ -61,7 +72,7 @@ class Partition():
         assert(self.size is not None or self.MRCA is not None), "\n\nWhen defining a Partition object, you must specify either a root sequence or a partition size."
         
         if self.MRCA is not None:
-            assert(type(self.MRCA) is str), "\n\nThe provided root sequence in your Partition object must be a string."
+            assert(isinstance(self.MRCA, (str, bytes, bytearray, memoryview, mmap.mmap, np.ndarray))), "\n\nThe provided root sequence in your Partition object must be a string (or bytes-like object)."
             if self.size is not None:
                 print("\n\nWARNING: You provided both a size and a root sequence for your Partition. The size argument will be ignored.")
             code_step = len(self._root_model.code[0])
@@ -75,6 +86,28 @@ class Partition():
 
 
 
+    def _read_root_file(self, root_file):
+        '''
+            Return the root sequence held in a file, as an array of bytes. A file holding the sequence alone is memory-mapped, ignoring any trailing whitespace. A FASTA file (or a file whose sequence spans several lines) is read, ignoring the header line and all whitespace.
+        '''
+        whitespace = np.frombuffer(b" \t\r\n", dtype = np.uint8)
+        raw = np.memmap(root_file, dtype = np.uint8, mode = "r")
+        start = 0
+        if len(raw) > 0 and raw[0] == ord(">"):
+            newlines = np.flatnonzero(raw == ord("\n"))
+            start = newlines[0] + 1 if len(newlines) > 0 else len(raw)
+        sequence = raw[start:]
+        is_space = np.isin(sequence, whitespace)
+        content = np.flatnonzero(~is_space)
+        if len(content) == 0:
+            return sequence[:0]
+        if start == 0 and not np.any(is_space[:content[-1]]):
+            return sequence[:content[-1] + 1]
+        return np.array(sequence[~is_space])
+
+
+
+
     def _partition_sanity(self):
         ''' 
             Sanity checks that Partition has been properly setup.
@@ -155,5 +188,65 @@ class Partition():
         '''
             Return True if the partition is evolving with dN/dS heterogeneity, and False otherwise.
         '''
-        return self.models[0].is_codon_model()
+        return self.models[0].is_hetcodon_model()
+
+
+
+
+
+class SiteModelPartition(Partition):
+    '''
+        Partition in which every site evolves according to its own model, taken from a ModelStack. Rather than defining one Partition (and one Model) per site, all sites are evolved together: along each branch, the transition matrices of all models in the stack are computed at once, and every site samples its new state from its own model's matrix in a single vectorized step.
+        Sites keep their order, and the partition has a single rate category, so that the site rate information written by Evolver gives each site's partition and category 1.
+    '''
+
+    def __init__(self, **kwargs):
+        '''
+            Required keyword arguments:
+
+                1. **models** (or **model**), either a single ModelStack object (for cases of branch homogeneity), or a list of named ModelStack objects, each with the same number of models (for cases of branch heterogeneity).
 
+            Optional keyword arguments:
+
+                1. **site_models**, a list or array giving, for each site, the index of its model in the stack. Sites may share models. Default: one site for each model, in order.
+                2. **size**, integer giving the root length of this partition. If given, it must equal the number of sites in **site_models**.
+                3. **root_sequence**, **root_file**, and **root_model_name**, as for Partition. A root sequence must have one state for each site in **site_models**.
+
+            Examples:
+                .. code-block:: python
+
+                   >>> # Evolve 1000 sites, each according to its own mutation-selection model
+                   >>> stack = ModelStack("mutsel", {"fitness": my_fitness_array}) # Of shape (1000, 20)
+                   >>> my_partition = SiteModelPartition(models = stack)
+
+                   >>> # Evolve 5000 sites, drawn from the same 1000 models
+                   >>> my_other_partition = SiteModelPartition(models = stack, site_models = np.random.randint(1000, size = 5000))
+        '''
+        models = kwargs.get('models', kwargs.get('model', None))
+        stacks = models if type(models) is list else [models]
+        for stack in stacks:
+            assert(isinstance(stack, ModelStack)), "\n\nThe models of a SiteModelPartition must be ModelStack objects."
+            assert(len(stack) == len(stacks[0])), "\n\nAll ModelStack objects in a SiteModelPartition must have the same number of models."
+
+        site_models = kwargs.get('site_models', None)
+        if site_models is None:
+            site_models = np.arange( len(stacks[0]) )
+        site_models = np.array(site_models, dtype = np.intp)
+        assert(site_models.ndim == 1 and len(site_models) > 0), "\n\nThe argument site_models must be a list of model indices, one for each site."
+        assert(np.all(site_models >= 0) and np.all(site_models < len(stacks[0]))), "\n\nThe argument site_models must only contain indices of models in the ModelStack."
+        if kwargs.get('size', None) is not None:
+            assert(kwargs['size'] == len(site_models)), "\n\nThe size of a SiteModelPartition must equal the number of sites in site_models."
+        if kwargs.get('root_sequence', None) is None and kwargs.get('root_file', None) is None:
+            kwargs['size'] = len(site_models)
+
+        super(SiteModelPartition, self).__init__(**kwargs)
+        self.site_models = site_models
+        assert(sum(self.size) == len(self.site_models)), "\n\nThe root sequence of a SiteModelPartition must have one state for each site in site_models."
+
+
+
+    def _divvy_partition_size(self):
+        '''
+            Turn size attribute into a list holding the full size, since all sites belong to a single rate category.
+        '''
+        self.size = [int(self.size)]
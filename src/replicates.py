@@ -0,0 +1,273 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    This module defines objects for working with replicate simulated alignments.
+'''
+
+import os
+import json
+import numpy as np
+from .sequences import *
+
+
+class Replicates(object):
+    '''
+        Container for a set of replicate alignments simulated along the same tree with the same partitions, as returned by ``Evolver`` when called with the **replicates** argument.
+
+        Attributes include,
+            1. **states**, an integer array of shape (replicates, taxa, sites) containing the simulated tip sequences
+            2. **taxa**, a list of tip names, ordered as in the second dimension of **states**
+            3. **ancestral_states**, an integer array of shape (replicates, internal nodes, sites) containing simulated ancestral sequences (including the root)
+            4. **ancestors**, a list of internal node names, ordered as in the second dimension of **ancestral_states**
+            5. **site_rates**, an integer array of shape (replicates, sites) giving the rate category of each site (indexed from 0)
+            6. **site_partitions**, an integer array of length sites giving the partition of each site (indexed from 0)
+            7. **code**, the list of states (alphabet) which the integers in **states** index
+            8. **seeds**, a list giving the numpy SeedSequence used to simulate each replicate, when replicates were simulated on independent random streams (e.g. by a ReplicateFarm). Otherwise, None.
+
+        Examples:
+            .. code-block:: python
+
+               >>> # Simulate 1000 replicates in a single tree traversal
+               >>> evolve = Evolver(tree = my_tree, partitions = my_partition)
+               >>> reps = evolve(replicates = 1000)
+               >>> len(reps)
+               1000
+               >>> reps.states.shape
+               (1000, 5, 100)
+               >>> # Dictionary of tip sequence strings for the first replicate
+               >>> seqs = reps[0]
+    '''
+
+    def __init__(self, taxa, states, ancestors, ancestral_states, site_rates, site_partitions, code, seeds = None):
+        self.taxa             = taxa
+        self.states           = states
+        self.ancestors        = ancestors
+        self.ancestral_states = ancestral_states
+        self.site_rates       = site_rates
+        self.site_partitions  = site_partitions
+        self.code             = code
+        self.seeds            = seeds
+        self._code_table      = code_table(code)
+
+
+
+    def __len__(self):
+        return self.states.shape[0]
+
+
+
+    def __getitem__(self, index):
+        '''
+            Return a dictionary of tip sequence strings for replicate *index*.
+        '''
+        return self.get_sequences(index)
+
+
+
+    def get_sequences(self, index, anc = False):
+        '''
+            Return a dictionary of sequence strings for replicate *index*.
+            Default anc = False will return tip sequences only. If anc == True, ancestral sequences are included as well.
+        '''
+        seqs = {}
+        for t in range(len(self.taxa)):
+            seqs[self.taxa[t]] = states_to_sequence( self.states[index, t], self.code, self._code_table )
+        if anc:
+            for a in range(len(self.ancestors)):
+                seqs[self.ancestors[a]] = states_to_sequence( self.ancestral_states[index, a], self.code, self._code_table )
+        return seqs
+
+
+
+
+class ReplicateStore(object):
+    '''
+        Appendable, memory-mapped store for large numbers of replicate alignments, kept in a single directory rather than in separate files for each replicate.
+        
+        The directory holds,
+            1. **index.json**, which records the tip names, code, number of sites, partition of each site, and data types
+            2. **states.bin**, the tip states of every replicate, stored consecutively as fixed-size (taxa, sites) blocks
+            3. **rates.bin**, the rate category of every site of every replicate, stored consecutively as fixed-size blocks
+            4. **count**, the number of complete replicates in the store
+        
+        Since every replicate occupies a block of the same size, replicate i (and tip j within it) is accessed in constant time, as a view of a memory-mapped file. Replicates are appended by writing new blocks to the end of the data files, and are only made visible to readers once fully written, by atomically replacing the count file. Any number of readers may therefore use a store while a single writer appends to it; readers see new replicates after calling ``refresh`` (which ``len`` does automatically).
+
+        Examples:
+            .. code-block:: python
+
+               >>> # Append 1000 replicates at a time to a store
+               >>> store = ReplicateStore("my_campaign")
+               >>> for i in range(100):
+               ...     evolve(replicates = 1000, store = store)
+               >>> # Elsewhere, read replicate 12345 as sequence strings, or tip 3 of that replicate as integer states
+               >>> store = ReplicateStore("my_campaign", mode = "r")
+               >>> seqs = store.get_sequences(12345)
+               >>> states = store.get_states(12345, taxon = 3)
+    '''
+
+    def __init__(self, path, mode = "a"):
+        '''
+            Required positional arguments include,
+                1. **path**, the directory of the store. It is created, if needed, when the first replicates are appended.
+            
+            Optional arguments include,
+                1. **mode**, either "a" to append to (or create) the store, or "r" to open an existing store for reading only. Default: "a".
+        '''
+        assert(mode in ["a", "r"]), "\n\nA ReplicateStore must be opened with mode 'a' (append) or 'r' (read)."
+        self.path   = path
+        self.mode   = mode
+        self._count = 0
+        self._states_map = None
+        self._rates_map  = None
+        self.taxa = None
+        if os.path.exists( os.path.join(path, "index.json") ):
+            self._read_index()
+            self.refresh()
+        else:
+            assert(mode == "a"), "\n\nNo ReplicateStore was found at " + str(path) + "."
+
+
+
+    def _read_index(self):
+        '''
+            Read the store's index, which describes the layout of each replicate.
+        '''
+        with open( os.path.join(self.path, "index.json"), "r" ) as handle:
+            index = json.load(handle)
+        self.taxa            = index["taxa"]
+        self.code            = index["code"]
+        self.num_sites       = index["num_sites"]
+        self.site_partitions = np.array( index["site_partitions"] )
+        self._state_dtype    = np.dtype( index["state_dtype"] )
+        self._rate_dtype     = np.dtype( index["rate_dtype"] )
+        self._code_table     = code_table(self.code)
+
+
+
+    def _create(self, taxa, code, site_partitions, state_dtype):
+        '''
+            Create the store's directory, index, and empty data files.
+        '''
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        index = {"taxa": [str(name) for name in taxa], "code": list(code), "num_sites": int(len(site_partitions)), "site_partitions": [int(p) for p in site_partitions], "state_dtype": np.dtype(state_dtype).str, "rate_dtype": np.dtype(np.uint16).str}
+        with open( os.path.join(self.path, "index.json"), "w" ) as handle:
+            json.dump(index, handle)
+        for name in ["states.bin", "rates.bin"]:
+            open( os.path.join(self.path, name), "wb" ).close()
+        self._write_count(0)
+        self._read_index()
+
+
+
+    def _write_count(self, count):
+        '''
+            Atomically record the number of complete replicates.
+        '''
+        temp = os.path.join(self.path, "count.tmp")
+        with open(temp, "w") as handle:
+            handle.write( str(count) )
+        os.replace( temp, os.path.join(self.path, "count") )
+
+
+
+    def refresh(self):
+        '''
+            Update the number of replicates available, mapping any replicates appended since the store was opened or last refreshed.
+        '''
+        with open( os.path.join(self.path, "count"), "r" ) as handle:
+            count = int( handle.read() )
+        if count != self._count or self._states_map is None:
+            self._count = count
+            if count > 0:
+                shape = (count, len(self.taxa), self.num_sites)
+                self._states_map = np.memmap( os.path.join(self.path, "states.bin"), dtype = self._state_dtype, mode = "r", shape = shape )
+                self._rates_map  = np.memmap( os.path.join(self.path, "rates.bin"), dtype = self._rate_dtype, mode = "r", shape = (count, self.num_sites) )
+
+
+
+    def append(self, states, site_rates, taxa, code, site_partitions):
+        '''
+            Append replicates to the store. This is called by Evolver when given the **store** argument, but may also be called directly.
+            
+            Required positional arguments include,
+                1. **states**, an integer array of tip states with shape (replicates, taxa, sites)
+                2. **site_rates**, an integer array of shape (replicates, sites) giving the rate category of each site (indexed from 0)
+                3. **taxa**, a list of tip names, ordered as in the second dimension of **states**
+                4. **code**, the list of states (alphabet) which the integers in **states** index
+                5. **site_partitions**, an integer array giving the partition of each site (indexed from 0)
+        '''
+        assert(self.mode == "a"), "\n\nThis ReplicateStore was opened for reading only."
+        if self.taxa is None:
+            self._create(taxa, code, site_partitions, states.dtype)
+        assert(list(taxa) == self.taxa and list(code) == self.code and states.shape[1:] == (len(self.taxa), self.num_sites)), "\n\nReplicates appended to a ReplicateStore must have the same tips, code, and number of sites as those already stored."
+        assert(np.max(site_rates) <= np.iinfo(self._rate_dtype).max), "\n\nToo many rate categories to store."
+        
+        # Data are written (and flushed to disk) before the count is updated, so that readers never see incomplete replicates
+        self.refresh()
+        for (name, data, dtype) in [("states.bin", states, self._state_dtype), ("rates.bin", site_rates, self._rate_dtype)]:
+            with open( os.path.join(self.path, name), "r+b" ) as handle:
+                handle.seek( self._count * int(np.prod(data.shape[1:])) * dtype.itemsize )
+                handle.write( np.ascontiguousarray(data, dtype = dtype).tobytes() )
+                handle.flush()
+                os.fsync( handle.fileno() )
+        self._write_count( self._count + states.shape[0] )
+        self.refresh()
+
+
+
+    def __len__(self):
+        if self.taxa is None:
+            return 0
+        self.refresh()
+        return self._count
+
+
+
+    def __getitem__(self, index):
+        '''
+            Return the tip states of replicate *index*, as a (taxa, sites) view of the memory-mapped store.
+        '''
+        return self.get_states(index)
+
+
+
+    def _check_index(self, index):
+        if index >= self._count:
+            self.refresh()
+        assert(0 <= index < self._count), "\n\nReplicate index is out of range for this ReplicateStore."
+
+
+
+    def get_states(self, index, taxon = None):
+        '''
+            Return the tip states of replicate *index*, as a (taxa, sites) view of the memory-mapped store. If *taxon* (a tip's position in **taxa**) is given, return the states of that tip only.
+        '''
+        self._check_index(index)
+        if taxon is None:
+            return self._states_map[index]
+        return self._states_map[index, taxon]
+
+
+
+    def get_site_rates(self, index):
+        '''
+            Return the rate category of each site (indexed from 0) in replicate *index*.
+        '''
+        self._check_index(index)
+        return self._rates_map[index]
+
+
+
+    def get_sequences(self, index):
+        '''
+            Return a dictionary of tip sequence strings for replicate *index*.
+        '''
+        states = self.get_states(index)
+        return {self.taxa[t]: states_to_sequence(states[t], self.code, self._code_table) for t in range(len(self.taxa))}
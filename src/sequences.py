@@ -0,0 +1,137 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    This module converts simulated integer state arrays into sequence strings, and sequences into integer state arrays.
+'''
+
+from collections.abc import Mapping
+import numpy as np
+
+
+def code_table(code):
+    '''
+        Build a byte lookup table for a code (list of states), with one row of ASCII bytes for each state.
+        Indexing the table with an integer array of states gives every character of the sequence at once.
+        Returns None if states differ in length or are not ASCII, in which case sequences must be joined state by state.
+    '''
+    if len( set([len(state) for state in code]) ) != 1:
+        return None
+    try:
+        encoded = "".join(code).encode("ascii")
+    except UnicodeEncodeError:
+        return None
+    return np.frombuffer(encoded, dtype = np.uint8).reshape( len(code), len(code[0]) )
+
+
+
+def states_to_sequence(states, code, table = None):
+    '''
+        Convert an integer array of *states* into a sequence string, using the byte lookup *table* for *code* if one is given.
+    '''
+    if table is None:
+        return "".join( [code[s] for s in states] )
+    return table[states].tobytes().decode("ascii")
+
+
+
+def encode_states(states, code, table = None):
+    '''
+        Convert an integer array of *states* into the ASCII bytes of its sequence, using the byte lookup *table* for *code* if one is given.
+    '''
+    if table is None:
+        return states_to_sequence(states, code).encode("ascii")
+    return table[states].tobytes()
+
+
+
+def sequence_to_states(sequence, code, table = None):
+    '''
+        Convert a *sequence* into an integer array of states, the inverse of ``states_to_sequence``. The sequence may be a string, or any bytes-like object (e.g. bytes, a memory-mapped file, or a numpy array of bytes), which is read without copying it into a string.
+        With the byte lookup *table* for *code* (built here if not given), all states are decoded at once: single-character states through a table of all 256 byte values, and longer states (e.g. codons) by locating each state's bytes, as an integer, among the sorted states of the code.
+        Raises a ValueError if the sequence contains anything other than states of the code.
+    '''
+    if table is None:
+        table = code_table(code)
+    if table is None or table.shape[1] > 7:
+        # States which differ in length, or which are too long to be held as a single integer, are decoded one by one
+        if not isinstance(sequence, str):
+            sequence = bytes(sequence).decode("ascii")
+        step = len(code[0])
+        index = {state: i for (i, state) in enumerate(code)}
+        try:
+            return np.array( [index[sequence[i:i+step]] for i in range(0, len(sequence), step)], dtype = np.intp )
+        except KeyError:
+            raise ValueError("\n\nSequence contains states which are not in the code.")
+
+    if isinstance(sequence, str):
+        sequence = sequence.encode("ascii")
+    raw = np.frombuffer(sequence, dtype = np.uint8)
+    width = table.shape[1]
+    if len(raw) % width != 0:
+        raise ValueError("\n\nSequence length is not a multiple of the length of the states in the code.")
+    
+    if width == 1:
+        lookup = np.full(256, -1, dtype = np.intp)
+        lookup[ table[:,0] ] = np.arange(len(code))
+        states = lookup[raw]
+        if np.any(states < 0):
+            raise ValueError("\n\nSequence contains states which are not in the code.")
+        return states
+
+    weights = 256 ** np.arange(width - 1, -1, -1, dtype = np.int64)
+    keys = raw.reshape(-1, width) @ weights
+    code_keys = table @ weights
+    order = np.argsort(code_keys)
+    found = np.searchsorted(code_keys[order], keys)
+    np.clip(found, 0, len(code) - 1, out = found)
+    if np.any(code_keys[order][found] != keys):
+        raise ValueError("\n\nSequence contains states which are not in the code.")
+    return order[found]
+
+
+
+
+class LazySequences(Mapping):
+    '''
+        Read-only mapping of node names to sequence strings, built from integer state arrays.
+        A sequence string is built, in a single vectorized pass, only when it is first requested; it is then stored for any further requests.
+    '''
+
+    def __init__(self, states, code, table = None, replicate = 0):
+        '''
+            Required positional arguments include,
+                1. **states**, a dictionary of node names to integer state arrays of shape (replicates, sites)
+                2. **code**, the list of states (alphabet) which the integers in **states** index
+
+            Optional arguments include,
+                1. **table**, the byte lookup table for **code**, as returned by ``code_table``. Default: built here.
+                2. **replicate**, the replicate whose sequences are given. Default: 0.
+        '''
+        self._states    = dict(states)
+        self._code      = code
+        self._table     = table if table is not None else code_table(code)
+        self._replicate = replicate
+        self._built     = {}
+
+
+
+    def __getitem__(self, name):
+        if name not in self._built:
+            self._built[name] = states_to_sequence( self._states[name][self._replicate], self._code, self._table )
+        return self._built[name]
+
+
+
+    def __iter__(self):
+        return iter(self._states)
+
+
+
+    def __len__(self):
+        return len(self._states)
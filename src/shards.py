@@ -0,0 +1,205 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    This module writes simulated replicates as sharded one-hot tensors, with arrays of labels describing the models which generated them, for use as training data (e.g. for neural-network classifiers of trees or models).
+'''
+
+import os
+import numpy as np
+from .writers import load_archive_member
+
+SHARD_FORMATS = ["npy", "npz"]
+
+
+def model_labels(partitions, tree_id = 0):
+    '''
+        Return a dictionary of label arrays describing the models of a list of partitions: every numeric parameter (from each model's **params**, with dictionaries such as **mu** given one label per key), the rate factors and rate probabilities, and the tree identifier.
+
+        Labels are named "partition<p>.<model>.<parameter>", where partitions are numbered from 1, and models are given by name or, when unnamed, as "model<m>", numbered from 1 (e.g. "partition1.model1.kappa", or "partition1.model1.mu.AC").
+
+        Required positional arguments include,
+            1. **partitions**, a list of Partition objects
+
+        Optional arguments include,
+            1. **tree_id**, a number identifying the tree. Default: 0.
+    '''
+    labels = {"tree_id": np.array(tree_id, dtype = float)}
+    for (p, part) in enumerate(partitions):
+        for (m, model) in enumerate(part.models):
+            prefix = "partition" + str(p + 1) + "." + (str(model.name) if model.name is not None else "model" + str(m + 1)) + "."
+            values = dict(model.params)
+            values["rate_factors"] = model.rate_factors
+            values["rate_probs"] = model.rate_probs
+            for key in values:
+                if type(values[key]) is dict:
+                    items = [(key + "." + str(k), v) for (k, v) in sorted(values[key].items())]
+                else:
+                    items = [(key, values[key])]
+                for (name, value) in items:
+                    try:
+                        labels[prefix + name] = np.asarray(value, dtype = float)
+                    except (TypeError, ValueError):
+                        pass # Non-numeric parameters, e.g. codes, are not labels
+    return labels
+
+
+
+
+class TensorShardWriter(object):
+    '''
+        Writes replicates as one-hot tensors of shape (replicates, taxa, sites, states), in shards of a fixed number of replicates, each of which can be memory-mapped by training data loaders (see ``load_shard``).
+
+        Each shard is written as "shard_<i>.npy", holding the tensor, with a companion "shard_<i>_labels.npz" archive holding the label arrays (each with a leading axis of replicates), the taxon names (**taxa**), and the code (**code**). In npz format, the tensor and labels are instead saved together in a single uncompressed archive, "shard_<i>.npz", with the tensor as **onehot**.
+        The tensor is of type uint8. When bit-packed, the states axis is packed with ``np.packbits``, to ceil(states / 8) bytes, and is recovered with ``np.unpackbits(tensor, axis = -1, count = states)``.
+
+        Replicates are added with ``write`` (or by an Evolver call, with the **shards** argument). Replicates are held, as integer states, until a shard is full; any remaining replicates are written as a final, smaller shard by ``close``.
+
+        Examples:
+            .. code-block:: python
+
+               >>> # Simulate 10000 replicates along each of two trees, in shards of 1000
+               >>> shards = TensorShardWriter("training_data", shard_size = 1000, packbits = True)
+               >>> for (i, tree) in enumerate([tree1, tree2]):
+               ...     Evolver(tree = tree, partitions = my_partition)(replicates = 10000, shards = shards, tree_id = i)
+               >>> shards.close()
+    '''
+
+    def __init__(self, path, shard_size = 1000, packbits = False, fmt = "npy"):
+        '''
+            Required positional arguments include,
+                1. **path**, the directory in which shards are written. It is created if it does not exist.
+
+            Optional arguments include,
+                1. **shard_size**, the number of replicates in each shard. Default: 1000.
+                2. **packbits**, a boolean indicating whether the one-hot states axis is bit-packed. Default: False.
+                3. **fmt**, either "npy" (tensor and labels in separate files) or "npz" (tensor and labels in a single archive). Default: "npy".
+        '''
+        assert(type(shard_size) is int and shard_size > 0), "\n\nThe shard size must be a positive integer."
+        assert(fmt in SHARD_FORMATS), "\n\nShards must be saved in npy or npz format."
+        self.path       = path
+        self.shard_size = shard_size
+        self.packbits   = packbits
+        self.fmt        = fmt
+        self.num_shards = 0
+        self._pending   = [] # Tuples of (states, labels) not yet written
+        self._num_pending = 0
+        self._taxa      = None
+        self._code      = None
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+
+
+    def write(self, states, taxa, code, labels = None):
+        '''
+            Add replicates, writing every shard which is then full.
+
+            Required positional arguments include,
+                1. **states**, an integer array of states, of shape (replicates, taxa, sites)
+                2. **taxa**, the list of taxon names, in the order of the second axis of **states**
+                3. **code**, the list of states (alphabet) which the integers in **states** index
+
+            Optional arguments include,
+                1. **labels**, a dictionary of label names to values which apply to every replicate given (e.g. as returned by ``model_labels``).
+        '''
+        states = np.asarray(states)
+        assert(states.ndim == 3), "\n\nStates must be given as an array of shape (replicates, taxa, sites)."
+        if self._taxa is None:
+            self._taxa, self._code = [str(t) for t in taxa], list(code)
+        assert([str(t) for t in taxa] == self._taxa and list(code) == self._code), "\n\nAll replicates in a TensorShardWriter must have the same taxa and code."
+        if self._pending:
+            assert(states.shape[1:] == self._pending[0][0].shape[1:]), "\n\nAll replicates in a TensorShardWriter must have the same number of taxa and sites."
+        labels = {key: np.asarray(value, dtype = float) for (key, value) in (labels or {}).items()}
+
+        self._pending.append( (np.array(states), labels) )
+        self._num_pending += states.shape[0]
+        while self._num_pending >= self.shard_size:
+            self._write_shard(self.shard_size)
+
+
+
+    def _write_shard(self, size):
+        '''
+            Write a shard of the first *size* pending replicates.
+        '''
+        states, labels = self._take(size)
+        onehot = (states[..., np.newaxis] == np.arange(len(self._code))).view(np.uint8)
+        if self.packbits:
+            onehot = np.packbits(onehot, axis = -1)
+        meta = {"taxa": np.array(self._taxa), "code": np.array(self._code)}
+
+        # Writing to open handles prevents numpy from appending extensions to the file names
+        root = os.path.join(self.path, "shard_" + str(self.num_shards).zfill(5))
+        if self.fmt == "npz":
+            with open(root + ".npz", "wb") as handle:
+                np.savez(handle, onehot = onehot, **dict(labels, **meta))
+        else:
+            with open(root + ".npy", "wb") as handle:
+                np.save(handle, onehot)
+            with open(root + "_labels.npz", "wb") as handle:
+                np.savez(handle, **dict(labels, **meta))
+        self.num_shards += 1
+
+
+
+    def _take(self, size):
+        '''
+            Remove the first *size* pending replicates, returning their states and labels. Labels missing from some replicates are given as NaN for those replicates.
+        '''
+        batches = []
+        taken = 0
+        while taken < size:
+            (states, labels) = self._pending[0]
+            count = min(size - taken, states.shape[0])
+            batches.append( (states[:count], labels) )
+            if count == states.shape[0]:
+                self._pending.pop(0)
+            else:
+                self._pending[0] = (states[count:], labels)
+            taken += count
+        self._num_pending -= size
+
+        names = []
+        for (states, labels) in batches:
+            names += [key for key in labels if key not in names]
+        shard_labels = {}
+        for key in names:
+            shapes = set([labels[key].shape for (states, labels) in batches if key in labels])
+            assert(len(shapes) == 1), "\n\nThe label " + key + " was given with different shapes."
+            shape = shapes.pop()
+            shard_labels[key] = np.concatenate([np.broadcast_to(labels.get(key, np.full(shape, np.nan)), (states.shape[0],) + shape) for (states, labels) in batches])
+        return np.concatenate([states for (states, labels) in batches]), shard_labels
+
+
+
+    def close(self):
+        '''
+            Write any remaining replicates as a final shard.
+        '''
+        if self._num_pending > 0:
+            self._write_shard(self._num_pending)
+
+
+
+
+def load_shard(filename, mmap = True):
+    '''
+        Load a shard written by a TensorShardWriter, given the name of its npy or npz file. By default, the one-hot tensor is memory-mapped (read-only) rather than read. Provide mmap = False to read it into memory.
+
+        Returns a tuple of the one-hot tensor, and a dictionary of its label arrays (including **taxa** and **code**).
+    '''
+    if filename.endswith(".npy"):
+        onehot = np.load(filename, mmap_mode = "r" if mmap else None)
+        labels_filename = filename[:-4] + "_labels.npz"
+    else:
+        onehot = load_archive_member(filename, "onehot", mmap)
+        labels_filename = filename
+    with np.load(labels_filename) as archive:
+        labels = {key: archive[key] for key in archive.files if key != "onehot"}
+    return onehot, labels
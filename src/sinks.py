@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    This module defines output sinks, which receive each node's simulated sequence from an Evolver as soon as it is final.
+'''
+
+import os
+import numpy as np
+from .sequences import *
+from .compression import *
+
+
+class Sink(object):
+    '''
+        Parent class for output sinks. A sink is given to an Evolver call with the **sinks** argument, and receives each retained node's sequence (tips, and ancestors as specified by the Evolver's **ancestors** argument) the moment that it is final, while the rest of the tree is still evolving.
+
+        Custom sinks (e.g. to send sequences to a message queue or database) should inherit from Sink and override the method ``write``, and, as needed, ``open`` and ``close``.
+    '''
+
+    def open(self, evolver):
+        '''
+            Called once, before simulation begins. Argument *evolver* is the Evolver instance, which provides the code (**evolver._code**), the number of replicates (**evolver._num_replicates**), and the number of sites (**evolver._root_seq_length**).
+        '''
+        self.code = evolver._code
+        self.num_replicates = evolver._num_replicates
+
+
+
+    def write(self, name, is_leaf, states):
+        '''
+            Called once for each node whose sequence is final, in the order that nodes are evolved.
+
+            Required positional arguments include,
+                1. **name**, the node name
+                2. **is_leaf**, a boolean indicating whether the node is a tip
+                3. **states**, an integer array of states with shape (replicates, sites). This array must not be modified.
+        '''
+        print("Parent class function. Not called.")
+
+
+
+    def close(self):
+        '''
+            Called once, after simulation is complete.
+        '''
+        pass
+
+
+
+
+class MemorySink(Sink):
+    '''
+        Sink which keeps sequences in memory. After simulation, the attribute **states** is a dictionary of node names to integer state arrays, and **leaves** is a list of tip names.
+    '''
+    def open(self, evolver):
+        super(MemorySink, self).open(evolver)
+        self.states = {}
+        self.leaves = []
+        self._table = code_table(self.code)
+
+
+    def write(self, name, is_leaf, states):
+        self.states[name] = states
+        if is_leaf:
+            self.leaves.append(name)
+
+
+    def get_sequences(self, replicate = 0):
+        '''
+            Return a dictionary of node names to sequence strings, for a given replicate.
+        '''
+        return {name: states_to_sequence(self.states[name][replicate], self.code, self._table) for name in self.states}
+
+
+
+
+class FastaSink(Sink):
+    '''
+        Sink which streams sequences to a FASTA file as they are produced. When several replicates are simulated, each replicate is written to its own file, with the replicate number (from 1) inserted before the file's extension.
+    '''
+    def __init__(self, filename, leaves_only = True, compress = None):
+        '''
+            Required positional arguments include,
+                1. **filename**, the name of the FASTA file to write
+
+            Optional arguments include,
+                1. **leaves_only**, a boolean indicating whether only tip sequences are written. Default: True.
+                2. **compress**, the compression of the file ("gzip", "deflate", or False), as described for ``open_output``. Default: None, to gzip the file if its name ends with ".gz".
+        '''
+        self.filename    = filename
+        self.leaves_only = leaves_only
+        self.compress    = compress
+
+
+    def open(self, evolver):
+        super(FastaSink, self).open(evolver)
+        self._table = code_table(self.code)
+        if self.num_replicates == 1:
+            filenames = [self.filename]
+        else:
+            filenames = [evolver._replicate_filename(self.filename, r) for r in range(self.num_replicates)]
+        self._handles = [open_output(filename, "wb", self.compress) for filename in filenames]
+
+
+    def write(self, name, is_leaf, states):
+        if self.leaves_only and not is_leaf:
+            return
+        header = b">" + str(name).encode("ascii") + b"\n"
+        for r in range(self.num_replicates):
+            self._handles[r].write(header)
+            self._handles[r].write( encode_states(states[r], self.code, self._table) )
+            self._handles[r].write(b"\n")
+
+
+    def close(self):
+        for handle in self._handles:
+            handle.close()
+        self._handles = []
+
+
+
+
+class BinarySink(Sink):
+    '''
+        Sink which streams integer state arrays to a binary file as they are produced. Each node is stored as three consecutive arrays in numpy's .npy format (its name, whether it is a tip, and its states of shape (replicates, sites)), so that no pickling is needed to read the file back with ``read_binary_sink``.
+    '''
+    def __init__(self, filename, leaves_only = False):
+        '''
+            Required positional arguments include,
+                1. **filename**, the name of the binary file to write
+
+            Optional arguments include,
+                1. **leaves_only**, a boolean indicating whether only tip sequences are written. Default: False.
+        '''
+        self.filename    = filename
+        self.leaves_only = leaves_only
+
+
+    def open(self, evolver):
+        super(BinarySink, self).open(evolver)
+        self._handle = open(self.filename, "wb")
+
+
+    def write(self, name, is_leaf, states):
+        if self.leaves_only and not is_leaf:
+            return
+        np.save(self._handle, np.array(str(name)))
+        np.save(self._handle, np.array(is_leaf))
+        np.save(self._handle, states)
+
+
+    def close(self):
+        self._handle.close()
+
+
+
+
+def read_binary_sink(filename):
+    '''
+        Read a file written by a BinarySink. Returns a dictionary of node names to integer state arrays of shape (replicates, sites), and a list of tip names.
+    '''
+    states = {}
+    leaves = []
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as handle:
+        while handle.tell() < size:
+            name = str( np.load(handle) )
+            is_leaf = bool( np.load(handle) )
+            states[name] = np.load(handle)
+            if is_leaf:
+                leaves.append(name)
+    return states, leaves
@@ -107,10 +107,13 @@ class StateFrequencies(object):
         ''' Set up the code (alphabet) and dimensionality for computing self._byFreqs '''
         if self._by == 'amino_acid':
             self._code = MOLECULES.amino_acids
+            self._code_index = MOLECULES.amino_acid_index
         elif self._by == 'codon':
             self._code = MOLECULES.codons
+            self._code_index = MOLECULES.codon_index
         elif self._by == 'nucleotide':
             self._code = MOLECULES.nucleotides
+            self._code_index = MOLECULES.nucleotide_index
         self._size = len(self._code)
  
  
@@ -125,11 +128,8 @@ class StateFrequencies(object):
             Assumes equal frequencies for synonymous codons.
         '''
         
-        for aa_count in range(20):
-            syn = MOLECULES.genetic_code[aa_count]
-            for synCodon in syn:
-                cind = MOLECULES.codons.index(synCodon)
-                self.codon_freqs[cind] = self.amino_acid_freqs[aa_count]/float(len(syn))
+        num_syn = np.bincount(MOLECULES.codon_amino_acids, minlength = 20)
+        self.codon_freqs = np.asarray(self.amino_acid_freqs)[MOLECULES.codon_amino_acids] / num_syn[MOLECULES.codon_amino_acids]
         assert( abs(np.sum(self.codon_freqs) - 1.) <= ZERO), "Codon state frequencies improperly calculated from amino acid frequencies. Do not sum to 1."                 
       
     
@@ -140,11 +140,7 @@ class StateFrequencies(object):
             Calculate amino acid frequencies from codon frequencies (by = 'codon', type = 'amino_acid').
         '''
         
-        for a in range(len(MOLECULES.amino_acids)):
-            codons1 = MOLECULES.genetic_code[a]
-            for c in codons1:
-                ind = MOLECULES.codons.index(c)
-                self.amino_acid_freqs[a] += self.codon_freqs[ind]
+        self.amino_acid_freqs = np.bincount(MOLECULES.codon_amino_acids, weights = self.codon_freqs, minlength = 20)
         assert( abs(np.sum(self.amino_acid_freqs) - 1.) <= ZERO), "Amino acid state frequencies improperly generate_byFreqsd from codon frequencies. Do not sum to 1." 
 
 
@@ -236,7 +232,7 @@ class EqualFrequencies(StateFrequencies):
         '''
         fill = 1./float(len(self._restrict))
         for entry in self._restrict:
-            self._byFreqs[self._code.index(entry)] = fill     
+            self._byFreqs[self._code_index[entry]] = fill     
                     
                     
                     
@@ -302,8 +298,8 @@ class RandomFrequencies(StateFrequencies):
                 if restart_search:
                     break
                 sum += freq
-                self._byFreqs[self._code.index(entry)] = freq
-        self._byFreqs[self._code.index(self._restrict[-1])] = (1.-sum)    
+                self._byFreqs[self._code_index[entry]] = freq
+        self._byFreqs[self._code_index[self._restrict[-1]]] = (1.-sum)    
         
 
 
@@ -467,27 +463,28 @@ class ReadFrequencies(StateFrequencies):
             Compute self._byFreqs
         ''' 
         
-        total_characters = 0.
+        counts = np.zeros(self._size)
         for row in self._seqs: 
-            if self.which_columns is not None:   
-                for col in self.which_columns:
-                    if self._by == "codon": 
-                        char = row[col*3 : col*3 + 3]
-                    else:
-                        char = row[col]
-                    if char in self._code:
-                        total_characters += 1.
-                        self._byFreqs[ self._code.index(char) ] += 1          
-            else:
-                for i in range(len(row)):
-                    if self._by == "codon":
-                        char = row[i*3 : i*3+3]
-                    else:
-                        char = row[i]
-                    if char in self._code:
-                        total_characters += 1.
-                        self._byFreqs[ self._code.index(char) ] += 1     
-        self._byFreqs = np.divide(self._byFreqs, total_characters)
+            states = self._row_states(row)
+            if self.which_columns is not None:
+                states = states[ self.which_columns[self.which_columns < len(states)] ]
+            counts += np.bincount(states[states >= 0], minlength = self._size)
+        self._byFreqs = np.divide(counts, np.sum(counts))
+
+
+
+    def _row_states(self, row):
+        '''
+            Return the state index of each column of a sequence, with the lookup tables of Genetics. Columns which are not states (e.g. gaps, ambiguities, or stop codons) are -1.
+        '''
+        chars = np.frombuffer( row.encode("ascii", "replace"), dtype = np.uint8 )
+        if self._by == "amino_acid":
+            return MOLECULES.amino_acid_lookup[chars]
+        nucs = MOLECULES.nucleotide_lookup[chars]
+        if self._by == "nucleotide":
+            return nucs
+        nucs = nucs[: len(nucs) - len(nucs)%3].reshape(-1, 3)
+        return np.where( np.all(nucs >= 0, axis = 1), MOLECULES.codon_lookup[nucs[:,0], nucs[:,1], nucs[:,2]], -1 )
 
 
 
@@ -0,0 +1,157 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    This module defines a bounded cache of transition matrices, which may be shared across Evolver calls, Evolver instances, and partitions.
+'''
+
+import threading
+from collections import OrderedDict
+
+
+class TransitionCache(object):
+    '''
+        Least-recently-used cache of transition matrices, P(t), with a fixed memory budget.
+        Entries are keyed on the model's fingerprint (a hash of its rate matrices), the rate category, and the effective branch length (branch length scaled by the rate category's factor). Partitions sharing a Model, identical Models, and sibling branches of identical length therefore reuse the same matrix.
+
+        Counters for cache hits, misses, and evictions are kept in the attributes **hits**, **misses**, and **evictions**.
+        The cache may be shared by threads (e.g. an Evolver evolving partitions in parallel); lookups and insertions are guarded by a lock, while matrices themselves are computed outside of it.
+    '''
+
+    def __init__(self, max_bytes = 64 * 2**20):
+        '''
+            Optional arguments include,
+                1. **max_bytes**, the memory budget, in bytes, for stored transition matrices. Least recently used matrices are evicted once this budget is exceeded. Default: 64 MB.
+
+            Examples:
+                .. code-block:: python
+
+                   >>> # Share a 256 MB cache between two Evolver instances
+                   >>> cache = TransitionCache(max_bytes = 256 * 2**20)
+                   >>> evolve1 = Evolver(tree = my_tree, partitions = my_partitions, cache = cache)
+                   >>> evolve2 = Evolver(tree = my_other_tree, partitions = my_partitions, cache = cache)
+        '''
+        assert(max_bytes >= 0), "\n\nThe memory budget for a TransitionCache must be non-negative."
+        self.max_bytes = max_bytes
+        self._entries  = OrderedDict()
+        self._bytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self._lock     = threading.Lock()
+
+
+
+    def __call__(self, model, t, category = 0):
+        '''
+            Return the transition matrix for Model *model*, branch length *t*, and rate category *category*, computing and storing it if not yet cached.
+            Returned matrices are read-only, since they are shared by all users of the cache.
+        '''
+        key = self._make_key(model, t, category)
+        with self._lock:
+            P = self._entries.get(key)
+            if P is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return P
+            self.misses += 1
+
+        P = model.transition_matrix(t, category)
+        P.flags.writeable = False
+        with self._lock:
+            self._store(key, P)
+        return P
+
+
+
+    def _make_key(self, model, t, category):
+        '''
+            Construct the cache key for a given model, branch length, and rate category.
+        '''
+        if model.is_hetcodon_model():
+            effective_t = float(t)
+        else:
+            effective_t = float(t) * float(model.rate_factors[category])
+        return (model.fingerprint(), category, effective_t)
+
+
+
+    def _store(self, key, P):
+        '''
+            Insert a matrix into the cache, evicting the least recently used matrices as needed to remain within the memory budget.
+        '''
+        if P.nbytes > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = P
+        self._bytes += P.nbytes
+        self._evict()
+
+
+
+    def _evict(self):
+        '''
+            Evict least recently used matrices until the cache is within its memory budget.
+        '''
+        while self._bytes > self.max_bytes:
+            (old_key, old_P) = self._entries.popitem(last = False)
+            self._bytes -= old_P.nbytes
+            self.evictions += 1
+
+
+
+    def resize(self, max_bytes):
+        '''
+            Change the memory budget, in bytes, evicting matrices as needed.
+        '''
+        assert(max_bytes >= 0), "\n\nThe memory budget for a TransitionCache must be non-negative."
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+
+
+    def clear(self):
+        '''
+            Remove all matrices from the cache and reset the counters.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._bytes    = 0
+            self.hits      = 0
+            self.misses    = 0
+            self.evictions = 0
+
+
+
+    def stats(self):
+        '''
+            Return a dictionary of cache statistics: number of stored matrices, memory in use (bytes), memory budget (bytes), hits, misses, and evictions.
+        '''
+        return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+
+    def __getstate__(self):
+        # The lock cannot be pickled (e.g. when a cache is shipped to worker processes); each copy receives its own.
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+
+# Default cache, shared by all Evolver instances unless another is provided.
+TRANSITION_CACHE = TransitionCache()
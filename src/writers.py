@@ -0,0 +1,353 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    This module writes simulated alignments to file. FASTA, PHYLIP (strict and relaxed), and NEXUS files are written natively, one record at a time, directly from integer state arrays. Any other format accepted by Biopython is written through Biopython.
+    Alignments may also be saved as binary integer matrices of states (npz and npy formats), which are reloaded, memory-mapped, with ``load_alignment``.
+    Alignments in which most sites match the root sequence are best saved sparsely, as the root sequence and each sequence's differences from it (VCF, or the compact binary "variants" format, which is reloaded with ``load_variants``).
+'''
+
+import os
+import re
+import zipfile
+import numpy as np
+from .sequences import *
+from .compression import *
+
+NATIVE_FORMATS = ["fasta", "phylip", "phylip-sequential", "phylip-relaxed", "nexus"]
+BINARY_FORMATS = ["npz", "npy"]
+VARIANT_FORMATS = ["vcf", "variants"]
+
+
+def write_alignment(filename, seqfmt, names, states, code, table = None, compress = None):
+    '''
+        Write an alignment to file.
+
+        Required positional arguments include,
+            1. **filename**, the name of the file to write
+            2. **seqfmt**, the alignment format. FASTA, PHYLIP ("phylip" or "phylip-sequential" for strict PHYLIP, with names of at most 10 characters, and "phylip-relaxed"), and NEXUS are written natively. Any other format is written with Biopython.
+            3. **names**, a list of sequence names
+            4. **states**, a list of integer state arrays (one per name, in the same order)
+            5. **code**, the list of states (alphabet) which the integers in **states** index
+
+        Optional arguments include,
+            1. **table**, the byte lookup table for **code**, as returned by ``code_table``. Default: built here.
+            2. **compress**, the compression of the file ("gzip", "deflate", or False), as described for ``open_output``. Default: None, to gzip the file if its name ends with ".gz".
+    '''
+    seqfmt = seqfmt.lower()
+    if table is None:
+        table = code_table(code)
+    if seqfmt not in NATIVE_FORMATS or (seqfmt == "nexus" and _nexus_datatype(code) is None):
+        _write_biopython(filename, seqfmt, names, [states_to_sequence(s, code, table) for s in states], compress)
+        return
+
+    with open_output(filename, "wb", compress) as handle:
+        if seqfmt == "fasta":
+            _write_fasta(handle, names, states, code, table)
+        elif seqfmt == "nexus":
+            _write_nexus(handle, names, states, code, table)
+        else:
+            _write_phylip(handle, names, states, code, table, relaxed = (seqfmt == "phylip-relaxed"))
+
+
+
+def _alignment_length(states, code, table):
+    '''
+        Return the number of characters in each sequence of the alignment.
+    '''
+    if len(states) == 0:
+        return 0
+    if table is None:
+        return len( states_to_sequence(states[0], code) )
+    return table.shape[1] * len(states[0])
+
+
+
+def _write_fasta(handle, names, states, code, table):
+    '''
+        Write records in FASTA format, with each sequence on a single line.
+    '''
+    for (name, seq) in zip(names, states):
+        handle.write( b">" + str(name).encode("ascii") + b"\n" )
+        handle.write( encode_states(seq, code, table) )
+        handle.write( b"\n" )
+
+
+
+def _write_phylip(handle, names, states, code, table, relaxed = False):
+    '''
+        Write records in sequential PHYLIP format. In strict PHYLIP, names are padded to 10 characters and may not be longer. In relaxed PHYLIP, names are padded to the longest name, plus one space.
+    '''
+    names = [str(name) for name in names]
+    for name in names:
+        assert(re.search(r"\s", name) is None), "\n\nSequence names may not contain whitespace in PHYLIP format."
+    if relaxed:
+        width = max([len(name) for name in names]) + 1
+    else:
+        assert(max([len(name) for name in names]) <= 10), "\n\nSequence names must be at most 10 characters long in strict PHYLIP format. Try seqfmt = 'phylip-relaxed' instead."
+        width = 10
+
+    nchar = _alignment_length(states, code, table)
+    handle.write( (" " + str(len(names)) + " " + str(nchar) + "\n").encode("ascii") )
+    for (name, seq) in zip(names, states):
+        handle.write( name.ljust(width).encode("ascii") )
+        handle.write( encode_states(seq, code, table) )
+        handle.write( b"\n" )
+
+
+
+def _nexus_datatype(code):
+    '''
+        Return the NEXUS datatype and symbols for a code: DNA for nucleotide and codon codes, protein for amino-acid codes, and standard for custom codes of single-character states. Returns None for other codes, which NEXUS cannot represent.
+    '''
+    if set("".join(code)) <= set("ACGT") and len(set([len(state) for state in code])) == 1:
+        return "dna", None
+    if len(code) == 20 and all([len(state) == 1 for state in code]):
+        return "protein", None
+    if all([len(state) == 1 for state in code]):
+        return "standard", "".join(code)
+    return None
+
+
+
+def _nexus_name(name):
+    '''
+        Quote a name for NEXUS, if it contains whitespace or punctuation.
+    '''
+    name = str(name)
+    if re.match(r"^\w+$", name):
+        return name
+    return "'" + name.replace("'", "''") + "'"
+
+
+
+def _write_nexus(handle, names, states, code, table):
+    '''
+        Write records in NEXUS format, as a single non-interleaved data block.
+    '''
+    (datatype, symbols) = _nexus_datatype(code)
+    nexus_names = [_nexus_name(name) for name in names]
+    width = max([len(name) for name in nexus_names]) + 1
+    nchar = _alignment_length(states, code, table)
+
+    header  = "#NEXUS\n\nbegin data;\n"
+    header += "\tdimensions ntax=" + str(len(names)) + " nchar=" + str(nchar) + ";\n"
+    header += "\tformat datatype=" + datatype + " missing=? gap=-"
+    if symbols is not None:
+        header += ' symbols="' + symbols + '"'
+    header += ";\n\tmatrix\n"
+    handle.write( header.encode("ascii") )
+    for (name, seq) in zip(nexus_names, states):
+        handle.write( name.ljust(width).encode("ascii") )
+        handle.write( encode_states(seq, code, table) )
+        handle.write( b"\n" )
+    handle.write( b"\t;\nend;\n" )
+
+
+
+def _write_biopython(filename, seqfmt, names, seqs, compress = None):
+    '''
+        Write sequence strings to file in any format which Biopython can write.
+    '''
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+    from Bio import SeqIO
+
+    alignment = [SeqRecord( Seq(seq), id = str(name), description = "") for (name, seq) in zip(names, seqs)]
+    try:
+        with open_output(filename, "w", compress) as handle:
+            SeqIO.write(alignment, handle, seqfmt)
+    except:
+        raise TypeError("\n Output file format is unknown. Consult with Biopython manual to see which I/O formats are accepted.\n NOTE: If you are attempting to save as phylip and are receiving this error, try seqfmt = 'phylip-relaxed' instead.")
+
+
+
+
+def write_alignment_array(filename, seqfmt, names, matrix, code, site_rates = None):
+    '''
+        Save an alignment as a binary integer matrix of states.
+
+        Required positional arguments include,
+            1. **filename**, the name of the file to write
+            2. **seqfmt**, either "npz" or "npy". In npz format, a single uncompressed archive holds the arrays **states**, **names**, **code**, and **site_rates**. In npy format, the matrix of states is saved alone to **filename**, and the other arrays to a companion npz archive, named by inserting "_meta" before the extension (e.g. my_seqs.npy and my_seqs_meta.npz).
+            3. **names**, a list of sequence names
+            4. **matrix**, the integer matrix of states, of shape (sequences, sites)
+            5. **code**, the list of states (alphabet) which the integers in **matrix** index
+
+        Optional arguments include,
+            1. **site_rates**, the site rate table, an integer array with columns Site_Index, Partition_Index, and Rate_Category (indexed from 1), as written to the Evolver's ratefile.
+    '''
+    seqfmt = seqfmt.lower()
+    assert(seqfmt in BINARY_FORMATS), "\n\nBinary alignments must be saved in npz or npy format."
+    meta = {"names": np.array([str(name) for name in names]), "code": np.array(code)}
+    if site_rates is not None:
+        meta["site_rates"] = np.asarray(site_rates)
+    
+    # Writing to open handles prevents numpy from appending extensions to the file names
+    if seqfmt == "npz":
+        with open(filename, "wb") as handle:
+            np.savez(handle, states = matrix, **meta)
+    else:
+        with open(filename, "wb") as handle:
+            np.save(handle, matrix)
+        with open(_meta_filename(filename), "wb") as handle:
+            np.savez(handle, **meta)
+
+
+
+def load_alignment(filename, mmap = True):
+    '''
+        Load an alignment saved in npz or npy format (e.g. with Evolver's seqfmt = "npz").
+        By default, the matrix of states is memory-mapped (read-only) rather than read, so that very large alignments can be sliced by sequence or site without loading them fully. Provide mmap = False to read the matrix into memory.
+        
+        Returns a tuple of four arrays: the matrix of states, of shape (sequences, sites); the sequence names; the code which the states index; and the site rate table (or None if none was saved).
+
+        Examples:
+            .. code-block:: python
+
+               >>> evolve(seqfile = "my_seqs.npz", seqfmt = "npz")
+               >>> (states, names, code, site_rates) = load_alignment("my_seqs.npz")
+               >>> first_sites = states[:, :1000]
+    '''
+    if filename.endswith(".npy"):
+        states = np.load(filename, mmap_mode = "r" if mmap else None)
+        meta_filename = _meta_filename(filename)
+    else:
+        states = load_archive_member(filename, "states", mmap)
+        meta_filename = filename
+    with np.load(meta_filename) as meta:
+        site_rates = meta["site_rates"] if "site_rates" in meta.files else None
+        return states, list(meta["names"]), list(meta["code"]), site_rates
+
+
+
+def _meta_filename(filename):
+    '''
+        Name of the companion archive for an alignment saved in npy format.
+    '''
+    (root, ext) = os.path.splitext(filename)
+    return root + "_meta.npz"
+
+
+
+def load_archive_member(filename, member, mmap = True):
+    '''
+        Load a single array from an uncompressed npz archive (e.g. one written by ``write_alignment_array`` or a TensorShardWriter). Since numpy stores archive members uncompressed, the array's data can be memory-mapped directly from its offset within the archive.
+
+        Required positional arguments include,
+            1. **filename**, the name of the npz archive
+            2. **member**, the name of the array within the archive
+
+        Optional arguments include,
+            1. **mmap**, a boolean indicating whether the array is memory-mapped (read-only) rather than read into memory. Default: True.
+    '''
+    if not mmap:
+        with np.load(filename) as archive:
+            return archive[member]
+    
+    with zipfile.ZipFile(filename) as archive:
+        info = archive.getinfo(member + ".npy")
+    assert(info.compress_type == zipfile.ZIP_STORED), "\n\nCompressed archives cannot be memory-mapped. Provide mmap = False."
+    with open(filename, "rb") as handle:
+        # Skip the member's local file header, whose name and extra fields may differ in length from the central directory's
+        handle.seek(info.header_offset + 26)
+        (name_length, extra_length) = np.frombuffer(handle.read(4), dtype = "<u2")
+        handle.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(handle)
+        if version == (1, 0):
+            (shape, fortran_order, dtype) = np.lib.format.read_array_header_1_0(handle)
+        else:
+            (shape, fortran_order, dtype) = np.lib.format.read_array_header_2_0(handle)
+        offset = handle.tell()
+    return np.memmap(filename, dtype = dtype, mode = "r", offset = offset, shape = shape, order = "F" if fortran_order else "C")
+
+
+
+
+def write_variants(filename, seqfmt, names, matrix, root, code, compress = None):
+    '''
+        Save an alignment sparsely: the root sequence once, and for each sequence, only the sites whose states differ from the root. Differences are found with a single vectorized comparison of the matrix of states against the root.
+
+        Required positional arguments include,
+            1. **filename**, the name of the file to write
+            2. **seqfmt**, either "vcf" or "variants". In VCF (version 4.2) format, each site where any sequence differs from the root is a record, with the root state as REF, the other states observed at the site as ALT (in the order of the code), and a haploid genotype for each sequence. VCF is intended for nucleotides; other codes are written with their states (e.g. codons) as alleles, and positions count characters (e.g. the second codon is at position 4). In "variants" format, a single uncompressed npz archive holds the arrays **root**, **names**, **code**, and, concatenated over sequences, the **positions** (indexed from 0) and **states** of all differences, where sequence i's differences are those at **offsets[i]** to **offsets[i+1]**.
+            3. **names**, a list of sequence names
+            4. **matrix**, the integer matrix of states, of shape (sequences, sites)
+            5. **root**, the integer array of root states, of shape (sites,)
+            6. **code**, the list of states (alphabet) which the integers in **matrix** and **root** index
+
+        Optional arguments include,
+            1. **compress**, the compression of a VCF file ("gzip", "deflate", or False), as described for ``open_output``. Default: None, to gzip the file if its name ends with ".gz". Files in "variants" format are never compressed, so that they can be memory-mapped.
+    '''
+    seqfmt = seqfmt.lower()
+    assert(seqfmt in VARIANT_FORMATS), "\n\nSparse alignments must be saved in vcf or variants format."
+    matrix = np.asarray(matrix)
+    root = np.asarray(root)
+    assert(matrix.shape[1:] == root.shape), "\n\nThe root sequence must have the same number of sites as the alignment."
+    differs = matrix != root
+
+    if seqfmt == "vcf":
+        with open_output(filename, "wb", compress) as handle:
+            _write_vcf(handle, names, matrix, root, differs, code)
+        return
+
+    (rows, positions) = np.nonzero(differs)
+    offsets = np.zeros(len(names) + 1, dtype = np.int64)
+    np.cumsum( np.bincount(rows, minlength = len(names)), out = offsets[1:] )
+    with open(filename, "wb") as handle:
+        np.savez(handle, root = root, names = np.array([str(name) for name in names]), code = np.array(code), offsets = offsets,
+                 positions = positions.astype( np.min_scalar_type(max(root.shape[0] - 1, 0)) ), states = matrix[rows, positions])
+
+
+
+def _write_vcf(handle, names, matrix, root, differs, code, chunk_size = 10000):
+    '''
+        Write the variable sites of an alignment as VCF records with haploid genotypes. Genotypes for all sites are computed at once; records are then written in chunks.
+    '''
+    table = code_table(code)
+    width = 1 if table is None else table.shape[1]
+    sites = np.flatnonzero( differs.any(axis = 0) )
+    site_states = matrix[:, sites]
+    ref = root[sites]
+    
+    # Mark the non-root states observed at each variable site. Numbered in the order of the code, these are the ALT alleles.
+    index = np.arange(len(sites))
+    observed = np.zeros( (len(sites), len(code)), dtype = bool )
+    observed[np.broadcast_to(index, site_states.shape), site_states] = True
+    observed[index, ref] = False
+    alleles = np.cumsum(observed, axis = 1)
+    genotypes = np.where(site_states == ref, 0, alleles[index, site_states]).T
+    allele_names = np.array([str(i) for i in range(len(code))])
+
+    header  = "##fileformat=VCFv4.2\n##source=pyvolve\n"
+    header += "##contig=<ID=root,length=" + str(width * root.shape[0]) + ">\n"
+    header += '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n'
+    header += "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t" + "\t".join([str(name) for name in names]) + "\n"
+    handle.write( header.encode("ascii") )
+    for chunk in range(0, len(sites), chunk_size):
+        records = []
+        for v in range(chunk, min(chunk + chunk_size, len(sites))):
+            alt = ",".join([code[s] for s in np.flatnonzero(observed[v])])
+            records.append( "root\t" + str(width * sites[v] + 1) + "\t.\t" + code[ref[v]] + "\t" + alt + "\t.\t.\t.\tGT\t" + "\t".join(allele_names[genotypes[v]]) + "\n" )
+        handle.write( "".join(records).encode("ascii") )
+
+
+
+def load_variants(filename):
+    '''
+        Load an alignment saved in "variants" format (e.g. with Evolver's seqfmt = "variants"), rebuilding the full matrix of states from the root sequence and each sequence's differences.
+
+        Returns a tuple of four arrays: the matrix of states, of shape (sequences, sites); the sequence names; the code which the states index; and the root sequence's states.
+    '''
+    with np.load(filename) as archive:
+        root = archive["root"]
+        names = list(archive["names"])
+        offsets = archive["offsets"]
+        matrix = np.repeat(root[np.newaxis], len(names), axis = 0)
+        matrix[np.repeat(np.arange(len(names)), np.diff(offsets)), archive["positions"]] = archive["states"]
+        return matrix, names, list(archive["code"]), root
@@ -11,9 +11,33 @@ Test modules
 
 * model_test
 
+* model_stack_test
+
 * parameters_sanity_test
 
 * evolver_test 
 
+* transition_cache_test
+
+* model_registry_test
+
+* sequences_test
+
+* writers_test
+
+* sinks_test
+
+* replicates_test
+
+* compression_test
+
+* background_test
+
+* shards_test
+
+* genetics_test
+
+* parallel_test
+
 """
 from pyvolve import *
@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com) 
+##############################################################################
+
+'''
+    Test background module.
+'''
+
+import unittest
+import os
+import asyncio
+import threading
+from pyvolve import *
+import numpy as np
+
+
+class background_writer_tests(unittest.TestCase):
+    ''' 
+        Tests for writing output in a background thread.
+    '''
+
+    def test_background_order(self):
+        '''
+            Tasks performed in order, and all complete after flush?
+        '''
+        done = []
+        with BackgroundWriter(max_pending = 2) as writer:
+            for i in range(20):
+                writer.submit(done.append, i)
+            writer.flush()
+            self.assertTrue(done == list(range(20)), msg = "Background tasks not performed in order.")
+
+
+    def test_background_backpressure(self):
+        '''
+            Submitting blocks while the queue is full?
+        '''
+        release = threading.Event()
+        writer = BackgroundWriter(max_pending = 1)
+        writer.submit(release.wait)
+        writer.submit(lambda: None)
+        blocked = threading.Thread(target = writer.submit, args = (lambda: None,))
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive(), msg = "Submit did not block on a full queue.")
+        release.set()
+        blocked.join()
+        writer.close()
+
+
+    def test_background_error(self):
+        '''
+            An error raised by a task is raised by flush, and later tasks are skipped?
+        '''
+        done = []
+        writer = BackgroundWriter()
+        writer.submit(open, "no_such_directory/out.fasta", "w")
+        writer.submit(done.append, 1)
+        self.assertRaises(IOError, writer.flush)
+        self.assertTrue(done == [], msg = "Task performed after an error.")
+        writer.close()
+
+
+    def test_background_async(self):
+        '''
+            Async submit and close perform the tasks?
+        '''
+        done = []
+        async def run(writer):
+            for i in range(5):
+                await writer.asubmit(done.append, i)
+            await writer.aclose()
+        asyncio.run( run(BackgroundWriter(max_pending = 1)) )
+        self.assertTrue(done == list(range(5)), msg = "Async tasks not performed.")
+
+
+    def test_background_evolver(self):
+        '''
+            Files written in the background match the simulated alignment, even after the Evolver is called again?
+        '''
+        tree = read_tree( tree = "((t1:0.5,t2:0.5):0.1,t3:0.7);" )
+        evolve = Evolver(tree = tree, partitions = Partition(models = Model("nucleotide"), size = 50), seed = 5)
+        with BackgroundWriter() as writer:
+            evolve(seqfile = "bg1.fasta", ratefile = "bg_rates.txt", infofile = None, writer = writer)
+            seqs = evolve.get_sequences()
+            evolve(seqfile = "bg2.fasta", ratefile = None, infofile = None, writer = writer)
+        with open("bg1.fasta", "r") as handle:
+            lines = handle.read().split()
+        with open("bg_rates.txt", "r") as handle:
+            rates = handle.readlines()
+        for filename in ["bg1.fasta", "bg2.fasta", "bg_rates.txt"]:
+            os.remove(filename)
+        self.assertTrue(dict(zip([name[1:] for name in lines[0::2]], lines[1::2])) == seqs, msg = "Background sequence file does not match the simulated alignment.")
+        self.assertTrue(len(rates) == 51, msg = "Background ratefile improperly written.")
@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com) 
+##############################################################################
+
+'''
+    Test compression module.
+'''
+
+import unittest
+import os
+import gzip
+import zlib
+from pyvolve import *
+import numpy as np
+
+
+class compression_tests(unittest.TestCase):
+    ''' 
+        Tests for parallel compressed output.
+    '''
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.data = rng.choice( np.frombuffer(b"ACGT", dtype = np.uint8), size = 300000 ).tobytes()
+
+
+    def test_parallel_gzip(self):
+        '''
+            Blocks compressed in parallel form a standard gzip file?
+        '''
+        with ParallelGzipFile("out.gz", block_size = 10000, threads = 4) as handle:
+            handle.write(self.data[:123456])
+            handle.write(self.data[123456:])
+        with gzip.open("out.gz", "rb") as handle:
+            data = handle.read()
+        os.remove("out.gz")
+        self.assertTrue(data == self.data, msg = "Parallel gzip file improperly written.")
+
+
+    def test_parallel_deflate(self):
+        '''
+            Raw deflate stream written?
+        '''
+        with open_output("out.deflate", "wb", compress = "deflate") as handle:
+            handle.write(self.data)
+        with open("out.deflate", "rb") as handle:
+            data = zlib.decompress(handle.read(), -zlib.MAX_WBITS)
+        os.remove("out.deflate")
+        self.assertTrue(data == self.data, msg = "Raw deflate stream improperly written.")
+
+
+    def test_evolver_gzip(self):
+        '''
+            Evolver output files ending with .gz are compressed?
+        '''
+        tree = read_tree( tree = "(((t2:0.36,t1:0.45):0.001,t3:0.77):0.44,(t5:0.77,t4:0.41):0.89);" )
+        evolve = Evolver(tree = tree, partitions = Partition(models = Model("nucleotide"), size = 30))
+        evolve(seqfile = "out.fasta.gz", ratefile = "rates.txt.gz", infofile = "info.txt.gz")
+        with gzip.open("out.fasta.gz", "rt") as handle:
+            lines = handle.read().split()
+        with gzip.open("rates.txt.gz", "rt") as handle:
+            rates = handle.readlines()
+        for filename in ["out.fasta.gz", "rates.txt.gz", "info.txt.gz"]:
+            os.remove(filename)
+        seqs = evolve.get_sequences()
+        self.assertTrue(lines[0] == ">t2" and lines[1] == seqs["t2"], msg = "Compressed sequence file improperly written.")
+        self.assertTrue(len(rates) == 31, msg = "Compressed ratefile improperly written.")
@@ -61,6 +61,38 @@ class evolver_mrca(unittest.TestCase):
         self.assertTrue(seqdict["root"] == rootseq, msg = "MRCA not preserved for codon evolution.")
 
 
+    def test_evolver_mrca_file(self):
+        '''
+            MRCA read from a plain or FASTA file, or given as bytes?
+        '''
+        rootseq = "AACCGATTTGGCCAT"
+        with open("root.txt", "w") as handle:
+            handle.write(rootseq + "\n")
+        with open("root.fasta", "w") as handle:
+            handle.write(">root\n" + rootseq[:9] + "\n" + rootseq[9:] + "\n")
+        partitions = [Partition(root_file = "root.txt", models = Model("nucleotide")), Partition(root_file = "root.fasta", models = Model("nucleotide")), Partition(root_sequence = rootseq.encode("ascii"), models = Model("nucleotide"))]
+        self.assertTrue(isinstance(partitions[0].MRCA, np.memmap), msg = "Root file not memory-mapped.")
+        for p in partitions:
+            evolve = Evolver(partitions = p, tree = self.tree)
+            evolve(ratefile = False, infofile=False, seqfile=False)
+            self.assertTrue(evolve.get_sequences(anc = True)["root"] == rootseq, msg = "MRCA not preserved from a file or bytes.")
+        del partitions
+        os.remove("root.txt")
+        os.remove("root.fasta")
+
+
+    def test_evolver_root_draw(self):
+        '''
+            Root states drawn in bulk match those drawn one at a time?
+        '''
+        freqs = np.array([0.1, 0.2, 0.3, 0.4])
+        evolve = Evolver(partitions = Partition(models = Model("nucleotide"), size = 10), tree = self.tree)
+        states = evolve._draw_states(freqs, (3, 50), np.random.default_rng(4))
+        rng = np.random.default_rng(4)
+        single = [[evolve._generate_prob_from_unif(freqs, rng) for r in range(3)] for j in range(50)]
+        np.testing.assert_array_equal(states, np.array(single).T, err_msg = "Root states drawn in bulk differ from those drawn one at a time.")
+
+
 
 
 class evolver_singlepart_nohet_tests(unittest.TestCase):
@@ -169,6 +201,20 @@ class evolver_singlepart_nohet_tests(unittest.TestCase):
         assert(len(aln) == 9), "Wrong number of sequences were written to file when write_anc=False."
         assert(len(aln[0]) == 10), "Output alignment incorrect length."
         
+        
+        
+    def test_evolver_singlepart_nohet_seqfile_anc_order(self):
+        '''
+            Test evolver with a single partition, no heterogeneity at all.
+            Ensure ancestors and tips written to seqfile in tree preorder.
+        '''
+        evolve = Evolver(partitions = self.part1, tree = self.tree)
+        evolve(seqfile = "out.fasta", write_anc = True, infofile=False, ratefile=False)
+        aln = AlignIO.read("out.fasta", "fasta")
+        os.remove("out.fasta")
+        names = [record.id for record in aln]
+        self.assertEqual(names, ["root", "internalNode2", "internalNode1", "t2", "t1", "t3", "internalNode3", "t5", "t4"], msg = "Sequences with ancestors not written in tree preorder.")
+        
 
 
     def test_evolver_singlepart_nohet_seqfile_phy(self):
@@ -441,6 +487,276 @@ class evolver_branchhet_tests(unittest.TestCase):
 
 
 
+class evolver_plan_tests(unittest.TestCase):
+    ''' 
+        Suite of tests for the compiled simulation plan.
+    '''
+    
+    def test_evolver_plan_branchhet(self):
+        '''
+            Model flags resolved once, including inheritance from parent branches?
+        '''
+        tree = read_tree( tree = "(((t2:0.36_m2_,t1:0.45):0.001,t3:0.77):0.44_m1_,(t5:0.77,t4:0.41):0.89);" )
+        root = Model("nucleotide", name = "root_model")
+        m1 = Model("nucleotide", name = "m1")
+        m2 = Model("nucleotide", name = "m2")
+        evolve = Evolver(tree = tree, partitions = Partition(models = [m1, m2, root], size = 10, root_model_name = "root_model"))
+        flags = dict( zip(evolve._plan_names, [evolve.partitions[0].models[i].name for i in evolve._plan_models[:,0]]) )
+        self.assertTrue(flags == {"root": "root_model", "internalNode2": "m1", "internalNode1": "m1", "t2": "m2", "t1": "m1", "t3": "m1", "internalNode3": "root_model", "t5": "root_model", "t4": "root_model"}, msg = "Model flags improperly resolved in the simulation plan.")
+        self.assertTrue(list(evolve._plan_ends) == [9, 6, 5, 4, 5, 6, 9, 8, 9], msg = "Subtree extents improperly compiled.")
+
+
+    def test_evolver_plan_deep_tree(self):
+        '''
+            A caterpillar tree deeper than the recursion limit can be simulated?
+        '''
+        tree = Node()
+        tree.name = "root"
+        tree.root = True
+        node = tree
+        for i in range(3000):
+            leaf = Node()
+            leaf.name, leaf.branch_length = "t" + str(i), 0.01
+            internal = Node()
+            internal.name, internal.branch_length = "n" + str(i), 0.01
+            node.children = [leaf, internal]
+            node = internal
+        evolve = Evolver(tree = tree, partitions = Partition(models = Model("nucleotide"), size = 5))
+        evolve(seqfile = None, ratefile = None, infofile = None)
+        self.assertTrue(len(evolve.get_sequences()) == 3001, msg = "Deep tree improperly simulated.")
+
+
+
+    def test_evolver_plan_ancestors(self):
+        '''
+            Only tips and requested ancestors are retained?
+        '''
+        tree = read_tree( tree = "(((t2:0.36,t1:0.45):0.001,t3:0.77):0.44,(t5:0.77,t4:0.41):0.89);" )
+        evolve = Evolver(tree = tree, partitions = Partition(models = Model("nucleotide"), size = 10), ancestors = False)
+        reps = evolve(replicates = 1)
+        self.assertTrue(sorted(reps.get_sequences(0, anc = True).keys()) == ["t1", "t2", "t3", "t4", "t5"], msg = "Ancestral sequences retained with ancestors = False.")
+        evolve = Evolver(tree = tree, partitions = Partition(models = Model("nucleotide"), size = 10), ancestors = ["root", "internalNode1"])
+        reps = evolve(replicates = 1)
+        self.assertTrue(sorted(reps.get_sequences(0, anc = True).keys()) == ["internalNode1", "root", "t1", "t2", "t3", "t4", "t5"], msg = "Requested ancestral sequences not retained.")
+
+
+    def test_evolver_plan_ancestors_not_retained(self):
+        '''
+            Ancestral sequences cannot be written or returned unless all are retained?
+        '''
+        tree = read_tree( tree = "(((t2:0.36,t1:0.45):0.001,t3:0.77):0.44,(t5:0.77,t4:0.41):0.89);" )
+        for ancestors in [False, ["root"]]:
+            evolve = Evolver(tree = tree, partitions = Partition(models = Model("nucleotide"), size = 10), ancestors = ancestors)
+            with self.assertRaises(AssertionError):
+                evolve(seqfile = "out.fasta", write_anc = True, ratefile = None, infofile = None)
+            self.assertFalse(os.path.exists("out.fasta"), msg = "Sequences written when ancestors were not retained.")
+            evolve(seqfile = None, ratefile = None, infofile = None)
+            self.assertEqual(len(evolve.get_sequences()), 5, msg = "Tip sequences not returned when ancestors were not retained.")
+            with self.assertRaises(AssertionError):
+                evolve.get_sequences(anc = True)
+            with self.assertRaises(AssertionError):
+                evolve.get_alignment_array(anc = True)
+
+
+
+
+class evolver_alignment_array_tests(unittest.TestCase):
+    ''' 
+        Suite of tests for the integer alignment accessor.
+    '''
+    
+    def setUp(self):
+        self.tree = read_tree( tree = "(((t2:0.36,t1:0.45):0.001,t3:0.77):0.44,(t5:0.77,t4:0.41):0.89);" )
+        m1 = Model("nucleotide", rate_factors = [2.0783848 ,  0.89073634,  0.05938242], rate_probs = [0.33, 0.33, 0.34])
+        self.partitions = [Partition(models = m1, size = 12, shuffle = True), Partition(models = Model("nucleotide"), size = 10)]
+
+
+    def test_evolver_alignment_array(self):
+        '''
+            Integer alignment matches the sequence strings, and is a view of the Evolver's buffer?
+        '''
+        evolve = Evolver(tree = self.tree, partitions = self.partitions)
+        evolve(seqfile = None, ratefile = None, infofile = None)
+        (matrix, names, partitions, rates) = evolve.get_alignment_array()
+        self.assertTrue(matrix.shape == (5, 22) and matrix.dtype == np.uint8, msg = "Alignment array has the wrong shape or type.")
+        self.assertTrue(np.shares_memory(matrix, evolve._sites_buffer), msg = "Alignment array is not a view.")
+        seqs = evolve.get_sequences()
+        for i in range(len(names)):
+            self.assertTrue("".join(["ACGT"[s] for s in matrix[i]]) == seqs[names[i]], msg = "Alignment array does not match sequences.")
+        self.assertTrue(list(partitions) == [0]*12 + [1]*10, msg = "Site partitions improperly returned.")
+        self.assertTrue(np.all(rates[12:] == 0) and rates.shape == (22,), msg = "Site rates improperly returned.")
+
+
+    def test_evolver_alignment_array_anc(self):
+        '''
+            Ancestral sequences follow the tips?
+        '''
+        evolve = Evolver(tree = self.tree, partitions = self.partitions)
+        evolve(seqfile = None, ratefile = None, infofile = None, replicates = 2)
+        (matrix, names, partitions, rates) = evolve.get_alignment_array(anc = True, replicate = 1)
+        self.assertTrue(matrix.shape == (9, 22) and names[:5] == ["t2", "t1", "t3", "t5", "t4"] and names[5] == "root", msg = "Alignment array with ancestors improperly ordered.")
+
+
+
+
+class evolver_replicates_tests(unittest.TestCase):
+    ''' 
+        Suite of tests for evolver when simulating replicates in a single traversal.
+    '''
+    
+    def setUp(self):
+        ''' 
+            Tree and partition set-up.
+        '''
+        self.tree = read_tree( tree = "(((t2:0.36,t1:0.45):0.001,t3:0.77):0.44,(t5:0.77,t4:0.41):0.89);" )
+        m1 = Model("nucleotide", rate_factors = [2.0783848 ,  0.89073634,  0.05938242], rate_probs = [0.33, 0.33, 0.34])
+        self.part1 = Partition(models = m1, size = 12)
+        self.part2 = Partition(models = Model("nucleotide"), size = 10)
+    
+    
+    def test_evolver_replicates_shape(self):
+        '''
+            Replicates object has the right dimensions?
+        '''
+        evolve = Evolver(partitions = [self.part1, self.part2], tree = self.tree)
+        reps = evolve(replicates = 7)
+        self.assertTrue(len(reps) == 7, msg = "Wrong number of replicates returned.")
+        self.assertTrue(reps.states.shape == (7, 5, 22), msg = "Replicate states have the wrong shape.")
+        self.assertTrue(reps.ancestral_states.shape == (7, 4, 22), msg = "Replicate ancestral states have the wrong shape.")
+        self.assertTrue(reps.site_rates.shape == (7, 22), msg = "Replicate site rates have the wrong shape.")
+        seqs = reps.get_sequences(6, anc = True)
+        self.assertTrue(len(seqs) == 9 and len(seqs["t1"]) == 22, msg = "Replicate sequences improperly converted to strings.")
+
+
+    def test_evolver_replicates_mrca(self):
+        '''
+            A provided root sequence is shared by all replicates?
+        '''
+        rootseq = "AAATTTCCCGGG"
+        p = Partition(root_sequence = rootseq, models = Model("nucleotide"))
+        evolve = Evolver(partitions = p, tree = self.tree)
+        reps = evolve(replicates = 3)
+        for r in range(3):
+            self.assertTrue(reps.get_sequences(r, anc = True)["root"] == rootseq, msg = "MRCA not preserved across replicates.")
+
+
+    def test_evolver_replicates_seed(self):
+        '''
+            Identical seeds give identical replicates?
+        '''
+        reps1 = Evolver(partitions = [self.part1, self.part2], tree = self.tree, seed = 42)(replicates = 3)
+        reps2 = Evolver(partitions = [self.part1, self.part2], tree = self.tree, seed = 42)(replicates = 3)
+        np.testing.assert_array_equal(reps1.states, reps2.states, err_msg = "Identical seeds did not give identical replicates.")
+
+
+    def test_evolver_replicates_global_seed(self):
+        '''
+            Without a seed, numpy's global seed makes each call reproducible?
+        '''
+        evolve = Evolver(partitions = [self.part1, self.part2], tree = self.tree)
+        np.random.seed(42)
+        reps1 = evolve(replicates = 3)
+        np.random.seed(42)
+        reps2 = evolve(replicates = 3)
+        np.random.seed(42)
+        reps3 = Evolver(partitions = [self.part1, self.part2], tree = self.tree)(replicates = 3)
+        np.testing.assert_array_equal(reps1.states, reps2.states, err_msg = "Global seed did not give identical replicates.")
+        np.testing.assert_array_equal(reps1.states, reps3.states, err_msg = "Global seed did not give identical replicates with a new Evolver.")
+        self.assertFalse(np.array_equal(reps1.states, evolve(replicates = 3).states), msg = "Unseeded calls gave identical replicates.")
+
+
+    def test_evolver_replicates_get_sequences(self):
+        '''
+            After simulating replicates, get_sequences gives the first replicate, on a fresh or a reused Evolver?
+        '''
+        evolve = Evolver(partitions = [self.part1, self.part2], tree = self.tree)
+        reps = evolve(replicates = 2)
+        self.assertEqual(evolve.get_sequences(), reps[0], msg = "get_sequences does not give the first replicate on a fresh Evolver.")
+        evolve(seqfile = None, ratefile = None, infofile = None)
+        reps = evolve(replicates = 2)
+        self.assertEqual(evolve.get_sequences(), reps[0], msg = "get_sequences does not give the first replicate on a reused Evolver.")
+        self.assertEqual(evolve.get_sequences(anc = True), reps.get_sequences(0, anc = True), msg = "get_sequences with ancestors does not give the first replicate.")
+
+
+    def test_evolver_replicates_files(self):
+        '''
+            Files written for each replicate, only when requested?
+        '''
+        evolve = Evolver(partitions = self.part1, tree = self.tree)
+        evolve(replicates = 2, ratefile = "rates.txt")
+        for r in [1, 2]:
+            with open("rates_" + str(r) + ".txt", "r") as test_h:
+                test = test_h.readlines()
+            os.remove("rates_" + str(r) + ".txt")
+            self.assertTrue( len(test) == 13 , msg="Ratefile improperly written for replicate " + str(r) + ".")
+
+
+
+    def test_evolver_replicates_threads(self):
+        '''
+            Evolving partitions on threads gives the same result as evolving them in turn?
+        '''
+        part3 = Partition(models = Model("nucleotide", {"kappa": 4.}), size = 15, shuffle = True)
+        reps1 = Evolver(partitions = [self.part1, self.part2, part3], tree = self.tree, seed = 11)(replicates = 4)
+        reps2 = Evolver(partitions = [self.part1, self.part2, part3], tree = self.tree, seed = 11, threads = 3)(replicates = 4)
+        np.testing.assert_array_equal(reps1.states, reps2.states, err_msg = "Threaded partitions did not reproduce serial simulation.")
+        np.testing.assert_array_equal(reps1.site_rates, reps2.site_rates, err_msg = "Threaded partitions did not reproduce serial site rates.")
+        self.assertFalse(os.path.exists("simulated_alignment_1.fasta"), msg = "Sequence file written for replicates without being requested.")
+
+
+
+class evolver_site_models_tests(unittest.TestCase):
+    ''' 
+        Suite of tests for evolver with a SiteModelPartition.
+    '''
+    
+    def setUp(self):
+        ''' 
+            Tree and stack set-up. Each model strongly prefers a single nucleotide.
+        '''
+        self.tree = read_tree( tree = "(((t2:0.36,t1:0.45):0.001,t3:0.77):0.44,(t5:0.77,t4:0.41):0.89);" )
+        freqs = np.full((4, 4), 0.001)
+        freqs[np.arange(4), np.arange(4)] = 0.997
+        self.stack = ModelStack("mutsel", {"state_freqs": freqs})
+
+
+    def test_evolver_site_models_states(self):
+        '''
+            Every site evolves according to its own model, at its own position?
+        '''
+        site_models = [3, 0, 0, 2, 1, 3, 2, 1] * 5
+        evolve = Evolver(tree = self.tree, partitions = [Partition(models = Model("nucleotide"), size = 6), SiteModelPartition(models = self.stack, site_models = site_models)], seed = 5)
+        evolve(seqfile = None, ratefile = None, infofile = None)
+        (matrix, names, partitions, rates) = evolve.get_alignment_array(anc = True)
+        self.assertTrue(matrix.shape == (9, 46) and list(partitions) == [0]*6 + [1]*40, msg = "SiteModelPartition improperly sized.")
+        self.assertTrue(np.mean(matrix[:, 6:] == np.array(site_models)) > 0.95, msg = "Sites did not evolve according to their own models.")
+
+
+    def test_evolver_site_models_queries(self):
+        '''
+            Partition queries answered for a SiteModelPartition, as for a Partition?
+        '''
+        part = SiteModelPartition(models = self.stack)
+        self.assertFalse(part.is_codon_model() or part.site_het() or part.branch_het(), msg = "SiteModelPartition improperly queried.")
+        self.assertFalse(Partition(models = Model("nucleotide"), size = 5).is_codon_model(), msg = "Nucleotide partition reported as dN/dS heterogeneous.")
+        self.assertTrue(Partition(models = Model("gy", {"omega": [0.1, 1.5], "alpha": [1., 1.]}, rate_probs = [0.5, 0.5]), size = 5).is_codon_model(), msg = "dN/dS heterogeneous partition not reported.")
+
+
+    def test_evolver_site_models_sanity(self):
+        '''
+            Site models must index the stack, and match the size and root sequence?
+        '''
+        with self.assertRaises(AssertionError):
+            SiteModelPartition(models = self.stack, site_models = [0, 4])
+        with self.assertRaises(AssertionError):
+            SiteModelPartition(models = self.stack, size = 5)
+        with self.assertRaises(AssertionError):
+            SiteModelPartition(models = self.stack, root_sequence = "ACG")
+        with self.assertRaises(AssertionError):
+            SiteModelPartition(models = Model("nucleotide"))
+
+
+
 class evolver_setcode(unittest.TestCase):
     '''
         Tests to ensure that the self._code is properly setup.
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    Test genetics module.
+'''
+
+import unittest
+from pyvolve import *
+import numpy as np
+
+
+class genetics_tables_tests(unittest.TestCase):
+    '''
+        Tests for the lookup tables of Genetics.
+    '''
+
+    def setUp(self):
+        self.molecules = Genetics()
+
+
+    def test_genetics_state_tables(self):
+        '''
+            State indices, bytes, and lookups agree with the lists of states?
+        '''
+        for (name, code) in [("nucleotide", self.molecules.nucleotides), ("amino_acid", self.molecules.amino_acids), ("codon", self.molecules.codons)]:
+            index = getattr(self.molecules, name + "_index")
+            self.assertEqual([index[state] for state in code], list(range(len(code))), msg = "Bad " + name + " index.")
+            self.assertEqual(getattr(self.molecules, name + "_bytes")[ np.arange(len(code)) ].tobytes(), "".join(code).encode("ascii"), msg = "Bad " + name + " bytes.")
+        self.assertTrue( np.array_equal(self.molecules.nucleotide_lookup[ np.frombuffer(b"GATN-", dtype = np.uint8) ], [2, 0, 3, -1, -1]), msg = "Bad nucleotide lookup.")
+        self.assertTrue( np.array_equal(self.molecules.amino_acid_lookup[ np.frombuffer(b"WAX", dtype = np.uint8) ], [18, 0, -1]), msg = "Bad amino acid lookup.")
+        self.assertEqual(self.molecules.codon_lookup[3, 0, 0], -1, msg = "Stop codon TAA given an index.")
+        self.assertEqual(self.molecules.codon_lookup[3, 2, 2], self.molecules.codons.index("TGG"), msg = "Bad codon lookup.")
+        self.assertEqual(self.molecules.amino_acids[ self.molecules.codon_amino_acids[ self.molecules.codon_index["ATG"] ] ], "M", msg = "Bad codon amino acids.")
+
+
+
+    def test_genetics_codon_pair_tables(self):
+        '''
+            Codon-pair tables agree with pairs of codon strings?
+        '''
+        nucs = self.molecules.nucleotides
+        for (s, source) in enumerate(self.molecules.codons):
+            for (t, target) in enumerate(self.molecules.codons):
+                diff = [i for i in range(3) if source[i] != target[i]]
+                ti = [i for i in diff if source[i] + target[i] in ["AG", "GA", "CT", "TC"]]
+                self.assertEqual(self.molecules.codon_num_diff[s, t], len(diff))
+                self.assertEqual(list(np.flatnonzero(self.molecules.codon_diff_positions[s, t])), diff)
+                self.assertEqual(self.molecules.codon_syn[s, t], self.molecules.codon_dict[source] == self.molecules.codon_dict[target])
+                self.assertEqual(self.molecules.codon_num_ti[s, t], len(ti))
+                self.assertEqual(self.molecules.codon_num_tv[s, t], len(diff) - len(ti))
+                if len(diff) > 0:
+                    pair = nucs[ self.molecules.codon_source_nuc[s, t] ] + nucs[ self.molecules.codon_target_nuc[s, t] ]
+                    self.assertEqual(pair, source[diff[0]] + target[diff[0]])
+                    self.assertEqual(self.molecules.codon_nuc_pair[s, t], 4*nucs.index(pair[0]) + nucs.index(pair[1]))
+
+
+
+    def test_genetics_tables_shared(self):
+        '''
+            Tables shared by all instances, and read-only?
+        '''
+        self.assertTrue(Genetics().codon_syn is self.molecules.codon_syn, msg = "Tables rebuilt for a new instance.")
+        with self.assertRaises(ValueError):
+            self.molecules.codon_num_diff[0, 1] = 2
+        with self.assertRaises(TypeError):
+            self.molecules.codon_index["TAA"] = 61
+
+
+
+
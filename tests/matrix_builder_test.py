@@ -11,7 +11,6 @@
 import unittest
 import numpy as np
 from Bio import Seq
-from Bio.Alphabet import generic_dna
 from pyvolve import matrix_builder
 from pyvolve import Genetics
 MOLECULES = Genetics()
@@ -22,8 +21,8 @@ DECIMAL=8
 
 class matrixBuilder_baseClass_tests(unittest.TestCase):
     ''' 
-        Set of unittests for simple base class functions in matrixBuilder.
-        Functions tested here include _is_TI, _is_syn, _get_nucleotide_diff. 
+        Set of unittests for the codon-pair tables (from Genetics) from which matrixBuilder subclasses build their rates.
+        Tables tested here identify transitions, synonymous changes, and nucleotide differences. 
         All other functions require full model specification, so they are tested elsewhere.
         Note: state_freqs specification is required. To test this, all frequencies must be unique.
     '''
@@ -32,22 +31,32 @@ class matrixBuilder_baseClass_tests(unittest.TestCase):
         codonFreqs = [0.01617666, 0.00291771, 0.02664918, 0.02999061, 0.00717921, 0.00700012, 0.01435559, 0.0231568, 0.02403056, 0.00737008, 0.03185765, 0.0193576, 0.03277142, 0.02141258, 0.0127537, 0.00298803, 0.0256333, 0.02312437, 0.01861465, 0.01586447, 0.00373147, 0.02662654, 0.00082524, 0.00048916, 0.01191673, 0.00512658, 0.00050502, 0.01688169, 0.01843001, 0.00215437, 0.02659356, 0.02377742, 0.01169375, 0.00097256, 0.02937344, 0.00268204, 0.01414414, 0.02781933, 0.00070877, 0.02370841, 0.02984617, 0.01828081, 0.01002825, 0.00870788, 0.00728006, 0.02179328, 0.00379049, 0.01978996, 0.00443774, 0.01201798, 0.02030269, 0.01238501, 0.01279963, 0.02094385, 0.02810987, 0.00918507, 0.02880549, 0.0029311, 0.0237658, 0.03194712, 0.06148723]
         params = {'state_freqs': codonFreqs}
         self.baseObject = matrix_builder.MatrixBuilder("nucleotide", params)
+
+    def is_TI(self, source, target):
+        ''' Whether a nucleotide change is a transition, according to the codon-pair tables (for codons CCN, which differ only at the last position). '''
+        return MOLECULES.codon_num_ti[ MOLECULES.codon_index["CC" + source] ][ MOLECULES.codon_index["CC" + target] ] == 1
+
+    def nucleotide_diff(self, source, target):
+        ''' The nucleotide difference(s) between two codons, e.g. "ATAT" for AAA -> ATT, according to the codon-pair tables. '''
+        positions = np.flatnonzero(MOLECULES.codon_diff_positions[source][target])
+        return "".join( [MOLECULES.codons[source][i] + MOLECULES.codons[target][i] for i in positions] )
+        
         
     def test_matrixBuilder_baseClass_is_TI(self):    
         ''' Test that transitions can be properly identified. '''
                 
-        self.assertTrue( self.baseObject._is_TI('A', 'G'), msg = "matrixBuilder._is_TI() does not think A -> G is a transition.")
-        self.assertTrue( self.baseObject._is_TI('G', 'A'), msg = "matrixBuilder._is_TI() does not think G -> A is a transition.")
-        self.assertTrue( self.baseObject._is_TI('C', 'T'), msg = "matrixBuilder._is_TI() does not think C -> T is a transition.")
-        self.assertTrue( self.baseObject._is_TI('T', 'C'), msg = "matrixBuilder._is_TI() does not think C -> T is a transition.")
-        self.assertFalse( self.baseObject._is_TI('A', 'C'), msg = "matrixBuilder._is_TI() mistakenly thinks A -> C is a transition.")
-        self.assertFalse( self.baseObject._is_TI('C', 'A'), msg = "matrixBuilder._is_TI() mistakenly thinks C -> A is a transition.")
-        self.assertFalse( self.baseObject._is_TI('A', 'T'), msg = "matrixBuilder._is_TI() mistakenly thinks A -> T is a transition.")
-        self.assertFalse( self.baseObject._is_TI('T', 'A'), msg = "matrixBuilder._is_TI() mistakenly thinks T -> A is a transition.")
-        self.assertFalse( self.baseObject._is_TI('G', 'C'), msg = "matrixBuilder._is_TI() mistakenly thinks G -> C is a transition.")
-        self.assertFalse( self.baseObject._is_TI('C', 'G'), msg = "matrixBuilder._is_TI() mistakenly thinks C -> G is a transition.")
-        self.assertFalse( self.baseObject._is_TI('G', 'T'), msg = "matrixBuilder._is_TI() mistakenly thinks G -> T is a transition.")
-        self.assertFalse( self.baseObject._is_TI('T', 'G'), msg = "matrixBuilder._is_TI() mistakenly thinks T -> G is a transition.")
+        self.assertTrue( self.is_TI('A', 'G'), msg = "the codon-pair tables do not think A -> G is a transition.")
+        self.assertTrue( self.is_TI('G', 'A'), msg = "the codon-pair tables do not think G -> A is a transition.")
+        self.assertTrue( self.is_TI('C', 'T'), msg = "the codon-pair tables do not think C -> T is a transition.")
+        self.assertTrue( self.is_TI('T', 'C'), msg = "the codon-pair tables do not think C -> T is a transition.")
+        self.assertFalse( self.is_TI('A', 'C'), msg = "the codon-pair tables mistakenly think A -> C is a transition.")
+        self.assertFalse( self.is_TI('C', 'A'), msg = "the codon-pair tables mistakenly think C -> A is a transition.")
+        self.assertFalse( self.is_TI('A', 'T'), msg = "the codon-pair tables mistakenly think A -> T is a transition.")
+        self.assertFalse( self.is_TI('T', 'A'), msg = "the codon-pair tables mistakenly think T -> A is a transition.")
+        self.assertFalse( self.is_TI('G', 'C'), msg = "the codon-pair tables mistakenly think G -> C is a transition.")
+        self.assertFalse( self.is_TI('C', 'G'), msg = "the codon-pair tables mistakenly think C -> G is a transition.")
+        self.assertFalse( self.is_TI('G', 'T'), msg = "the codon-pair tables mistakenly think G -> T is a transition.")
+        self.assertFalse( self.is_TI('T', 'G'), msg = "the codon-pair tables mistakenly think T -> G is a transition.")
 
 
 
@@ -59,21 +68,21 @@ class matrixBuilder_baseClass_tests(unittest.TestCase):
             for target in range(61):
                 sourceCodon = MOLECULES.codons[source]
                 targetCodon = MOLECULES.codons[target]
-                source_aa = str( Seq.Seq(sourceCodon, generic_dna).translate() )
-                target_aa = str( Seq.Seq(targetCodon, generic_dna).translate() )
+                source_aa = str( Seq.Seq(sourceCodon).translate() )
+                target_aa = str( Seq.Seq(targetCodon).translate() )
                 if source_aa == target_aa:
-                    self.assertTrue( self.baseObject._is_syn(source, target), msg = ("matrixBuilder._is_syn() does not think", source, " -> ", target, " is synonymous.") )
+                    self.assertTrue( MOLECULES.codon_syn[source][target], msg = ("the codon-pair tables do not think", source, " -> ", target, " is synonymous.") )
                 else:
-                    self.assertFalse( self.baseObject._is_syn(source, target), msg = ("matrixBuilder._is_syn() mistakenly thinks", source, " -> ", target, " is synonymous.") )
+                    self.assertFalse( MOLECULES.codon_syn[source][target], msg = ("the codon-pair tables mistakenly think", source, " -> ", target, " is synonymous.") )
 
 
     def test_matrixBuilder_baseClass_get_nucleotide_diff(self):
         ''' Test that nucleotide differences between codons can be identified properly. '''
         
-        self.assertEqual( self.baseObject._get_nucleotide_diff( MOLECULES.codons.index('AAA'), MOLECULES.codons.index('AAA')), '', msg = "matrixBuilder._get_nucleotide_diff can't do same codon." )
-        self.assertEqual( self.baseObject._get_nucleotide_diff( MOLECULES.codons.index('AAA'), MOLECULES.codons.index('CAA')), 'AC',  msg = "matrixBuilder._get_nucleotide_diff can't do one difference, muliple=False" )
-        self.assertEqual( self.baseObject._get_nucleotide_diff( MOLECULES.codons.index('AAA'), MOLECULES.codons.index('ATT')), 'ATAT', msg = "matrixBuilder._get_nucleotide_diff can't do two differences, multiple=True." )
-        self.assertEqual( self.baseObject._get_nucleotide_diff( MOLECULES.codons.index('AAA'), MOLECULES.codons.index('TTT')), 'ATATAT', msg = "matrixBuilder._get_nucleotide_diff can't do fully distinct, multiple=True." )
+        self.assertEqual( self.nucleotide_diff( MOLECULES.codons.index('AAA'), MOLECULES.codons.index('AAA')), '', msg = "The codon-pair tables can't do same codon." )
+        self.assertEqual( self.nucleotide_diff( MOLECULES.codons.index('AAA'), MOLECULES.codons.index('CAA')), 'AC',  msg = "The codon-pair tables can't do one difference, muliple=False" )
+        self.assertEqual( self.nucleotide_diff( MOLECULES.codons.index('AAA'), MOLECULES.codons.index('ATT')), 'ATAT', msg = "The codon-pair tables can't do two differences, multiple=True." )
+        self.assertEqual( self.nucleotide_diff( MOLECULES.codons.index('AAA'), MOLECULES.codons.index('TTT')), 'ATATAT', msg = "The codon-pair tables can't do fully distinct, multiple=True." )
 
 
 
@@ -125,7 +134,7 @@ class matrixBuilder_MechCodon_Matrix_scaling_tests(unittest.TestCase):
 class matrixBuilder_MechCodon_Matrix_tests(unittest.TestCase):
     ''' 
         Set of unittests for the matrix_builder.MechCodon_Matrix subclass of matrixBuilder.
-        Functions tested here include getTargetFreq, _calc_syn_prob, _calc_nonsyn_prob, _calc_instantaneous_prob.
+        Functions tested here include _build_rates.
     '''
     
     def setUp(self):
@@ -138,54 +147,54 @@ class matrixBuilder_MechCodon_Matrix_tests(unittest.TestCase):
         ############################################################################
         
    
-    def test_MechCodon_Matrix_MG_calc_prob(self):
+    def test_MechCodon_Matrix_MG_build_rates(self):
         ''' Test (non)synonymous probability calculation for MG. '''
         
         codonMatrix = matrix_builder.MechCodon_Matrix( "mg", self.params_mg )
 
         # GCA -> GCT, synonymous
         correctProb1 =  0.29781111 * 1.5 * 1.83
-        self.assertTrue( abs(codonMatrix._calc_prob(39, "T", "AT", codonMatrix.params["alpha"]) - correctProb1) < ZERO, msg = "matrix_builder.MechCodon_MatrixBuiler._calc_prob can't do syn MG.")
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[ MOLECULES.codon_index["GCA"] ][ MOLECULES.codon_index["GCT"] ] - correctProb1) < ZERO, msg = "matrix_builder.MechCodon_Matrix._build_rates can't do syn MG.")
         # TTA -> ATA, nonsyn. Rounding is sadly a bit funky here, so 1e-7. 
         correctProb2 =  0.24206108 * 1.5 * 5.7
-        self.assertTrue( abs(codonMatrix._calc_prob(12, "A", "AT", codonMatrix.params["beta"]) - correctProb2) < 1e-7, msg = "matrix_builder.MechCodon_MatrixBuiler._calc_prob can't do nonsyn MG.")
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[ MOLECULES.codon_index["TTA"] ][ MOLECULES.codon_index["ATA"] ] - correctProb2) < 1e-7, msg = "matrix_builder.MechCodon_Matrix._build_rates can't do nonsyn MG.")
  
 
     
     
 
-    def test_MechCodon_Matrix_GY_calc_prob(self):
+    def test_MechCodon_Matrix_GY_build_rates_syn_nonsyn(self):
         ''' Test (non)synonymous probability calculation for GY. '''
         
         codonMatrix = matrix_builder.MechCodon_Matrix( "gy", self.params_gy )
 
         # GCA -> GCT, synonymous
         correctProb1 =  0.02370841 * 1.5 * 1.83
-        self.assertTrue( abs(codonMatrix._calc_prob(39, "T", "AT", codonMatrix.params["alpha"]) - correctProb1) < ZERO, msg = "matrix_builder.MechCodon_MatrixBuiler._calc_prob can't do syn GY.")
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[ MOLECULES.codon_index["GCA"] ][ MOLECULES.codon_index["GCT"] ] - correctProb1) < ZERO, msg = "matrix_builder.MechCodon_Matrix._build_rates can't do syn GY.")
         # TTA -> ATA, nonsynonymous
         correctProb2 =  0.03277142 * 1.5 * 5.7
-        self.assertTrue( abs(codonMatrix._calc_prob(12, "A", "AT", codonMatrix.params["beta"]) - correctProb2) < ZERO, msg = "matrix_builder.MechCodon_MatrixBuiler._calc_prob can't do nonsyn GY.")
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[ MOLECULES.codon_index["TTA"] ][ MOLECULES.codon_index["ATA"] ] - correctProb2) < ZERO, msg = "matrix_builder.MechCodon_Matrix._build_rates can't do nonsyn GY.")
  
 
 
-    def test_MechCodon_Matrix_GY_calc_instantaneous_prob(self):    
-        ''' Test that substitution probabilities are properly calculated. Only test GY, since MG will work if calc_prob works.
+    def test_MechCodon_Matrix_GY_build_rates(self):    
+        ''' Test that substitution probabilities are properly calculated. Only test GY, since MG rates are tested above.
             Conduct tests for - no change, two changes, three changes, synonymous, nonsynonymous.
         '''
         codonMatrix = matrix_builder.MechCodon_Matrix( "gy", self.params_gy )
         
         # Test no change, two changes, three changes. All should be 0
-        self.assertTrue( codonMatrix._calc_instantaneous_prob(7, 7, codonMatrix.params) < ZERO, msg = "matrix_builder.MechCodon_Matrix._calc_instantaneous_prob doesn't return 0 for same codon substitution.")
-        self.assertTrue( codonMatrix._calc_instantaneous_prob(7, 8, codonMatrix.params) < ZERO, msg = "matrix_builder.MechCodon_Matrix._calc_instantaneous_prob doesn't return 0 for two nucleotide changes.")
-        self.assertTrue( codonMatrix._calc_instantaneous_prob(7, 24, codonMatrix.params) < ZERO, msg = "matrix_builder.MechCodon_Matrix._calc_instantaneous_prob doesn't return 0 for three nucleotide changes.")
+        self.assertTrue( codonMatrix._build_rates(codonMatrix.params)[7][7] < ZERO, msg = "matrix_builder.MechCodon_Matrix._build_rates doesn't return 0 for same codon substitution.")
+        self.assertTrue( codonMatrix._build_rates(codonMatrix.params)[7][8] < ZERO, msg = "matrix_builder.MechCodon_Matrix._build_rates doesn't return 0 for two nucleotide changes.")
+        self.assertTrue( codonMatrix._build_rates(codonMatrix.params)[7][24] < ZERO, msg = "matrix_builder.MechCodon_Matrix._build_rates doesn't return 0 for three nucleotide changes.")
         
         # Synonymous. GAG -> GAA
         correctProbSyn = 0.01169375 * 1.83 * 4.0
-        self.assertTrue( abs(codonMatrix._calc_instantaneous_prob(34, 32, codonMatrix.params) - correctProbSyn) < ZERO, msg = "matrix_builder.MechCodon_Matrix._calc_instantaneous_prob wrong for GAG -> GAA (synonymous) when GY.")
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[34][32] - correctProbSyn) < ZERO, msg = "matrix_builder.MechCodon_Matrix._build_rates wrong for GAG -> GAA (synonymous) when GY.")
 
         # Nonsynonymous. TCG -> ACG
         correctProbNonsyn = 0.01435559 * 5.7 * 1.5
-        self.assertTrue( abs(codonMatrix._calc_instantaneous_prob(52, 6, codonMatrix.params) - correctProbNonsyn) < ZERO, msg = "matrix_builder.MechCodon_Matrix._calc_instantaneous_prob wrong for TCG -> ACG (nonsynonymous) when GY.")
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[52][6] - correctProbNonsyn) < ZERO, msg = "matrix_builder.MechCodon_Matrix._build_rates wrong for TCG -> ACG (nonsynonymous) when GY.")
 
 
 
@@ -193,7 +202,7 @@ class matrixBuilder_MechCodon_Matrix_tests(unittest.TestCase):
 class matrixBuilder_ECM_Matrix_tests(unittest.TestCase):
     ''' 
         Set of unittests for the ECM_Matrix subclass of matrixBuilder.
-        Functions tested here include _is_syn, getCodonFreq, _calc_syn_prob, _calc_nonsyn_prob, _calc_instantaneous_prob.
+        Functions tested here include _init_empirical_matrix, _kappa_matrix, _build_rates.
     '''
     
     def setUp(self):
@@ -224,74 +233,75 @@ class matrixBuilder_ECM_Matrix_tests(unittest.TestCase):
 
 
 
-    def test_ECM_Matrix_set_kappa_param(self):
-        ''' Tests _set_kappa_param function. '''
+    def test_ECM_Matrix_kappa_matrix(self):
+        ''' Tests _kappa_matrix function, for codons differing by the given nucleotide changes. '''
         
         codonMatrix = matrix_builder.ECM_Matrix( "ecmrest", self.params )
+        kappa = codonMatrix._kappa_matrix()
         
-        self.assertEqual( codonMatrix._set_kappa_param('CT'), 3.5, msg = ("ECM_Matrix._set_kappa_param() doesn't work for single transition."))
-        self.assertEqual( codonMatrix._set_kappa_param('CG'), 0.75, msg = ("ECM_Matrix._set_kappa_param() doesn't work for single transversion."))
-        self.assertEqual( codonMatrix._set_kappa_param('AGGA'), 3.5**2, msg = ("ECM_Matrix._set_kappa_param() doesn't work for two transitions."))
-        self.assertEqual( codonMatrix._set_kappa_param('TGAT'), 0.75**2, msg = ("ECM_Matrix._set_kappa_param() doesn't work for two transversions."))
-        self.assertEqual( codonMatrix._set_kappa_param('AGTG'), 3.5*0.75, msg = ("ECM_Matrix._set_kappa_param() doesn't work for single TI, single TV."))
-        self.assertEqual( codonMatrix._set_kappa_param('AGTCCA'), 3.5**2 * 0.75, msg = ("ECM_Matrix._set_kappa_param() doesn't work for 2 TI's, 1 TV."))
-        self.assertEqual( codonMatrix._set_kappa_param('GTTACT'), 0.75**2 * 3.5, msg = ("ECM_Matrix._set_kappa_param() doesn't work for 1 TI, 2 TV's."))
-        self.assertEqual( codonMatrix._set_kappa_param('AGTCCT'), 3.5**3, msg = ("ECM_Matrix._set_kappa_param() doesn't work for 3 TI's."))
-        self.assertEqual( codonMatrix._set_kappa_param('ATGCCA'), 0.75**3, msg = ("ECM_Matrix._set_kappa_param() doesn't work for 3 TV's."))
-
-
-    def test_ECM_Matrix_calc_instantaneous_prob_restricted(self):
-        ''' Tests _calc_instantaneous_prob for restricted ECM matrix. '''
+        self.assertEqual( kappa[ MOLECULES.codon_index["CCC"] ][ MOLECULES.codon_index["CTC"] ], 3.5, msg = ("ECM_Matrix._kappa_matrix() doesn't work for single transition."))
+        self.assertEqual( kappa[ MOLECULES.codon_index["CCC"] ][ MOLECULES.codon_index["CGC"] ], 0.75, msg = ("ECM_Matrix._kappa_matrix() doesn't work for single transversion."))
+        self.assertEqual( kappa[ MOLECULES.codon_index["AGC"] ][ MOLECULES.codon_index["GAC"] ], 3.5**2, msg = ("ECM_Matrix._kappa_matrix() doesn't work for two transitions."))
+        self.assertEqual( kappa[ MOLECULES.codon_index["TAC"] ][ MOLECULES.codon_index["GTC"] ], 0.75**2, msg = ("ECM_Matrix._kappa_matrix() doesn't work for two transversions."))
+        self.assertEqual( kappa[ MOLECULES.codon_index["ATC"] ][ MOLECULES.codon_index["GGC"] ], 3.5*0.75, msg = ("ECM_Matrix._kappa_matrix() doesn't work for single TI, single TV."))
+        self.assertEqual( kappa[ MOLECULES.codon_index["ATC"] ][ MOLECULES.codon_index["GCA"] ], 3.5**2 * 0.75, msg = ("ECM_Matrix._kappa_matrix() doesn't work for 2 TI's, 1 TV."))
+        self.assertEqual( kappa[ MOLECULES.codon_index["GTC"] ][ MOLECULES.codon_index["TAT"] ], 0.75**2 * 3.5, msg = ("ECM_Matrix._kappa_matrix() doesn't work for 1 TI, 2 TV's."))
+        self.assertEqual( kappa[ MOLECULES.codon_index["ATC"] ][ MOLECULES.codon_index["GCT"] ], 3.5**3, msg = ("ECM_Matrix._kappa_matrix() doesn't work for 3 TI's."))
+        self.assertEqual( kappa[ MOLECULES.codon_index["AGC"] ][ MOLECULES.codon_index["TCA"] ], 0.75**3, msg = ("ECM_Matrix._kappa_matrix() doesn't work for 3 TV's."))
+
+
+    def test_ECM_Matrix_build_rates_restricted(self):
+        ''' Tests _build_rates for restricted ECM matrix. '''
         
         self.params["state_freqs"] = self.codonFreqs
         codonMatrix = matrix_builder.ECM_Matrix( "ecmrest", self.params )
 
-        self.assertEqual( codonMatrix._calc_instantaneous_prob(0, 0, codonMatrix.params), 0., msg = ("ECM_Matrix._calc_instantaneous_prob() doesn't work for zero changes, restricted matrix."))
-        self.assertEqual( codonMatrix._calc_instantaneous_prob(0, 5, codonMatrix.params), 0., msg = ("ECM_Matrix._calc_instantaneous_prob() doesn't work for two changes, restricted matrix."))
-        self.assertEqual( codonMatrix._calc_instantaneous_prob(0, 45, codonMatrix.params), 0., msg = ("ECM_Matrix._calc_instantaneous_prob() doesn't work for three changes, restricted matrix."))
+        self.assertEqual( codonMatrix._build_rates(codonMatrix.params)[0][0], 0., msg = ("ECM_Matrix._build_rates() doesn't work for zero changes, restricted matrix."))
+        self.assertEqual( codonMatrix._build_rates(codonMatrix.params)[0][5], 0., msg = ("ECM_Matrix._build_rates() doesn't work for two changes, restricted matrix."))
+        self.assertEqual( codonMatrix._build_rates(codonMatrix.params)[0][45], 0., msg = ("ECM_Matrix._build_rates() doesn't work for three changes, restricted matrix."))
 
         # AAA -> AAG. synonymous, single TI
         correct = 0.02664918 * 0.762877 * 3.5 * 0.5
-        self.assertTrue( abs(codonMatrix._calc_instantaneous_prob(0, 2, codonMatrix.params) - correct) < ZERO, msg = ("ECM_Matrix._calc_instantaneous_prob() doesn't work for synonymous single TI change, restricted matrix."))
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[0][2] - correct) < ZERO, msg = ("ECM_Matrix._build_rates() doesn't work for synonymous single TI change, restricted matrix."))
         
         # AAA -> AAT. nonsynonymous, single TV
         correct = 0.02999061 * 4.929483 * 0.75 * 2.1
-        self.assertTrue( abs(codonMatrix._calc_instantaneous_prob(0, 3, codonMatrix.params) - correct) < ZERO, msg = ("ECM_Matrix._calc_instantaneous_prob() doesn't work for nonsynonymous single TV change, restricted matrix."))
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[0][3] - correct) < ZERO, msg = ("ECM_Matrix._build_rates() doesn't work for nonsynonymous single TV change, restricted matrix."))
         
 
 
-    def test_ECM_Matrix_calc_instantaneous_prob_unestricted(self):
-        ''' Tests _calc_instantaneous_prob for unrestricted ECM matrix. '''
+    def test_ECM_Matrix_build_rates_unestricted(self):
+        ''' Tests _build_rates for unrestricted ECM matrix. '''
         
         self.params["state_freqs"] = self.codonFreqs
         codonMatrix = matrix_builder.ECM_Matrix( "ecmunrest", self.params )
 
         # no change
-        self.assertEqual( codonMatrix._calc_instantaneous_prob(0, 0, codonMatrix.params), 0., msg = ("ECM_Matrix._calc_instantaneous_prob() doesn't work for zero changes, unrestricted matrix."))
+        self.assertEqual( codonMatrix._build_rates(codonMatrix.params)[0][0], 0., msg = ("ECM_Matrix._build_rates() doesn't work for zero changes, unrestricted matrix."))
 
         # AAA -> AAG. synonymous, single TI
         correct = 0.02664918 * 2.931524 * 3.5 * 0.5
-        self.assertTrue( abs(codonMatrix._calc_instantaneous_prob(0, 2, codonMatrix.params) - correct) < ZERO, msg = ("ECM_Matrix._calc_instantaneous_prob() doesn't work for synonymous single TI change, unrestricted matrix."))
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[0][2] - correct) < ZERO, msg = ("ECM_Matrix._build_rates() doesn't work for synonymous single TI change, unrestricted matrix."))
         
         # AAA -> AAT. nonsynonymous, single TV
         correct = 0.02999061 * 2.07515399 * 0.75 * 2.1
-        self.assertTrue( abs(codonMatrix._calc_instantaneous_prob(0, 3, codonMatrix.params) - correct) < ZERO, msg = ("ECM_Matrix._calc_instantaneous_prob() doesn't work for nonsynonymous single TV change, unrestricted matrix."))
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[0][3] - correct) < ZERO, msg = ("ECM_Matrix._build_rates() doesn't work for nonsynonymous single TV change, unrestricted matrix."))
         
         # AAA -> AGG. nonsynonymous, two TI
         correct = 0.03185765 * 1.868194 * 3.5 * 3.5 * 2.1
-        self.assertTrue( abs(codonMatrix._calc_instantaneous_prob(0, 10, codonMatrix.params) - correct) < ZERO, msg = ("ECM_Matrix._calc_instantaneous_prob() doesn't work for nonsynonymous 2 TI change, unrestricted matrix."))
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[0][10] - correct) < ZERO, msg = ("ECM_Matrix._build_rates() doesn't work for nonsynonymous 2 TI change, unrestricted matrix."))
         
         # AAA -> ACC. nonsynonymous, two TV
         correct = 0.00700012 * 0.089476 * 0.75 * 0.75 * 2.1
-        self.assertTrue( abs(codonMatrix._calc_instantaneous_prob(0, 5, codonMatrix.params) - correct) < ZERO, msg = ("ECM_Matrix._calc_instantaneous_prob() doesn't work for nonsynonymous 2 TV change, unrestricted matrix."))
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[0][5] - correct) < ZERO, msg = ("ECM_Matrix._build_rates() doesn't work for nonsynonymous 2 TV change, unrestricted matrix."))
         
         # AAA -> ACG. nonsynonymous, 1 TI, 1 TV
         correct = 0.01435559 * 0.199589 * 0.75 * 3.5 * 2.1
-        self.assertTrue( abs(codonMatrix._calc_instantaneous_prob(0, 6, codonMatrix.params) - correct) < ZERO, msg = ("ECM_Matrix._calc_instantaneous_prob() doesn't work for nonsynonymous 2 TV change, unrestricted matrix."))
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[0][6] - correct) < ZERO, msg = ("ECM_Matrix._build_rates() doesn't work for nonsynonymous 2 TV change, unrestricted matrix."))
         
         # AAA -> TCG. nonsynonymous, 1 TI, 2 TV
         correct = 0.01279963 * 0.000459 * 0.75 * 0.75 * 3.5 * 2.1
-        self.assertTrue( abs(codonMatrix._calc_instantaneous_prob(0, 52, codonMatrix.params) - correct) < ZERO, msg = ("ECM_Matrix._calc_instantaneous_prob() doesn't work for nonsynonymous 2 TV change, unrestricted matrix."))
+        self.assertTrue( abs(codonMatrix._build_rates(codonMatrix.params)[0][52] - correct) < ZERO, msg = ("ECM_Matrix._build_rates() doesn't work for nonsynonymous 2 TV change, unrestricted matrix."))
 
 
 
@@ -303,7 +313,7 @@ class matrixBuilder_ECM_Matrix_tests(unittest.TestCase):
 class matrixBuilder_AminoAcid_Matrix_tests(unittest.TestCase):
     ''' 
         Set of unittests for the matrix_builder.AminoAcid_Matrix subclass of matrixBuilder, which deals with empirical amino acid models.
-        Functions tested here include initEmpiricalMatrix, _calc_instantaneous_prob.
+        Functions tested here include initEmpiricalMatrix, _build_rates.
         We are going to just test everything with the LG matrix.
     '''
     
@@ -322,11 +332,11 @@ class matrixBuilder_AminoAcid_Matrix_tests(unittest.TestCase):
         np.testing.assert_array_almost_equal(aaMatrix.emp_matrix, self.lg_mat, decimal = DECIMAL, err_msg = "matrix_builder.AminoAcid_Matrix.initEmpiricalMatrix doesn't return empirical matrix properly.")
 
         
-    def test_AminoAcid_Matrix_calc_instantaneous_prob(self):
-        ''' Test _calc_instantaneous_prob function for amino acid class. '''
+    def test_AminoAcid_Matrix_build_rates(self):
+        ''' Test _build_rates function for amino acid class. '''
         aaMatrix = matrix_builder.AminoAcid_Matrix("lg", self.params)
         correctProb = 3.499e-03 * 0.03385361
-        self.assertEqual(aaMatrix._calc_instantaneous_prob(1, 3, aaMatrix.params), correctProb, msg = "matrix_builder.AminoAcid_Matrix._calc_instantaneous_prob fail.")
+        self.assertEqual(aaMatrix._build_rates(aaMatrix.params)[1][3], correctProb, msg = "matrix_builder.AminoAcid_Matrix._build_rates fail.")
 
 
 
@@ -341,7 +351,7 @@ class matrixBuilder_AminoAcid_Matrix_tests(unittest.TestCase):
 class matrixBuilder_Nucleotide_Matrix_tests(unittest.TestCase):
     ''' 
         Set of unittests for the matrix_builder.Nucleotide_Matrix subclass of matrixBuilder.
-        Functions tested here include getNucleotideFreq, _calc_instantaneous_prob.
+        Functions tested here include _build_rates.
     '''
     
     def setUp(self):
@@ -352,14 +362,14 @@ class matrixBuilder_Nucleotide_Matrix_tests(unittest.TestCase):
         ############################################################################
 
    
-    def test_Nucleotide_Matrix_calc_instantaneous_prob(self):
+    def test_Nucleotide_Matrix_build_rates(self):
         ''' Test function to retrieve instantaneous substitution probability between nucleotides. Just test a few. '''
         correctAT = 0.18 * 0.05
-        self.assertEqual(self.nucMatrix._calc_instantaneous_prob(0, 3, self.nucMatrix.params), correctAT, msg = "nucleotideMatrix._calc_instantaneous_prob doesn't properly work for A->T.")
+        self.assertEqual(self.nucMatrix._build_rates(self.nucMatrix.params)[0][3], correctAT, msg = "nucleotideMatrix._build_rates doesn't properly work for A->T.")
         correctTA = 0.34 * 0.05
-        self.assertEqual(self.nucMatrix._calc_instantaneous_prob(3, 0, self.nucMatrix.params), correctTA, msg = "nucleotideMatrix._calc_instantaneous_prob doesn't properly work for T->A.")
+        self.assertEqual(self.nucMatrix._build_rates(self.nucMatrix.params)[3][0], correctTA, msg = "nucleotideMatrix._build_rates doesn't properly work for T->A.")
         correctCA = 0.34 * 0.08
-        self.assertEqual(self.nucMatrix._calc_instantaneous_prob(1, 0, self.nucMatrix.params), correctCA, msg = "nucleotideMatrix._calc_instantaneous_prob doesn't properly work for C->A.")
+        self.assertEqual(self.nucMatrix._build_rates(self.nucMatrix.params)[1][0], correctCA, msg = "nucleotideMatrix._build_rates doesn't properly work for C->A.")
 
 
 
@@ -387,8 +397,8 @@ class matrixBuilder_MutSel_nuc_tests(unittest.TestCase):
         self.assertTrue(self.mutSelMatrix._code == MOLECULES.nucleotides, msg = "nucleotides not correctly assigned as code for nuc mutsel model.")
 
         
-    def test_MutSel_Matrix_nuc_calc_substitution_prob(self):    
-        self.assertTrue( abs(self.mutSelMatrix._calc_instantaneous_prob(0, 1, self.mutSelMatrix.params) - 0.108317257) < ZERO, msg = "matrix_builder.MutSel_Matrix._calc_substitution_prob fails when target and source have different frequencies. NUCLEOTIDES.")
+    def test_MutSel_Matrix_nuc_build_rates(self):    
+        self.assertTrue( abs(self.mutSelMatrix._build_rates(self.mutSelMatrix.params)[0][1] - 0.108317257) < ZERO, msg = "matrix_builder.MutSel_Matrix._build_rates fails when target and source have different frequencies. NUCLEOTIDES.")
 
 
     def test_MutSel_Matrix_nuc_obtain_scaling_factor(self):
@@ -431,23 +441,23 @@ class matrixBuilder_mutSel_codon_statefreqs_tests(unittest.TestCase):
         self.assertTrue( abs(truefactor - testfactor) <= ZERO, msg = "Could not compute proper scaling factor for codon mutsel matrix made with state frequencies.")
 
 
-    def test_MutSel_Matrix_codon_calc_instantaneous_prob(self):    
-        ''' Test function _calc_instantaneous_prob for mutation-selection model subclass.
+    def test_MutSel_Matrix_codon_build_rates(self):    
+        ''' Test function _build_rates for mutation-selection model subclass.
             Test for one or both have freq 0, have equal freq, have no changes, have multiple changes, and finally, have different freq.
         '''
 
         # Target and/or source have 0 or equal frequency should return 0.
-        self.assertTrue( abs(self.mutSelMatrix._calc_instantaneous_prob(0, 3, self.mutSelMatrix.params) - 0.) < ZERO, msg = "matrix_builder.MutSel_Matrix._calc_instantaneous_prob wrong when both codons have 0 frequency, state_freqs approach.")
-        self.assertTrue( abs(self.mutSelMatrix._calc_instantaneous_prob(0, 4, self.mutSelMatrix.params) - 0.) < ZERO, msg = "matrix_builder.MutSel_Matrix._calc_instantaneous_prob wrong when source codon only has 0 frequency, state_freqs approach.")
-        self.assertTrue( abs(self.mutSelMatrix._calc_instantaneous_prob(7, 3, self.mutSelMatrix.params) - 0.) < ZERO, msg = "matrix_builder.MutSel_Matrix._calc_instantaneous_prob wrong when target codon only has 0 frequency, state_freqs approach.")
+        self.assertTrue( abs(self.mutSelMatrix._build_rates(self.mutSelMatrix.params)[0][3] - 0.) < ZERO, msg = "matrix_builder.MutSel_Matrix._build_rates wrong when both codons have 0 frequency, state_freqs approach.")
+        self.assertTrue( abs(self.mutSelMatrix._build_rates(self.mutSelMatrix.params)[0][4] - 0.) < ZERO, msg = "matrix_builder.MutSel_Matrix._build_rates wrong when source codon only has 0 frequency, state_freqs approach.")
+        self.assertTrue( abs(self.mutSelMatrix._build_rates(self.mutSelMatrix.params)[7][3] - 0.) < ZERO, msg = "matrix_builder.MutSel_Matrix._build_rates wrong when target codon only has 0 frequency, state_freqs approach.")
         
         # Too few or too many changes
-        self.assertTrue( abs(self.mutSelMatrix._calc_instantaneous_prob(6, 6, self.mutSelMatrix.params) - 0.) < ZERO, msg = "matrix_builder.MutSel_Matrix._calc_instantaneous_prob wrong when source and target are the same, state_freqs approach.")
-        self.assertTrue( abs(self.mutSelMatrix._calc_instantaneous_prob(6, 53, self.mutSelMatrix.params) - 0.) < ZERO, msg = "matrix_builder.MutSel_Matrix._calc_instantaneous_prob wrong when two changes between codon, state_freqs approachs.")
-        self.assertTrue( abs(self.mutSelMatrix._calc_instantaneous_prob(0, 60, self.mutSelMatrix.params) - 0.) < ZERO, msg = "matrix_builder.MutSel_Matrix._calc_instantaneous_prob wrong when three changes between codons, state_freqs approach.")
+        self.assertTrue( abs(self.mutSelMatrix._build_rates(self.mutSelMatrix.params)[6][6] - 0.) < ZERO, msg = "matrix_builder.MutSel_Matrix._build_rates wrong when source and target are the same, state_freqs approach.")
+        self.assertTrue( abs(self.mutSelMatrix._build_rates(self.mutSelMatrix.params)[6][53] - 0.) < ZERO, msg = "matrix_builder.MutSel_Matrix._build_rates wrong when two changes between codon, state_freqs approachs.")
+        self.assertTrue( abs(self.mutSelMatrix._build_rates(self.mutSelMatrix.params)[0][60] - 0.) < ZERO, msg = "matrix_builder.MutSel_Matrix._build_rates wrong when three changes between codons, state_freqs approach.")
         
         # Different frequencies.
-        self.assertTrue( abs(self.mutSelMatrix._calc_instantaneous_prob(56, 55, self.mutSelMatrix.params) - 0.0673146677) < ZERO, msg = "matrix_builder.MutSel_Matrix._calc_instantaneous_prob wrong when codons have different frequency, state_freqs approach.")
+        self.assertTrue( abs(self.mutSelMatrix._build_rates(self.mutSelMatrix.params)[56][55] - 0.0673146677) < ZERO, msg = "matrix_builder.MutSel_Matrix._build_rates wrong when codons have different frequency, state_freqs approach.")
 
 
 
@@ -465,17 +475,58 @@ class matrixBuilder_MutSel_codon_fitness_tests(unittest.TestCase):
         ############################################################################
 
 
-    def test_MutSel_Matrix_codon_calc_instantaneous_prob(self):    
+    def test_MutSel_Matrix_codon_build_rates(self):    
         ''' 
-            Test function _calc_instantaneous_prob for mutation-selection model subclass, with fitness input.
+            Test function _build_rates for mutation-selection model subclass, with fitness input.
         '''
         
         
         # Equal fitness.
-        self.assertTrue( abs(self.mutSelMatrix._calc_instantaneous_prob(6, 7, self.mutSelMatrix.params) - 0.1) < ZERO, msg = "matrix_builder.MutSel_Matrix._calc_instantaneous_prob wrong when codons have same fitness.")
+        self.assertTrue( abs(self.mutSelMatrix._build_rates(self.mutSelMatrix.params)[6][7] - 0.1) < ZERO, msg = "matrix_builder.MutSel_Matrix._build_rates wrong when codons have same fitness.")
 
         # Different fitness.
-        self.assertTrue( abs(self.mutSelMatrix._calc_instantaneous_prob(0, 1, self.mutSelMatrix.params) - 0.1020277113) < ZERO, msg = "matrix_builder.MutSel_Matrix._calc_instantaneous_prob wrong when codons have different fitness.")
+        self.assertTrue( abs(self.mutSelMatrix._build_rates(self.mutSelMatrix.params)[0][1] - 0.1020277113) < ZERO, msg = "matrix_builder.MutSel_Matrix._build_rates wrong when codons have different fitness.")
+
+
+
+
+class matrixBuilder_build_rates_tests(unittest.TestCase):
+    ''' 
+        Set of unittests for the vectorized _build_rates functions of MatrixBuilder subclasses: every matrix is a valid rate matrix, and codon models allow only the instantaneous changes they specify.
+    '''
+    def setUp(self):
+        rng = np.random.RandomState(11)
+        self.codon_freqs = rng.dirichlet(np.ones(61))
+        self.nuc_freqs = rng.dirichlet(np.ones(4))
+        self.mu = {'AG':1.1, 'GA':0.9, 'CT':2.1, 'TC':1.8, 'AC': 0.4, 'CA':0.6, 'AT':0.7, 'TA':0.3, 'CG':0.5, 'GC':0.8, 'GT':1.3, 'TG':1.2}
+        self.fitness = rng.normal(size = 61)
+
+
+    def check_rates(self, builder, allowed = None):
+        rates = builder._build_rates(builder.params)
+        off_diagonal = ~np.eye(builder._size, dtype = bool)
+        self.assertEqual(rates.shape, (builder._size, builder._size), msg = "Rates have the wrong shape for " + builder.model_type + ".")
+        self.assertTrue( np.all(rates[off_diagonal] >= 0.), msg = "Negative rates for " + builder.model_type + ".")
+        if allowed is not None:
+            self.assertTrue( np.all(rates[off_diagonal & ~allowed] == 0.) and np.all(rates[off_diagonal & allowed] > 0.), msg = "Rates of disallowed changes are not 0 for " + builder.model_type + ".")
+        matrix = builder._build_matrix(builder.params)
+        self.assertTrue( np.all(np.abs(np.sum(matrix, axis = 1)) < ZERO), msg = "Rows do not sum to 0 for " + builder.model_type + ".")
+
+
+    def test_build_rates(self):
+        ''' 
+            Test vectorized rates for every subclass.
+        '''
+        single = MOLECULES.codon_num_diff == 1
+        self.check_rates( matrix_builder.Nucleotide_Matrix("nucleotide", {'state_freqs': self.nuc_freqs, 'mu': self.mu}) )
+        self.check_rates( matrix_builder.AminoAcid_Matrix("wag", {'state_freqs': self.codon_freqs[:20] / np.sum(self.codon_freqs[:20])}) )
+        self.check_rates( matrix_builder.MechCodon_Matrix("gy", {'state_freqs': self.codon_freqs, 'mu': self.mu, 'alpha': 1.2, 'beta': 0.4}), single )
+        self.check_rates( matrix_builder.MechCodon_Matrix("mg", {'state_freqs': self.codon_freqs, 'nuc_freqs': self.nuc_freqs, 'mu': self.mu, 'alpha': 1.2, 'beta': 0.4}), single )
+        self.check_rates( matrix_builder.MutSel_Matrix("mutsel", {'state_freqs': self.codon_freqs, 'mu': self.mu, 'calc_by_freqs': True}), single )
+        self.check_rates( matrix_builder.MutSel_Matrix("mutsel", {'fitness': self.fitness, 'mu': self.mu, 'calc_by_freqs': False}), single )
+        self.check_rates( matrix_builder.MutSel_Matrix("mutsel", {'state_freqs': self.nuc_freqs, 'mu': self.mu, 'calc_by_freqs': True}) )
+        self.check_rates( matrix_builder.ECM_Matrix("ecmrest", {'state_freqs': self.codon_freqs, 'alpha': 1., 'beta': 0.6, 'k_ti': 1.5, 'k_tv': 0.8}) )
+        self.check_rates( matrix_builder.ECM_Matrix("ecmunrest", {'state_freqs': self.codon_freqs, 'alpha': 1., 'beta': 0.6, 'k_ti': 1.5, 'k_tv': 0.8}) )
 
 
 
@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    Test model_registry module.
+'''
+
+import unittest
+from pyvolve import *
+import numpy as np
+DECIMAL = 8
+
+
+class model_registry_tests(unittest.TestCase):
+    '''
+        Tests for the ModelRegistry class.
+    '''
+
+    def test_model_registry_shared(self):
+        '''
+            Identical requests share one read-only matrix, frequencies, and decompositions, with their own names?
+        '''
+        registry = ModelRegistry()
+        params = {"omega": 0.5}
+        model1 = registry("GY94", params, name = "m1")
+        model2 = registry("codon", {"beta": 0.5}, name = "m2")
+        self.assertEqual(params, {"omega": 0.5}, msg = "Registry modified the provided parameters.")
+        self.assertTrue(model1.matrix is model2.matrix and model1.params["state_freqs"] is model2.params["state_freqs"], msg = "Identical models not shared.")
+        self.assertTrue(registry.hits == 1 and registry.misses == 1, msg = "Registry hits and misses improperly counted.")
+        self.assertEqual([model1.name, model2.name], ["m1", "m2"], msg = "Registered models do not have their own names.")
+        self.assertFalse(model1.matrix.flags.writeable, msg = "Registered matrix is writeable.")
+        np.testing.assert_array_almost_equal(model1.matrix, Model("gy", {"omega": 0.5}).matrix, decimal = DECIMAL, err_msg = "Registered matrix is incorrect.")
+        model1.transition_matrix(0.1)
+        self.assertEqual(len(model2._eigensystems), 1, msg = "Eigendecomposition not shared.")
+
+
+    def test_model_registry_distinct(self):
+        '''
+            Requests differing in parameters, rate heterogeneity, or scaling are not shared?
+        '''
+        registry = ModelRegistry()
+        base = registry("gy", {"omega": 0.5})
+        self.assertFalse(registry("gy", {"omega": 0.6}).matrix is base.matrix, msg = "Models with different parameters shared.")
+        self.assertFalse(registry("gy", {"omega": 0.5}, neutral_scaling = True).matrix is base.matrix, msg = "Models with different scaling shared.")
+        self.assertEqual(registry("nucleotide", rate_factors = [0.5, 1.5]).num_classes(), 2, msg = "Models with different rate factors shared.")
+        self.assertEqual(registry("nucleotide").num_classes(), 1, msg = "Models with different rate factors shared.")
+        self.assertEqual(len(registry), 5, msg = "Distinct models not all registered.")
+
+
+    def test_model_registry_eviction(self):
+        '''
+            Least recently used models evicted once the memory budget is exceeded?
+        '''
+        registry = ModelRegistry()
+        registry("gy", {"omega": 0.1})
+        nbytes = registry.stats()["bytes"]
+        registry.resize(2 * nbytes)
+        registry("gy", {"omega": 0.2})
+        registry("gy", {"omega": 0.1})
+        registry("gy", {"omega": 0.3})
+        self.assertTrue(len(registry) == 2 and registry.evictions == 1, msg = "Registry did not evict to remain within its budget.")
+        registry("gy", {"omega": 0.1})
+        self.assertEqual(registry.hits, 2, msg = "Recently used model was evicted.")
+
@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com)
+##############################################################################
+
+'''
+    Test model_stack module.
+'''
+
+import unittest
+from pyvolve import *
+import numpy as np
+DECIMAL = 8
+
+
+class model_stack_tests(unittest.TestCase):
+    '''
+        Tests for the ModelStack class.
+    '''
+
+    def setUp(self):
+        self.mu = {"AC": 1.5, "AG": 2.5, "CT": 0.5}
+        self.fitness = np.random.default_rng(1).normal(size = (5, 20))
+
+
+    def test_model_stack_fitness(self):
+        '''
+            Stacked matrices and frequencies, from amino-acid fitness values, match those of individual models?
+        '''
+        stack = ModelStack("mutsel", {"fitness": self.fitness, "mu": dict(self.mu)})
+        self.assertEqual(stack.matrix.shape, (5, 61, 61), msg = "Stack of matrices has the wrong shape.")
+        self.assertEqual(stack.code, Genetics().codons, msg = "Stack has the wrong code.")
+        for i in range(5):
+            model = Model("mutsel", {"fitness": self.fitness[i], "mu": dict(self.mu)})
+            np.testing.assert_array_almost_equal(stack.matrix[i], model.matrix, decimal = DECIMAL, err_msg = "Stacked matrix is incorrect.")
+            np.testing.assert_array_almost_equal(stack.params["state_freqs"][i], model.params["state_freqs"], decimal = DECIMAL, err_msg = "Stacked state frequencies are incorrect.")
+
+
+    def test_model_stack_state_freqs(self):
+        '''
+            Stacked matrices, from nucleotide state frequencies, match those of individual models?
+        '''
+        freqs = np.array([[0.1, 0.2, 0.3, 0.4], [0.25, 0.25, 0.25, 0.25], [0.7, 0.1, 0.1, 0.1]])
+        stack = ModelStack("mutsel", {"state_freqs": freqs, "mu": dict(self.mu)})
+        self.assertEqual(len(stack), 3, msg = "Stack has the wrong number of models.")
+        for i in range(3):
+            np.testing.assert_array_almost_equal(stack.matrix[i], Model("mutsel", {"state_freqs": freqs[i], "mu": dict(self.mu)}).matrix, decimal = DECIMAL, err_msg = "Stacked matrix is incorrect.")
+
+
+    def test_model_stack_sanity(self):
+        '''
+            Unsupported model types, and site-specific values not given per model, rejected?
+        '''
+        with self.assertRaises(AssertionError):
+            ModelStack("gy", {"omega": 0.5})
+        with self.assertRaises(AssertionError):
+            ModelStack("mutsel", {"fitness": self.fitness[0]})
+        with self.assertRaises(AssertionError):
+            ModelStack("mutsel", {"state_freqs": [[0.1, 0.1, 0.1, 0.1]]})
+
+
+    def test_model_stack_transition_matrix(self):
+        '''
+            Stacked transition matrices match those of individual models?
+        '''
+        stack = ModelStack("mutsel", {"fitness": self.fitness, "mu": dict(self.mu)})
+        P = stack.transition_matrix(0.3)
+        self.assertEqual(P.shape, (5, 61, 61), msg = "Stack of transition matrices has the wrong shape.")
+        for i in range(5):
+            model = Model("mutsel", {"fitness": self.fitness[i], "mu": dict(self.mu)})
+            np.testing.assert_array_almost_equal(P[i], model.transition_matrix(0.3), decimal = DECIMAL, err_msg = "Stacked transition matrix is incorrect.")
+        self.assertEqual(stack.fingerprint(), ModelStack("mutsel", {"fitness": self.fitness, "mu": dict(self.mu)}).fingerprint(), msg = "Identical stacks have different fingerprints.")
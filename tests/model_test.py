@@ -15,6 +15,7 @@ import unittest
 import os
 from pyvolve import *
 import numpy as np
+from scipy import linalg
 ZERO    = 1e-8
 DECIMAL = 8
 
@@ -523,6 +524,52 @@ class model_hetcodonmodel_tests(unittest.TestCase):
         self.assertTrue(model.is_hetcodon_model() == False, msg = "Homogeneous codon model incorrectly identified as heterogeneous.")
         
     
+
+
+
+class model_transition_matrix_tests(unittest.TestCase):
+    ''' 
+        Tests for computing transition matrices from a Model's eigendecomposition.
+    '''
+
+    def tearDown(self):
+        try:
+            os.remove("custom_matrix_frequencies.txt")   
+        except:
+            pass
+
+
+    def _compare_expm(self, model, msg):
+        for i in range(model.num_classes()):
+            if model.is_hetcodon_model():
+                Q = model.matrix[i]
+            else:
+                Q = model.matrix * model.rate_factors[i]
+            for t in [0.01, 0.5, 2.]:
+                np.testing.assert_array_almost_equal(model.transition_matrix(t, i), linalg.expm(Q * t), decimal = DECIMAL, err_msg = msg)
+
+
+    def test_transition_matrix_nucleotide_gamma(self):
+        '''
+            Transition matrices correct for a nucleotide model with gamma rate heterogeneity?
+        '''
+        self._compare_expm( Model("nucleotide", alpha = 0.5), "Incorrect transition matrices for nucleotide model with rate heterogeneity.")
+
+
+    def test_transition_matrix_hetcodon(self):
+        '''
+            Transition matrices correct for a heterogeneous codon model?
+        '''
+        self._compare_expm( Model("gy", {"omega":[0.1, 1.5]}), "Incorrect transition matrices for heterogeneous codon model.")
+
+
+    def test_transition_matrix_custom_nonreversible(self):
+        '''
+            Transition matrices correct for a nonreversible custom model (general eigendecomposition)?
+        '''
+        matrix = np.array([ [-1., 1., 0.], [0., -1., 1.], [1., 0., -1.] ])
+        self._compare_expm( Model("custom", {"matrix":matrix, "code":["0", "1", "2"]}), "Incorrect transition matrices for nonreversible custom model.")
+
         
 # def run_models_test():
 #        
@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com) 
+##############################################################################
+
+'''
+    Test parallel module.
+'''
+
+import unittest
+import os
+from pyvolve import *
+import numpy as np
+ZERO    = 1e-8
+DECIMAL = 8
+
+
+class replicate_farm_tests(unittest.TestCase):
+    ''' 
+        Tests for the ReplicateFarm class.
+    '''
+
+    def setUp(self):
+        self.tree = read_tree( tree = "(((t2:0.36,t1:0.45):0.001,t3:0.77):0.44,(t5:0.77,t4:0.41):0.89);" )
+        m1 = Model("nucleotide", rate_factors = [2.0783848 ,  0.89073634,  0.05938242], rate_probs = [0.33, 0.33, 0.34])
+        self.partitions = [Partition(models = m1, size = 12), Partition(models = Model("nucleotide"), size = 10)]
+
+
+    def test_replicate_farm_shape(self):
+        '''
+            ReplicateFarm returns the right number of replicates, and records seeds?
+        '''
+        farm = ReplicateFarm(tree = self.tree, partitions = self.partitions, workers = 1, seed = 11)
+        reps = farm(5)
+        self.assertTrue(reps.states.shape == (5, 5, 22), msg = "ReplicateFarm replicate states have the wrong shape.")
+        self.assertTrue(len(reps.seeds) == 5, msg = "ReplicateFarm did not record a seed for each replicate.")
+
+
+    def test_replicate_farm_worker_independent(self):
+        '''
+            ReplicateFarm output is identical regardless of the number of workers?
+        '''
+        reps1 = ReplicateFarm(tree = self.tree, partitions = self.partitions, workers = 1, seed = 11)(6)
+        reps2 = ReplicateFarm(tree = self.tree, partitions = self.partitions, workers = 2, seed = 11)(6)
+        np.testing.assert_array_equal(reps1.states, reps2.states, err_msg = "ReplicateFarm output depends on the number of workers.")
+        np.testing.assert_array_equal(reps1.site_rates, reps2.site_rates, err_msg = "ReplicateFarm site rates depend on the number of workers.")
+
+
+    def test_replicate_farm_seed_reproduces(self):
+        '''
+            A recorded seed reproduces its replicate with a plain Evolver?
+        '''
+        reps = ReplicateFarm(tree = self.tree, partitions = self.partitions, workers = 1, seed = 11)(3)
+        evolve = Evolver(tree = self.tree, partitions = self.partitions)
+        evolve(seed = reps.seeds[2], seqfile = False, ratefile = False, infofile = False)
+        self.assertTrue(evolve.get_sequences() == reps[2], msg = "Recorded seed does not reproduce its replicate.")
+
+
+    def test_replicate_farm_no_ancestors(self):
+        '''
+            ReplicateFarm runs when no ancestors are kept, with the same tips as a serial run?
+        '''
+        reps = ReplicateFarm(tree = self.tree, partitions = self.partitions, workers = 2, seed = 11, ancestors = False)(3)
+        self.assertTrue(reps.ancestral_states.shape == (3, 0, 22) and reps.ancestors == [], msg = "ReplicateFarm kept ancestors with ancestors = False.")
+        serial = ReplicateFarm(tree = self.tree, partitions = self.partitions, workers = 1, seed = 11)(3)
+        self.assertEqual(reps.taxa, serial.taxa, msg = "ReplicateFarm tips ordered differently with ancestors = False.")
+        np.testing.assert_array_equal(reps.states, serial.states, err_msg = "ReplicateFarm tips differ with ancestors = False.")
+
+
+    def test_replicate_farm_files(self):
+        '''
+            Files written for each replicate when requested?
+        '''
+        farm = ReplicateFarm(tree = self.tree, partitions = self.partitions, workers = 2, seed = 11)
+        farm(2, ratefile = "rates.txt")
+        for r in [1, 2]:
+            self.assertTrue(os.path.exists("rates_" + str(r) + ".txt"), msg = "Ratefile not written for replicate " + str(r) + ".")
+            os.remove("rates_" + str(r) + ".txt")
+
+
+
+
+class subtree_evolver_tests(unittest.TestCase):
+    ''' 
+        Tests for the SubtreeEvolver class.
+    '''
+
+    def setUp(self):
+        self.tree = read_tree( tree = "((((t1:0.1,t2:0.2):0.3,(t3:0.4,t4:0.1):0.2):0.1,(t5:0.3,t6:0.2):0.4):0.2,((t7:0.1,t8:0.5):0.2,(t9:0.3,(t10:0.2,t11:0.1):0.3):0.1):0.3);" )
+        m1 = Model("nucleotide", rate_factors = [2.0783848 ,  0.89073634,  0.05938242], rate_probs = [0.33, 0.33, 0.34])
+        self.partitions = [Partition(models = m1, size = 12), Partition(models = Model("nucleotide"), size = 10)]
+
+
+    def test_subtree_evolver_workers(self):
+        '''
+            Subtrees evolved in worker processes give the same result as subtrees evolved in turn?
+        '''
+        reps1 = SubtreeEvolver(tree = self.tree, partitions = self.partitions, workers = 1, subtrees = 4, seed = 5)(replicates = 3)
+        reps2 = SubtreeEvolver(tree = self.tree, partitions = self.partitions, workers = 2, subtrees = 4, seed = 5)(replicates = 3)
+        self.assertTrue(reps1.taxa == ["t" + str(i) for i in range(1, 12)], msg = "SubtreeEvolver did not gather tips in tree order.")
+        self.assertTrue(reps1.ancestors == [], msg = "SubtreeEvolver gathered ancestral sequences which were not requested.")
+        np.testing.assert_array_equal(reps1.states, reps2.states, err_msg = "SubtreeEvolver results depend on the number of workers.")
+
+
+    def test_subtree_evolver_ancestors(self):
+        '''
+            Requested ancestral sequences are gathered from the subtrees?
+        '''
+        evolve = SubtreeEvolver(tree = self.tree, partitions = self.partitions, workers = 1, subtrees = 3, ancestors = True)
+        evolve(seqfile = None, ratefile = None, infofile = None)
+        seqs = evolve.get_sequences(anc = True)
+        self.assertTrue(len(seqs) == 21, msg = "SubtreeEvolver did not gather all ancestral sequences.")
+        self.assertTrue(all([len(seqs[name]) == 22 for name in seqs]), msg = "SubtreeEvolver gathered sequences of the wrong length.")
@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com) 
+##############################################################################
+
+'''
+    Test replicates module.
+'''
+
+import unittest
+import os
+import shutil
+import tempfile
+from pyvolve import *
+import numpy as np
+
+
+class replicate_store_tests(unittest.TestCase):
+    ''' 
+        Tests for the ReplicateStore class.
+    '''
+
+    def setUp(self):
+        self.tree = read_tree( tree = "(((t2:0.36,t1:0.45):0.001,t3:0.77):0.44,(t5:0.77,t4:0.41):0.89);" )
+        m1 = Model("nucleotide", rate_factors = [2.0783848 ,  0.89073634,  0.05938242], rate_probs = [0.33, 0.33, 0.34])
+        self.partitions = [Partition(models = m1, size = 12), Partition(models = Model("nucleotide"), size = 10)]
+        self.path = os.path.join(tempfile.mkdtemp(), "store")
+
+
+    def tearDown(self):
+        shutil.rmtree( os.path.dirname(self.path) )
+
+
+    def test_replicate_store_append(self):
+        '''
+            Replicates appended across Evolver calls, and read back in constant time?
+        '''
+        store = ReplicateStore(self.path)
+        evolve = Evolver(tree = self.tree, partitions = self.partitions)
+        reps1 = evolve(replicates = 3, store = store)
+        reps2 = evolve(replicates = 2, store = store)
+        self.assertTrue(len(store) == 5, msg = "Wrong number of replicates in store.")
+        np.testing.assert_array_equal(store[4], reps2.states[1], err_msg = "Stored replicate improperly read.")
+        np.testing.assert_array_equal(store.get_states(1, taxon = 2), reps1.states[1, 2], err_msg = "Stored tip improperly read.")
+        np.testing.assert_array_equal(store.get_site_rates(0), reps1.site_rates[0], err_msg = "Stored site rates improperly read.")
+        self.assertTrue(store.get_sequences(3) == reps2[0], msg = "Stored sequences improperly converted.")
+
+
+    def test_replicate_store_reader(self):
+        '''
+            A reader sees replicates appended after it was opened?
+        '''
+        store = ReplicateStore(self.path)
+        evolve = Evolver(tree = self.tree, partitions = self.partitions)
+        evolve(replicates = 2, store = store)
+        reader = ReplicateStore(self.path, mode = "r")
+        self.assertTrue(len(reader) == 2, msg = "Reader did not find stored replicates.")
+        reps = evolve(replicates = 1, store = store, seqfile = None)
+        self.assertTrue(len(reader) == 3, msg = "Reader did not see appended replicates.")
+        np.testing.assert_array_equal(reader[2], reps.states[0], err_msg = "Reader improperly read appended replicate.")
+        self.assertRaises(AssertionError, reader.append, reps.states, reps.site_rates, reps.taxa, reps.code, reps.site_partitions)
@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com) 
+##############################################################################
+
+'''
+    Test sequences module.
+'''
+
+import unittest
+from pyvolve import *
+import numpy as np
+
+
+class sequences_tests(unittest.TestCase):
+    ''' 
+        Tests for converting state arrays to sequence strings.
+    '''
+
+    def setUp(self):
+        self.states = np.array([[0, 3, 2, 1, 1]], dtype = np.uint8)
+        
+
+    def test_states_to_sequence_nucleotide(self):
+        '''
+            Nucleotide states converted with the lookup table?
+        '''
+        code = ["A", "C", "G", "T"]
+        self.assertTrue(states_to_sequence(self.states[0], code, code_table(code)) == "ATGCC", msg = "Nucleotide states improperly converted.")
+
+
+    def test_states_to_sequence_codon(self):
+        '''
+            Codon states converted with the lookup table?
+        '''
+        code = ["AAA", "AAC", "AAG", "AAT"]
+        self.assertTrue(states_to_sequence(self.states[0], code, code_table(code)) == "AAAAATAAGAACAAC", msg = "Codon states improperly converted.")
+
+
+    def test_states_to_sequence_custom(self):
+        '''
+            States of different lengths converted without a lookup table?
+        '''
+        code = ["0", "1", "10", "11"]
+        self.assertTrue(code_table(code) is None, msg = "Lookup table built for states of different lengths.")
+        self.assertTrue(states_to_sequence(self.states[0], code) == "0111011", msg = "Custom states improperly converted.")
+
+
+    def test_encode_states(self):
+        '''
+            States encoded as bytes, with or without a lookup table?
+        '''
+        code = ["A", "C", "G", "T"]
+        self.assertTrue(encode_states(self.states[0], code, code_table(code)) == b"ATGCC", msg = "Nucleotide states improperly encoded.")
+        self.assertTrue(encode_states(self.states[0], ["0", "1", "10", "11"]) == b"0111011", msg = "Custom states improperly encoded.")
+
+
+    def test_sequence_to_states(self):
+        '''
+            Sequences decoded into states, from strings and bytes, with invalid states rejected?
+        '''
+        code = ["A", "C", "G", "T"]
+        np.testing.assert_array_equal(sequence_to_states("ATGCC", code), self.states[0], err_msg = "Nucleotide sequence improperly decoded.")
+        np.testing.assert_array_equal(sequence_to_states(b"ATGCC", code), self.states[0], err_msg = "Nucleotide bytes improperly decoded.")
+        codons = ["AAA", "AAC", "AAG", "AAT"]
+        np.testing.assert_array_equal(sequence_to_states("AAAAATAAGAACAAC", codons), self.states[0], err_msg = "Codon sequence improperly decoded.")
+        np.testing.assert_array_equal(sequence_to_states("0111011", ["0", "1", "10", "11"]), [0, 1, 1, 1, 0, 1, 1], err_msg = "Custom sequence improperly decoded.")
+        self.assertRaises(ValueError, sequence_to_states, "ATGNC", code)
+        self.assertRaises(ValueError, sequence_to_states, "AAAAAGGGG", codons)
+        self.assertRaises(ValueError, sequence_to_states, "AAAAA", codons)
+
+
+    def test_lazy_sequences(self):
+        '''
+            LazySequences builds strings only on request?
+        '''
+        seqs = LazySequences({"t1": self.states, "t2": self.states[:, ::-1]}, ["A", "C", "G", "T"])
+        self.assertTrue(len(seqs) == 2 and len(seqs._built) == 0, msg = "LazySequences built strings before they were requested.")
+        self.assertTrue(seqs["t2"] == "CCGTA" and list(seqs._built.keys()) == ["t2"], msg = "LazySequences improperly built a requested string.")
+        self.assertTrue(dict(seqs) == {"t1": "ATGCC", "t2": "CCGTA"}, msg = "LazySequences improperly converted to a dictionary.")
@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com) 
+##############################################################################
+
+'''
+    Test shards module.
+'''
+
+import unittest
+import os
+import shutil
+from pyvolve import *
+import numpy as np
+
+
+class shards_tests(unittest.TestCase):
+    ''' 
+        Tests for writing replicates as one-hot tensor shards.
+    '''
+
+    def setUp(self):
+        self.path = "test_shards"
+        self.code = ["A", "C", "G", "T"]
+        self.states = np.random.default_rng(8).integers(4, size = (5, 3, 10))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors = True)
+
+
+    def test_shards_onehot(self):
+        '''
+            Replicates split into shards of one-hot tensors, with labels for every replicate?
+        '''
+        shards = TensorShardWriter(self.path, shard_size = 2)
+        shards.write(self.states[:3], ["t1", "t2", "t3"], self.code, {"kappa": 2.})
+        shards.write(self.states[3:], ["t1", "t2", "t3"], self.code, {"kappa": 4., "omega": 0.5})
+        shards.close()
+        self.assertTrue(sorted(os.listdir(self.path)) == ["shard_00000.npy", "shard_00000_labels.npz", "shard_00001.npy", "shard_00001_labels.npz", "shard_00002.npy", "shard_00002_labels.npz"], msg = "Shards improperly named.")
+        
+        onehots = []
+        for i in range(3):
+            (onehot, labels) = load_shard(os.path.join(self.path, "shard_0000" + str(i) + ".npy"))
+            self.assertTrue(isinstance(onehot, np.memmap), msg = "Shard not memory-mapped.")
+            onehots.append( np.array(onehot) )
+            del onehot
+        np.testing.assert_array_equal(np.concatenate(onehots).argmax(axis = -1), self.states, err_msg = "One-hot tensors improperly written.")
+        self.assertTrue(labels["taxa"].tolist() == ["t1", "t2", "t3"], msg = "Shard taxa improperly saved.")
+        (onehot, labels) = load_shard(os.path.join(self.path, "shard_00001.npy"), mmap = False)
+        np.testing.assert_array_equal(labels["kappa"], [2., 4.], err_msg = "Labels improperly split across shards.")
+        self.assertTrue(np.isnan(labels["omega"][0]) and labels["omega"][1] == 0.5, msg = "Missing labels not filled with NaN.")
+
+
+    def test_shards_packbits(self):
+        '''
+            Bit-packed tensors, in a single npz archive, unpack to the one-hot states?
+        '''
+        shards = TensorShardWriter(self.path, shard_size = 10, packbits = True, fmt = "npz")
+        shards.write(self.states, ["t1", "t2", "t3"], self.code)
+        shards.close()
+        (onehot, labels) = load_shard(os.path.join(self.path, "shard_00000.npz"))
+        self.assertTrue(onehot.shape == (5, 3, 10, 1), msg = "One-hot tensor improperly packed.")
+        np.testing.assert_array_equal(np.unpackbits(onehot, axis = -1, count = 4).argmax(axis = -1), self.states, err_msg = "Packed tensor improperly written.")
+        del onehot
+
+
+    def test_shards_evolver(self):
+        '''
+            Evolver adds replicates to shards, labeled with its models' parameters and the tree?
+        '''
+        tree = read_tree( tree = "((t1:0.5,t2:0.5):0.1,t3:0.7);" )
+        partitions = [Partition(models = Model("nucleotide", {"kappa": 3.}, alpha = 0.5, num_categories = 2), size = 20), Partition(models = Model("nucleotide", name = "jc"), size = 5)]
+        shards = TensorShardWriter(self.path, shard_size = 4)
+        evolve = Evolver(tree = tree, partitions = partitions)
+        reps = evolve(replicates = 3, shards = shards, tree_id = 7)
+        shards.close()
+        (onehot, labels) = load_shard(os.path.join(self.path, "shard_00000.npy"), mmap = False)
+        self.assertTrue(onehot.shape == (3, 3, 25, 4), msg = "Evolver shard has the wrong shape.")
+        np.testing.assert_array_equal(onehot.argmax(axis = -1), reps.states, err_msg = "Evolver shard does not match the replicates.")
+        self.assertTrue(list(labels["tree_id"]) == [7, 7, 7] and labels["partition1.model1.mu.AG"][0] == 3., msg = "Evolver shard improperly labeled.")
+        self.assertTrue(labels["partition1.model1.rate_factors"].shape == (3, 2) and labels["partition2.jc.state_freqs"].shape == (3, 4), msg = "Evolver shard labels have the wrong shape.")
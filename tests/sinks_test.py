@@ -0,0 +1,65 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com) 
+##############################################################################
+
+'''
+    Test sinks module.
+'''
+
+import unittest
+import os
+from pyvolve import *
+from Bio import AlignIO
+import numpy as np
+
+
+class sinks_tests(unittest.TestCase):
+    ''' 
+        Tests for output sinks given to Evolver.
+    '''
+
+    def setUp(self):
+        self.tree = read_tree( tree = "(((t2:0.36,t1:0.45):0.001,t3:0.77):0.44,(t5:0.77,t4:0.41):0.89);" )
+        m1 = Model("nucleotide", rate_factors = [2.0783848 ,  0.89073634,  0.05938242], rate_probs = [0.33, 0.33, 0.34])
+        self.partitions = [Partition(models = m1, size = 12, shuffle = True), Partition(models = Model("nucleotide"), size = 10)]
+
+
+    def test_memory_sink(self):
+        '''
+            MemorySink receives every final (shuffled) sequence?
+        '''
+        sink = MemorySink()
+        evolve = Evolver(tree = self.tree, partitions = self.partitions)
+        evolve(sinks = sink, seqfile = None, ratefile = None, infofile = None)
+        self.assertTrue(sorted(sink.leaves) == ["t1", "t2", "t3", "t4", "t5"], msg = "MemorySink did not receive all tips.")
+        self.assertTrue(sink.get_sequences() == evolve.get_sequences(anc = True), msg = "MemorySink sequences differ from final sequences.")
+
+
+    def test_fasta_sink(self):
+        '''
+            FastaSink streams tips to file, without the Evolver retaining sequences?
+        '''
+        evolve = Evolver(tree = self.tree, partitions = self.partitions)
+        evolve(sinks = [FastaSink("out.fasta")], retain = False, seqfile = None, ratefile = None, infofile = None)
+        aln = AlignIO.read("out.fasta", "fasta")
+        os.remove("out.fasta")
+        self.assertTrue(len(aln) == 5 and len(aln[0]) == 22, msg = "FastaSink improperly wrote tips.")
+        self.assertTrue(evolve.get_sequences() == {}, msg = "Sequences retained with retain = False.")
+
+
+    def test_binary_sink(self):
+        '''
+            BinarySink output read back, for replicates?
+        '''
+        sink = MemorySink()
+        evolve = Evolver(tree = self.tree, partitions = self.partitions)
+        evolve(sinks = [sink, BinarySink("out.bin")], replicates = 3)
+        (states, leaves) = read_binary_sink("out.bin")
+        os.remove("out.bin")
+        self.assertTrue(len(states) == 9 and sorted(leaves) == ["t1", "t2", "t3", "t4", "t5"], msg = "BinarySink improperly wrote nodes.")
+        for name in states:
+            np.testing.assert_array_equal(states[name], sink.states[name], err_msg = "BinarySink improperly wrote states.")
@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com) 
+##############################################################################
+
+'''
+    Test transition_cache module.
+'''
+
+import unittest
+from pyvolve import *
+import numpy as np
+ZERO    = 1e-8
+DECIMAL = 8
+
+
+class transition_cache_tests(unittest.TestCase):
+    ''' 
+        Tests for the TransitionCache class.
+    '''
+
+    def setUp(self):
+        self.model = Model("nucleotide", rate_factors = [0.5, 1.5])
+        self.tree = read_tree( tree = "(((t2:0.36,t1:0.45):0.001,t3:0.77):0.44,(t5:0.77,t4:0.41):0.89);" )
+        
+        
+    def test_transition_cache_hits_misses(self):
+        '''
+            Cached matrices reused, and counted, for a repeated model/category/branch length?
+        '''
+        cache = TransitionCache()
+        P1 = cache(self.model, 0.3, 1)
+        P2 = cache(self.model, 0.3, 1)
+        self.assertTrue(P1 is P2, msg = "Cached transition matrix not reused.")
+        self.assertTrue(cache.hits == 1 and cache.misses == 1, msg = "Cache hits and misses improperly counted.")
+        np.testing.assert_array_almost_equal(P1, self.model.transition_matrix(0.3, 1), decimal = DECIMAL, err_msg = "Cached transition matrix is incorrect.")
+
+
+    def test_transition_cache_shared_models(self):
+        '''
+            Identical models share cached matrices?
+        '''
+        cache = TransitionCache()
+        other = Model("nucleotide", rate_factors = [0.5, 1.5])
+        cache(self.model, 0.3, 0)
+        cache(other, 0.3, 0)
+        self.assertTrue(cache.hits == 1 and len(cache) == 1, msg = "Identical models do not share cached transition matrices.")
+
+
+    def test_transition_cache_eviction(self):
+        '''
+            Least recently used matrices evicted once the memory budget is exceeded?
+        '''
+        nbytes = self.model.transition_matrix(0.1).nbytes
+        cache = TransitionCache(max_bytes = 2 * nbytes)
+        cache(self.model, 0.1)
+        cache(self.model, 0.2)
+        cache(self.model, 0.1) # 0.2 is now least recently used
+        cache(self.model, 0.3)
+        self.assertTrue(len(cache) == 2 and cache.evictions == 1, msg = "Cache does not respect its memory budget.")
+        cache(self.model, 0.1)
+        self.assertTrue(cache.hits == 2, msg = "Cache did not evict the least recently used matrix.")
+        
+
+    def test_transition_cache_evolver(self):
+        '''
+            Evolver reuses cached matrices across calls?
+        '''
+        cache = TransitionCache()
+        evolve = Evolver(partitions = Partition(models = self.model, size = 20), tree = self.tree, cache = cache)
+        evolve(seqfile = False, ratefile = False, infofile = False)
+        misses = cache.misses
+        evolve(seqfile = False, ratefile = False, infofile = False)
+        self.assertTrue(cache.misses == misses, msg = "Evolver did not reuse cached transition matrices across calls.")
@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+
+##############################################################################
+##  pyvolve: Python platform for simulating evolutionary sequences.
+##
+##  Written by Stephanie J. Spielman (stephanie.spielman@gmail.com) 
+##############################################################################
+
+'''
+    Test writers module. Files written natively are read back with Biopython.
+'''
+
+import unittest
+import os
+from pyvolve import *
+from Bio import AlignIO
+import numpy as np
+
+
+class writers_tests(unittest.TestCase):
+    ''' 
+        Tests for writing alignments to file.
+    '''
+
+    def setUp(self):
+        self.names  = ["t1", "t2", "taxon_three"]
+        self.states = [np.array([0, 1, 2, 3]), np.array([3, 2, 1, 0]), np.array([0, 0, 3, 3])]
+        self.code   = ["A", "C", "G", "T"]
+        self.seqs   = ["ACGT", "TGCA", "AATT"]
+
+
+    def read_back(self, filename, seqfmt):
+        aln = AlignIO.read(filename, seqfmt)
+        os.remove(filename)
+        return [record.id for record in aln], [str(record.seq) for record in aln]
+
+
+    def test_write_fasta(self):
+        '''
+            FASTA written natively?
+        '''
+        write_alignment("out.fasta", "fasta", self.names, self.states, self.code)
+        (names, seqs) = self.read_back("out.fasta", "fasta")
+        self.assertTrue(names == self.names and seqs == self.seqs, msg = "FASTA improperly written.")
+
+
+    def test_write_phylip(self):
+        '''
+            Strict and relaxed PHYLIP written natively?
+        '''
+        write_alignment("out.phy", "phylip-relaxed", self.names, self.states, self.code)
+        (names, seqs) = self.read_back("out.phy", "phylip-relaxed")
+        self.assertTrue(names == self.names and seqs == self.seqs, msg = "Relaxed PHYLIP improperly written.")
+        
+        write_alignment("out.phy", "phylip", self.names[:2], self.states[:2], self.code)
+        (names, seqs) = self.read_back("out.phy", "phylip")
+        self.assertTrue(names == self.names[:2] and seqs == self.seqs[:2], msg = "Strict PHYLIP improperly written.")
+        self.assertRaises(AssertionError, write_alignment, "out.phy", "phylip", ["a_very_long_name"], self.states[:1], self.code)
+        os.remove("out.phy")
+
+
+    def test_write_nexus(self):
+        '''
+            NEXUS written natively, for nucleotide and codon codes?
+        '''
+        write_alignment("out.nex", "nexus", self.names, self.states, self.code)
+        (names, seqs) = self.read_back("out.nex", "nexus")
+        self.assertTrue(names == self.names and seqs == self.seqs, msg = "NEXUS improperly written.")
+        
+        write_alignment("out.nex", "nexus", self.names, self.states, ["AAA", "AAC", "AAG", "AAT"])
+        (names, seqs) = self.read_back("out.nex", "nexus")
+        self.assertTrue(seqs[1] == "AATAAGAACAAA", msg = "Codon NEXUS improperly written.")
+
+
+    def test_write_biopython(self):
+        '''
+            Other formats written with Biopython?
+        '''
+        write_alignment("out.aln", "clustal", self.names, self.states, self.code)
+        (names, seqs) = self.read_back("out.aln", "clustal")
+        self.assertTrue(names == self.names and seqs == self.seqs, msg = "Format written with Biopython improperly written.")
+
+
+    def test_write_alignment_array(self):
+        '''
+            Binary alignments reloaded, memory-mapped, in npz and npy formats?
+        '''
+        matrix = np.array(self.states, dtype = np.uint8)
+        rates = np.array([[1, 1, 1], [2, 1, 2], [3, 1, 1], [4, 1, 3]])
+        for (filename, seqfmt) in [("out.npz", "npz"), ("out.npy", "npy")]:
+            write_alignment_array(filename, seqfmt, self.names, matrix, self.code, rates)
+            (states, names, code, site_rates) = load_alignment(filename)
+            self.assertTrue(isinstance(states, np.memmap), msg = "Binary alignment not memory-mapped in " + seqfmt + " format.")
+            np.testing.assert_array_equal(states, matrix, err_msg = "Binary alignment improperly reloaded in " + seqfmt + " format.")
+            np.testing.assert_array_equal(site_rates, rates, err_msg = "Site rates improperly reloaded in " + seqfmt + " format.")
+            self.assertTrue(names == self.names and code == self.code, msg = "Names or code improperly reloaded in " + seqfmt + " format.")
+            del states
+            os.remove(filename)
+        os.remove("out_meta.npz")
+
+
+    def test_load_archive_member(self):
+        '''
+            A single array loaded from an npz archive, memory-mapped or read?
+        '''
+        matrix = np.array(self.states, dtype = np.uint8)
+        write_alignment_array("out.npz", "npz", self.names, matrix, self.code)
+        states = load_archive_member("out.npz", "states")
+        self.assertTrue(isinstance(states, np.memmap), msg = "Archive member not memory-mapped.")
+        np.testing.assert_array_equal(states, matrix, err_msg = "Memory-mapped archive member improperly loaded.")
+        del states
+        np.testing.assert_array_equal(load_archive_member("out.npz", "states", mmap = False), matrix, err_msg = "Archive member improperly read.")
+        os.remove("out.npz")
+
+
+    def test_evolver_npz(self):
+        '''
+            Evolver saves npz alignments which match its own?
+        '''
+        tree = read_tree( tree = "(((t2:0.36,t1:0.45):0.001,t3:0.77):0.44,(t5:0.77,t4:0.41):0.89);" )
+        evolve = Evolver(tree = tree, partitions = Partition(models = Model("nucleotide"), size = 30))
+        evolve(seqfile = "out.npz", seqfmt = "npz", ratefile = None, infofile = None)
+        (states, names, code, site_rates) = load_alignment("out.npz", mmap = False)
+        os.remove("out.npz")
+        (matrix, evolved_names, partitions, rates) = evolve.get_alignment_array()
+        np.testing.assert_array_equal(states, matrix, err_msg = "Evolver npz alignment improperly saved.")
+        self.assertTrue(names == evolved_names and site_rates.shape == (30, 3), msg = "Evolver npz names or site rates improperly saved.")
+
+
+    def test_write_variants(self):
+        '''
+            Sparse alignments hold only differences from the root, in variants and VCF formats?
+        '''
+        matrix = np.array(self.states, dtype = np.uint8)
+        root = np.array([0, 1, 1, 3], dtype = np.uint8)
+        write_variants("out.npz", "variants", self.names, matrix, root, self.code)
+        with np.load("out.npz") as archive:
+            self.assertTrue(list(archive["offsets"]) == [0, 1, 4, 6], msg = "Variants improperly found.")
+        (states, names, code, root_states) = load_variants("out.npz")
+        os.remove("out.npz")
+        np.testing.assert_array_equal(states, matrix, err_msg = "Sparse alignment improperly rebuilt.")
+        self.assertTrue(names == self.names and code == self.code, msg = "Names or code improperly reloaded from variants.")
+
+        write_variants("out.vcf", "vcf", self.names, matrix, root, self.code)
+        with open("out.vcf", "r") as handle:
+            records = [line.strip().split("\t") for line in handle if not line.startswith("##")]
+        os.remove("out.vcf")
+        self.assertTrue(records[0][9:] == self.names, msg = "VCF samples improperly written.")
+        self.assertTrue([r[1:5] for r in records[1:]] == [["1", ".", "A", "T"], ["2", ".", "C", "A,G"], ["3", ".", "C", "G,T"], ["4", ".", "T", "A"]], msg = "VCF alleles improperly written.")
+        self.assertTrue([r[9:] for r in records[1:]] == [["0", "1", "0"], ["0", "2", "1"], ["1", "0", "2"], ["0", "1", "0"]], msg = "VCF genotypes improperly written.")
+
+
+    def test_evolver_variants(self):
+        '''
+            Evolver saves sparse alignments, relative to its root sequence, which match its own?
+        '''
+        tree = read_tree( tree = "(((t2:0.036,t1:0.045):0.001,t3:0.077):0.044,(t5:0.077,t4:0.041):0.089);" )
+        evolve = Evolver(tree = tree, partitions = Partition(models = Model("nucleotide"), size = 40, shuffle = True))
+        evolve(seqfile = "out.npz", seqfmt = "variants", ratefile = None, infofile = None, write_anc = True)
+        (states, names, code, root) = load_variants("out.npz")
+        os.remove("out.npz")
+        (matrix, evolved_names, partitions, rates) = evolve.get_alignment_array(anc = True)
+        self.assertEqual(sorted(names), sorted(evolved_names), msg = "Evolver sparse alignment saved with the wrong sequences.")
+        np.testing.assert_array_equal(states, matrix[[evolved_names.index(name) for name in names]], err_msg = "Evolver sparse alignment improperly saved.")
+        np.testing.assert_array_equal(root, states[names.index("root")], err_msg = "Evolver sparse alignment saved with the wrong root.")
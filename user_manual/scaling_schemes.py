@@ -17,10 +17,9 @@ for dn in omegas:
     yang_seqfile = "yang.fasta"
     neutral_seqfile = "neutral.fasta"
     
-    yang_model = Model("codon", {'omega': dn})
-    yang_model.construct_model()
-    neutral_model = Model("codon", {'omega': dn}, "neutral")
-    neutral_model.construct_model()
+    # Models are built once per omega and scaling scheme, and shared by any later identical requests
+    yang_model = MODEL_REGISTRY("codon", {'omega': dn})
+    neutral_model = MODEL_REGISTRY("codon", {'omega': dn}, neutral_scaling = True)
     
     yang_partition = Partition(models = yang_model, size = 200)
     neutral_partition = Partition(models = neutral_model, size = 200)